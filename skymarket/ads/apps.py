@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, **kwargs):
+    from ads.search import ensure_sqlite_fts
+
+    ensure_sqlite_fts(using)
 
 
 class SalesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ads"
+
+    def ready(self):
+        from ads import checks, signals  # noqa: F401 регистрация system checks и сигналов
+
+        post_migrate.connect(ensure_search_index, sender=self)
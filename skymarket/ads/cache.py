@@ -0,0 +1,152 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Max
+from rest_framework.response import Response
+
+from ads.models import Ad
+from skymarket.caches import is_shared
+from skymarket.db_router import pinned_to_primary, reads_from_replica
+from skymarket.metrics import CACHE_REQUESTS
+
+# Кэш ответов списка объявлений с версионированием.
+# Ключ содержит номер поколения, поэтому для инвалидации достаточно увеличить
+# счётчик (bump_generation) - старые ключи просто перестают читаться и
+# вытесняются по TTL, сканировать и удалять их не нужно.
+# Кэш ответов работает только с общим для воркеров кэшем (skymarket/caches.py):
+# в LocMemCache каждого процесса инвалидация из другого воркера не дошла бы.
+
+KEY_PREFIX = 'ads:response'
+GENERATION_KEY = f'{KEY_PREFIX}:generation'
+# стоит REPLICA_PIN_SECONDS после инвалидации: пока реплики могут отставать,
+# прочитанные с них страницы в новое поколение не кладутся
+BUMPED_KEY = f'{KEY_PREFIX}:bumped'
+STATS_KEY = f'{KEY_PREFIX}:stats:{{}}'
+
+
+def initial_generation():
+    """
+    Начальное поколение по состоянию таблицы объявлений. Если ключ поколения
+    вытеснен, отсчёт с 1 снова открыл бы ответы, закэшированные под старыми
+    номерами; число из состояния данных с ними не совпадёт.
+    """
+    state = Ad.objects.using(DEFAULT_DB_ALIAS).aggregate(count=Count('pk'), last=Max('updated_at'))
+    raw = f"{state['count']}:{state['last'].isoformat() if state['last'] else ''}"
+    return int(hashlib.md5(raw.encode('utf-8')).hexdigest()[:15], 16)
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, initial_generation(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # ключа ещё нет (или его вытеснили)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def bump_generation():
+    if settings.DATABASE_REPLICAS:
+        cache.set(BUMPED_KEY, 1, settings.REPLICA_PIN_SECONDS)
+    get_generation()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # вытеснен между чтением и incr: следующее чтение засеет поколение заново
+        pass
+
+
+def invalidate():
+    """
+    Инвалидирует все закэшированные списки.
+
+    Поколение увеличивается сразу и ещё раз после коммита: иначе параллельный
+    запрос мог бы между ними закэшировать данные, которые ещё не видны.
+    """
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def replica_lagging():
+    """Запрос читает реплику, которая может ещё не содержать последнюю инвалидацию."""
+    return reads_from_replica() and bool(cache.get(BUMPED_KEY))
+
+
+def collection_version():
+    """
+    Поколение как версия коллекции объявлений для ETag списков: оно сдвигается
+    при каждом изменении объявлений и счётчиков комментариев и читается из кэша
+    без запроса к базе. None, если кэш не общий (поколение другого воркера не
+    видно) или страница читается с отстающей реплики.
+    """
+    if not is_shared() or replica_lagging():
+        return None
+    return get_generation()
+
+
+def record(outcome):
+    _incr(STATS_KEY.format(outcome))
+    CACHE_REQUESTS.labels('ads_list', outcome).inc()
+
+
+def stats():
+    counters = cache.get_many([STATS_KEY.format('hit'), STATS_KEY.format('miss')])
+    return {
+        'hits': counters.get(STATS_KEY.format('hit'), 0),
+        'misses': counters.get(STATS_KEY.format('miss'), 0),
+    }
+
+
+class CachedListMixin:
+    """
+    Кэширует ответ list() по нормализованным query-параметрам (фильтры,
+    сортировка, страница). TTL задаётся атрибутом `cache_timeout` и может быть
+    переопределён в settings.RESPONSE_CACHE_TIMEOUTS по имени URL; 0 отключает кэш.
+    Ответ не должен зависеть от пользователя: права проверяются до обращения к кэшу.
+    С кэшем, который не виден другим воркерам, ответы не кэшируются.
+    """
+    cache_timeout = 60
+
+    def get_cache_timeout(self):
+        url_name = self.request.resolver_match.url_name if self.request.resolver_match else None
+        timeouts = getattr(settings, 'RESPONSE_CACHE_TIMEOUTS', {})
+        return timeouts.get(url_name, self.cache_timeout)
+
+    def get_cache_key(self, request):
+        params = sorted(
+            (name, sorted(values)) for name, values in request.query_params.lists()
+        )
+        # в ответе есть абсолютные ссылки next/previous, поэтому хост тоже часть ключа
+        raw = f'{request.scheme}://{request.get_host()}{request.path}?{params}'
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        return f'{KEY_PREFIX}:{get_generation()}:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        timeout = self.get_cache_timeout()
+        # в кэше может лежать ответ, собранный по отстающей реплике, а закреплённый
+        # за основной базой пользователь должен видеть свои изменения
+        if not timeout or not is_shared() or pinned_to_primary():
+            return super().list(request, *args, **kwargs)
+
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record('miss')
+        response = super().list(request, *args, **kwargs)
+        # сразу после записи реплика может ещё не содержать её: такой ответ отдаётся, но не кэшируется
+        if response.status_code == 200 and not replica_lagging():
+            cache.set(key, response.data, timeout)
+        response['X-Cache'] = 'MISS'
+        return response
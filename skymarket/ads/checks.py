@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.checks import Error, Tags, register
+from rest_framework.views import APIView
+
+from ads.ordering import IndexedOrderingFilter
+
+
+@register(Tags.models)
+def check_ordering_indexes(app_configs, **kwargs):
+    """Каждая разрешённая сортировка должна опираться на индекс вида (..., поле, id)."""
+    from ads import views
+
+    indexes = {
+        index.name: index
+        for model in apps.get_app_config('ads').get_models()
+        for index in model._meta.indexes
+    }
+    tie_breaker = IndexedOrderingFilter.tie_breaker
+
+    errors = []
+    for view in vars(views).values():
+        if not (isinstance(view, type) and issubclass(view, APIView) and hasattr(view, 'ordering_indexes')):
+            continue
+
+        for field, index_name in view.ordering_indexes.items():
+            index = indexes.get(index_name)
+            fields = list(index.fields) if index else []
+            if field not in fields or fields[fields.index(field) + 1:][:1] != [tie_breaker]:
+                errors.append(Error(
+                    f'{view.__name__} orders by "{field}" but index "{index_name}" '
+                    f'does not cover ({field}, {tie_breaker}).',
+                    obj=view,
+                    id='ads.E001',
+                ))
+    return errors
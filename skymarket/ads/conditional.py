@@ -0,0 +1,85 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalRetrieveMixin:
+    """
+    Поддержка ETag / Last-Modified для retrieve().
+
+    Вьюха реализует `get_last_modified()`, который одним запросом читает
+    только колонку updated_at. Если клиент прислал совпадающий If-None-Match
+    или If-Modified-Since, сразу возвращается 304 без загрузки объекта и
+    сериализации.
+    """
+
+    def get_last_modified(self):
+        raise NotImplementedError
+
+    def get_etag(self, last_modified):
+        # JSON и MessagePack - разные представления, у них разные ETag
+        raw = f'{self.request.path}:{self.request.accepted_media_type}:{last_modified.isoformat()}'
+        return quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        etag = self.get_etag(last_modified)
+        timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class ConditionalListMixin:
+    """
+    ETag для list(): отпечаток коллекции плюс нормализованные query-параметры.
+    Если отпечаток не изменился, возвращается 304 без выборки страницы и
+    сериализации. По умолчанию отпечаток - число строк и max(updated_at) по
+    отфильтрованному queryset (без сортировки и пагинации); вьюха может
+    переопределить get_collection_fingerprint() более дешёвым источником,
+    а None означает, что ETag не выдаётся.
+    """
+
+    def get_fingerprint_aggregates(self):
+        return {'count': Count('pk'), 'last': Max('updated_at')}
+
+    def get_collection_fingerprint(self):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        fingerprint = queryset.aggregate(**self.get_fingerprint_aggregates())
+        last = fingerprint['last'].isoformat() if fingerprint['last'] else ''
+        return f"{fingerprint['count']}:{last}"
+
+    def get_list_etag(self, request):
+        fingerprint = self.get_collection_fingerprint()
+        if fingerprint is None:
+            return None
+        params = sorted(
+            (name, sorted(values)) for name, values in request.query_params.lists()
+        )
+        raw = (
+            f'{request.scheme}://{request.get_host()}{request.path}?{params}:'
+            f'{request.accepted_media_type}:{fingerprint}'
+        )
+        return quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_list_etag(request)
+        if etag is None:
+            return super().list(request, *args, **kwargs)
+
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept',))
+        return response
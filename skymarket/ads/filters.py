@@ -1,14 +1,31 @@
 import django_filters
 from ads.models import Ad
+from ads.search import search_ads
+from users.search import users_with_email_containing
 
 
 class AdFilter(django_filters.rest_framework.FilterSet):
     title = django_filters.CharFilter(lookup_expr='icontains')
-    author__email = django_filters.CharFilter(field_name='author__email', lookup_expr='icontains')
+    author__email = django_filters.CharFilter(method='filter_author_email')
     price__gte = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     price__lte = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
     description = django_filters.CharFilter(lookup_expr='icontains')
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Ad
-        fields = ['title', 'author__email', 'price__gte', 'price__lte', 'description']
+        fields = ['title', 'author__email', 'price__gte', 'price__lte', 'description', 'search']
+
+    def filter_author_email(self, queryset, name, value):
+        # сначала по триграммному индексу находятся авторы, затем их объявления по индексу author_id
+        return queryset.filter(author__in=users_with_email_containing(value, queryset.db).values('id'))
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+
+        queryset = search_ads(queryset, value)
+        # без явного ordering выдача сортируется по релевантности
+        if self.request is not None and 'ordering' not in self.request.query_params:
+            queryset = queryset.order_by('-rank', '-id')
+        return queryset
@@ -0,0 +1,136 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ads.models import Ad, Comment
+from ads.views import AdListAPIView, AdMyListAPIView, CommentListAPIView
+
+CHECKED_TABLES = ('ads_ad', 'ads_comment')
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN for the page queries of the ad and comment list endpoints, their keyset "
+        "cursor pages and the comment list ETag aggregate, and fails if any of them falls back "
+        "to a sequential scan. "
+        "Run it against a seeded database: on small tables the planner prefers seq scans anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Refresh planner statistics (ANALYZE) before explaining.',
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+
+        sample_ad = Ad.objects.using(using).filter(author__isnull=False).order_by('-id').first()
+        sample_comment = Comment.objects.using(using).filter(ad__isnull=False).order_by('-id').first()
+        if sample_ad is None or sample_comment is None:
+            raise CommandError('Database has no ads or comments to explain against, seed it first.')
+
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                for table in CHECKED_TABLES:
+                    cursor.execute(f'ANALYZE {table}')
+
+        endpoints = [
+            ('ads_list', AdListAPIView, {}, {}),
+            ('ads_list price range', AdListAPIView, {}, {'price__gte': 100, 'price__lte': 200}),
+            ('ads_my_list', AdMyListAPIView, {}, {}),
+            ('comments', CommentListAPIView, {'ad_pk': sample_comment.ad_id}, {}),
+        ]
+        plans = [
+            (name, self.page_queryset(view_class, kwargs, query_params, sample_ad.author).using(using).explain())
+            for name, view_class, kwargs, query_params in endpoints
+        ]
+        # вторая и следующие страницы курсорной пагинации (условие по кортежу (поле, id))
+        cursors = [
+            ('ads_list cursor', AdListAPIView, {}, sample_ad),
+            ('comments cursor', CommentListAPIView, {'ad_pk': sample_comment.ad_id}, sample_comment),
+        ]
+        plans += [
+            (name, self.cursor_queryset(view_class, kwargs, sample_ad.author, row).using(using).explain())
+            for name, view_class, kwargs, row in cursors
+        ]
+        # ETag списка комментариев - агрегат по отфильтрованным строкам (ConditionalListMixin)
+        plans.append((
+            'comments fingerprint',
+            self.fingerprint_plan(CommentListAPIView, {'ad_pk': sample_comment.ad_id}, sample_ad.author, using),
+        ))
+
+        failed = []
+        for name, plan in plans:
+            scans = seq_scans(plan, connection.vendor)
+
+            self.stdout.write(f'{name}:')
+            self.stdout.write(plan)
+            if scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'  sequential scan on {", ".join(scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS('  OK'))
+
+        if failed:
+            raise CommandError(f'Sequential scans in: {", ".join(failed)}')
+
+    @staticmethod
+    def make_view(view_class, kwargs, query_params, user):
+        # запрос строится кодом самой вьюхи, чтобы проверялась реальная форма запроса
+        request = APIRequestFactory().get('/', query_params)
+        force_authenticate(request, user=user)
+
+        view = view_class()
+        view.setup(request, **kwargs)
+        view.request = view.initialize_request(request)
+        view.format_kwarg = None
+        return view
+
+    def page_queryset(self, view_class, kwargs, query_params, user):
+        view = self.make_view(view_class, kwargs, query_params, user)
+        queryset = view.filter_queryset(view.get_queryset())
+        return queryset[:view.paginator.page_size]
+
+    def cursor_queryset(self, view_class, kwargs, user, row):
+        view = self.make_view(view_class, kwargs, {}, user)
+        paginator = view.paginator.cursor_pagination_class()
+        paginator.prepare(view.get_queryset(), view.request, view)
+        # курсор на строку row, как в ссылке next
+        query_params = {paginator.cursor_query_param: paginator.cursor_token(row, reverse=False)}
+
+        view = self.make_view(view_class, kwargs, query_params, user)
+        queryset = view.filter_queryset(view.get_queryset())
+        cursor = paginator.prepare(queryset, view.request, view)
+        return paginator.get_page_queryset(queryset, cursor)
+
+    def fingerprint_plan(self, view_class, kwargs, user, using):
+        view = self.make_view(view_class, kwargs, {}, user)
+        queryset = view.filter_queryset(view.get_queryset()).order_by().using(using)
+        # aggregate() выполняет запрос сразу, поэтому EXPLAIN строится по тому же Query
+        query = queryset.query.chain()
+        query.clear_select_clause()
+        for alias, aggregate in view.get_fingerprint_aggregates().items():
+            query.add_annotation(aggregate, alias, is_summary=True)
+        return query.explain(using)
+
+
+def seq_scans(plan, vendor):
+    if vendor == 'postgresql':
+        return sorted({
+            table for table in re.findall(r'Seq Scan on (\w+)', plan) if table in CHECKED_TABLES
+        })
+
+    if vendor == 'sqlite':
+        # "SCAN ads_ad" - полный проход, "SCAN ads_ad USING INDEX ..." - проход по индексу
+        scans = set()
+        for table, rest in re.findall(r'\bSCAN (?:TABLE )?(\w+)(.*)', plan):
+            if table in CHECKED_TABLES and 'USING' not in rest:
+                scans.add(table)
+        return sorted(scans)
+
+    return []
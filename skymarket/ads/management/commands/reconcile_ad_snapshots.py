@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ads.models import Ad
+from ads.snapshots import build_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuilds Ad.snapshot in primary key batches and repairs missing, stale or mismatched snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report broken snapshots.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                ads = list(
+                    Ad.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .select_for_update().only('pk', 'snapshot', 'snapshot_version')[:batch_size]
+                )
+                if not ads:
+                    break
+                last_pk = ads[-1].pk
+
+                current = {ad.pk: ad for ad in ads}
+                broken = []
+                for pk, updated_at, snapshot in build_snapshots(Ad.objects.filter(pk__in=current)):
+                    ad = current[pk]
+                    # снимок с верной версией, но другим содержимым - след изменения без сдвига updated_at
+                    if (ad.snapshot, ad.snapshot_version) != (snapshot, updated_at):
+                        ad.snapshot = snapshot
+                        ad.snapshot_version = updated_at
+                        broken.append(ad)
+
+                if broken and not options['dry_run']:
+                    Ad.objects.bulk_update(broken, ['snapshot', 'snapshot_version'])
+
+            checked += len(ads)
+            repaired += len(broken)
+
+        action = 'broken' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} ads, {action} {repaired}'))
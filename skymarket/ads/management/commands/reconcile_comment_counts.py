@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from ads import cache
+from ads.models import Ad, Comment
+from ads.snapshots import refresh_snapshots
+
+
+class Command(BaseCommand):
+    help = "Recomputes Ad.comments_count and Ad.last_comment_at in primary key batches and repairs drifted rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted ads.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                ads = list(
+                    Ad.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .select_for_update().only('pk', 'comments_count', 'last_comment_at', 'updated_at')[:batch_size]
+                )
+                if not ads:
+                    break
+                last_pk = ads[-1].pk
+
+                actual = {
+                    row['ad']: row
+                    for row in Comment.objects.filter(ad__in=ads).order_by().values('ad')
+                    .annotate(count=Count('id'), last=Max('created_at'))
+                }
+
+                drifted, now = [], timezone.now()
+                for ad in ads:
+                    row = actual.get(ad.pk, {'count': 0, 'last': None})
+                    if (ad.comments_count, ad.last_comment_at) != (row['count'], row['last']):
+                        ad.comments_count = row['count']
+                        ad.last_comment_at = row['last']
+                        # счётчики входят в представление объявления: как и в ads/signals.py,
+                        # сдвигается updated_at, иначе ETag/Last-Modified отдали бы 304 со старыми
+                        ad.updated_at = now
+                        drifted.append(ad)
+
+                if drifted and not options['dry_run']:
+                    Ad.objects.bulk_update(drifted, ['comments_count', 'last_comment_at', 'updated_at'])
+                    refresh_snapshots(ad.pk for ad in drifted)
+                    cache.invalidate()
+
+            checked += len(ads)
+            repaired += len(drifted)
+
+        action = 'drifted' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} ads, {action} {repaired}'))
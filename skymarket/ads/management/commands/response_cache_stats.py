@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ads.cache import get_generation, stats
+
+
+class Command(BaseCommand):
+    help = "Shows hit/miss counters of the ad list response cache"
+
+    def handle(self, *args, **options):
+        counters = stats()
+        total = counters['hits'] + counters['misses']
+        ratio = counters['hits'] / total if total else 0
+        self.stdout.write(
+            f"generation={get_generation()} hits={counters['hits']} "
+            f"misses={counters['misses']} hit_ratio={ratio:.2%}"
+        )
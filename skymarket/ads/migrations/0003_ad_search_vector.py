@@ -0,0 +1,101 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+SEARCH_CONFIG = 'russian'
+BACKFILL_BATCH_SIZE = 5000
+
+POSTGRES_FORWARD_SQL = [
+    f"""
+    CREATE FUNCTION ads_ad_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER ads_ad_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON ads_ad
+    FOR EACH ROW EXECUTE PROCEDURE ads_ad_search_vector_update()
+    """,
+]
+
+POSTGRES_REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS ads_ad_search_vector_trigger ON ads_ad",
+    "DROP FUNCTION IF EXISTS ads_ad_search_vector_update()",
+]
+
+
+def run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            # на SQLite индекс FTS5 создаётся в post_migrate (ads.apps)
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+def backfill_search_vector(apps, schema_editor):
+    # триггер пересчитает search_vector для уже существующих строк; миграция не атомарная,
+    # поэтому каждая пачка коммитится сразу и не держит блокировки на всю таблицу
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(id), max(id) FROM ads_ad")
+        low, high = cursor.fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, BACKFILL_BATCH_SIZE):
+        schema_editor.execute(
+            "UPDATE ads_ad SET title = title WHERE id >= %s AND id < %s",
+            [start, start + BACKFILL_BATCH_SIZE],
+        )
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """На других базах CONCURRENTLY нет, там индекс создаётся как в обычном AddIndex."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнить внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('ads', '0002_auto_20231225_2100'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_postgres_sql(POSTGRES_FORWARD_SQL),
+            run_postgres_sql(POSTGRES_REVERSE_SQL),
+            atomic=True,
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='ad',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='ads_ad_search_vector_gin'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.6 on 2026-10-18 14:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ads', '0003_ad_search_vector'),
+    ]
+
+    operations = [
+        # сначала создаются составные индексы, и только потом удаляются заменяемые ими индексы FK
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['created_at', 'id'], name='ads_ad_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='ads_ad_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['price', 'id'], name='ads_ad_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['ad', 'created_at', 'id'], name='ads_comment_ad_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='author',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='author'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='ad',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='ads.ad', verbose_name='ad'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.6 on 2026-10-18 14:09
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_counts(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    Comment = apps.get_model('ads', 'Comment')
+
+    comments = Comment.objects.filter(ad=OuterRef('pk')).order_by().values('ad')
+    Ad.objects.update(
+        comments_count=Coalesce(Subquery(comments.annotate(count=Count('id')).values('count')), 0),
+        last_comment_at=Subquery(comments.annotate(last=Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_ad_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='comments count'),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='last comment at'),
+        ),
+        migrations.RunPython(backfill_comment_counts, migrations.RunPython.noop),
+    ]
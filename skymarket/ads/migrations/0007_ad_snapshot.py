@@ -0,0 +1,23 @@
+# Generated by Django 3.2.6 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0006_comment_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='snapshot',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ad',
+            name='snapshot_version',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.6 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Now
+
+
+def backfill_created_at(apps, schema_editor):
+    # без даты создания строки остаются только после загрузки старых фикстур
+    for name in ('Ad', 'Comment'):
+        model = apps.get_model('ads', name)
+        model.objects.filter(created_at__isnull=True).update(created_at=Coalesce('updated_at', Now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0007_ad_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ad',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
@@ -1,3 +1,5 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 from users.models import User
@@ -10,9 +12,19 @@ class Ad(models.Model):
     image = models.ImageField(upload_to='ads_images', verbose_name='image', **NULLABLE)
     price = models.DecimalField(max_digits=11, decimal_places=2, verbose_name='price', default=0.00)
     description = models.TextField(verbose_name='description', **NULLABLE)
-    author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='author', **NULLABLE)
-    created_at = models.DateTimeField(auto_now_add=True, **NULLABLE)
+    # отдельный индекс по FK не нужен: его заменяет составной индекс ads_ad_author_created_idx
+    author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='author', db_index=False, **NULLABLE)
+    # NOT NULL: поле сортировки курсорной пагинации, порядок NULL в индексах у баз разный
+    created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True, **NULLABLE)
+    # денормализованные счётчики комментариев, поддерживаются сигналами из ads/signals.py
+    comments_count = models.PositiveIntegerField(default=0, verbose_name='comments count')
+    last_comment_at = models.DateTimeField(verbose_name='last comment at', **NULLABLE)
+    # заполняется триггером БД на PostgreSQL, см. ads/search.py
+    search_vector = SearchVectorField(editable=False, **NULLABLE)
+    # готовый JSON AdSerializer и updated_at, по которому он построен (ads/snapshots.py)
+    snapshot = models.TextField(editable=False, **NULLABLE)
+    snapshot_version = models.DateTimeField(editable=False, **NULLABLE)
 
     def __str__(self):
         return self.title
@@ -20,13 +32,23 @@ class Ad(models.Model):
     class Meta:
         verbose_name = 'Ad'
         verbose_name_plural = 'Ads'
+        # индексы повторяют форму запросов списков: фильтр по равенству, затем сортировка и tie-breaker по id
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='ads_ad_created_idx'),
+            models.Index(fields=['author', 'created_at', 'id'], name='ads_ad_author_created_idx'),
+            models.Index(fields=['price', 'id'], name='ads_ad_price_idx'),
+            # на SQLite это обычный индекс, поиск там идёт через FTS5 (ads/search.py)
+            GinIndex(fields=['search_vector'], name='ads_ad_search_vector_gin'),
+        ]
 
 
 class Comment(models.Model):
     text = models.TextField(verbose_name='text', default='new comment')
     author = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name='author', **NULLABLE)
-    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, verbose_name='ad', **NULLABLE)
-    created_at = models.DateTimeField(auto_now_add=True, **NULLABLE)
+    # отдельный индекс по FK не нужен: его заменяет составной индекс ads_comment_ad_created_idx
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, verbose_name='ad', db_index=False, **NULLABLE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, **NULLABLE)
 
     def __str__(self):
         return f'{self.author}: {self.text[:10]}'
@@ -34,3 +56,6 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Comment'
         verbose_name_plural = 'Comments'
+        indexes = [
+            models.Index(fields=['ad', 'created_at', 'id'], name='ads_comment_ad_created_idx'),
+        ]
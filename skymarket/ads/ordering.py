@@ -0,0 +1,47 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class IndexedOrderingFilter(BaseFilterBackend):
+    """
+    Сортировка только по полям из `view.ordering_indexes`.
+
+    `ordering_indexes` сопоставляет каждому разрешённому полю индекс, который
+    обслуживает такую сортировку (соответствие проверяет ads.checks), а
+    `view.ordering` задаёт сортировку по умолчанию. К каждой сортировке
+    добавляется tie-breaker по id, поэтому порядок строк детерминирован.
+    Недопустимая сортировка отклоняется с 400 ещё до запроса к БД.
+    """
+    ordering_param = 'ordering'
+    tie_breaker = 'id'
+
+    def get_ordering(self, request, view):
+        ordering = request.query_params.get(self.ordering_param) or view.ordering
+        descending = ordering.startswith('-')
+        field = ordering[1:] if descending else ordering
+
+        if field not in view.ordering_indexes:
+            allowed = ', '.join(sorted(view.ordering_indexes))
+            raise ValidationError({
+                self.ordering_param: [f'Ordering by "{ordering}" is not supported. Allowed fields: {allowed}.']
+            })
+        return field, descending
+
+    def filter_queryset(self, request, queryset, view):
+        # запрос уже упорядочен предыдущим фильтром (например, по релевантности поиска)
+        if self.ordering_param not in request.query_params and queryset.query.order_by:
+            return queryset
+
+        field, descending = self.get_ordering(request, view)
+        prefix = '-' if descending else ''
+        return queryset.order_by(prefix + field, prefix + self.tie_breaker)
+
+    def get_schema_operation_parameters(self, view):
+        choices = [prefix + field for field in sorted(view.ordering_indexes) for prefix in ('', '-')]
+        return [{
+            'name': self.ordering_param,
+            'required': False,
+            'in': 'query',
+            'description': f'Which field to use when ordering the results, default "{view.ordering}".',
+            'schema': {'type': 'string', 'enum': choices},
+        }]
@@ -1,11 +1,241 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from urllib import parse
 
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import BooleanField, Expression, F, Q, Value
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-class AdPagination(PageNumberPagination):
+from ads.ordering import IndexedOrderingFilter
+
+
+class RowCompare(Expression):
+    """
+    Сравнение кортежей `(a, b) < (x, y)`. В отличие от раскрытого через OR
+    условия база использует его как границу диапазона по составному индексу
+    (a, b) и не перебирает строки перед курсором.
+    """
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, fields, operator, values):
+        super().__init__()
+        self.fields, self.operator, self.values = list(fields), operator, list(values)
+
+    def get_source_expressions(self):
+        return [*self.fields, *self.values]
+
+    def set_source_expressions(self, expressions):
+        self.fields, self.values = expressions[:len(self.fields)], expressions[len(self.fields):]
+
+    def as_sql(self, compiler, connection):
+        sides, params = [], []
+        for expressions in (self.fields, self.values):
+            parts = []
+            for expression in expressions:
+                sql, expression_params = compiler.compile(expression)
+                parts.append(sql)
+                params.extend(expression_params)
+            sides.append(f"({', '.join(parts)})")
+        return f' {self.operator} '.join(sides), params
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (поле сортировки, id).
+
+    Поле сортировки берётся из ?ordering= и проверяется по `ordering_indexes`
+    вьюхи так же, как в IndexedOrderingFilter.
+
+    Вместо COUNT(*) и OFFSET следующая страница выбирается условием
+    `(field, id) < (last_field, last_id)` (RowCompare), поэтому стоимость
+    страницы зависит только от page_size, а не от её глубины. Поля сортировки
+    должны быть NOT NULL: тогда ORDER BY совпадает с индексом (field, id).
+    """
+    page_size = 10
+    page_size_query_param = None
+    max_page_size = None
+    cursor_query_param = 'cursor'
+    ordering_filter_class = IndexedOrderingFilter
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = self.prepare(queryset, request, view)
+        results = list(self.get_page_queryset(queryset, cursor))
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.is_reverse:
+            self.page.reverse()
+
+        if self.is_reverse:
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        return self.page
+
+    def prepare(self, queryset, request, view=None):
+        """Разбирает сортировку и курсор запроса, возвращает курсор или None."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        ordering_filter = self.ordering_filter_class()
+        self.tie_breaker = ordering_filter.tie_breaker
+        self.field, self.descending = ordering_filter.get_ordering(request, view)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        self.is_reverse = bool(cursor and cursor['reverse'])
+        return cursor
+
+    def get_page_queryset(self, queryset, cursor):
+        # лишняя строка показывает, есть ли следующая страница
+        descending = self.descending != self.is_reverse
+        queryset = queryset.order_by(*self.get_ordering(descending))
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(cursor, descending))
+        return queryset[:self.page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return min(page_size, self.max_page_size or page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, descending):
+        prefix = '-' if descending else ''
+        return [prefix + self.field, prefix + self.tie_breaker]
+
+    def get_cursor_filter(self, cursor, descending):
+        field = self.model._meta.get_field(self.field)
+        value = Value(cursor['value'], output_field=field)
+        pk = Value(cursor['pk'], output_field=self.model._meta.get_field(self.tie_breaker))
+        operator, bound = ('<', 'lte') if descending else ('>', 'gte')
+        # избыточная граница по одному полю - для планировщиков, которые не разбирают сравнение кортежей
+        return Q(
+            RowCompare([F(self.field), F(self.tie_breaker)], operator, [value, pk]),
+            **{f'{self.field}__{bound}': cursor['value']}
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            value = self.model._meta.get_field(self.field).to_python(tokens['v'][0])
+            if value is None:
+                raise ValueError('Empty cursor value')
+            return {
+                'value': value,
+                'pk': int(tokens['pk'][0]),
+                'reverse': tokens.get('r', ['0'])[0] == '1',
+            }
+        except (TypeError, ValueError, KeyError, UnicodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.cursor_token(obj, reverse))
+
+    def cursor_token(self, obj, reverse):
+        # страница - экземпляры модели или словари values() (ads/values.py)
+        row = obj if isinstance(obj, dict) else obj.__dict__
+        value = row[self.field]
+        tokens = {
+            'v': value.isoformat() if hasattr(value, 'isoformat') else str(value),
+            'pk': row[self.tie_breaker],
+        }
+        if reverse:
+            tokens['r'] = '1'
+        return b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+class CursorModePaginationMixin:
+    """
+    Переключает пагинатор в keyset-режим, если клиент передал `?pagination=cursor`
+    или уже пришёл по ссылке с `?cursor=...`. Без этого остаётся обычная
+    постраничная пагинация.
+    """
+    cursor_pagination_class = None
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+
+    def is_cursor_request(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.cursor_mode
+            or self.cursor_pagination_class.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_pagination_class is not None and self.is_cursor_request(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class AdCursorPagination(KeysetPagination):
+    page_size = 4
+
+
+class CommentCursorPagination(KeysetPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+class AdPagination(CursorModePaginationMixin, PageNumberPagination):
     page_size = 4
+    cursor_pagination_class = AdCursorPagination
 
 
-class CommentPagination(PageNumberPagination):
+class CommentPagination(CursorModePaginationMixin, PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 50
+    cursor_pagination_class = CommentCursorPagination
@@ -6,7 +6,9 @@ class IsOwnerOrAdmin(BasePermission):
     message = 'you are not the owner or administrator of this post'
 
     def has_object_permission(self, request, view, obj) -> bool:
-        return obj.author == request.user or request.user.is_staff
+        # сравнение по author_id не подгружает автора, это важно для массовых операций
+        is_owner = request.user.is_authenticated and obj.author_id == request.user.pk
+        return is_owner or request.user.is_staff
 
 
 class IsCommentOwnerOrAdmin(BasePermission):
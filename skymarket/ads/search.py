@@ -0,0 +1,104 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Полнотекстовый поиск по title и description объявлений.
+# На PostgreSQL используется колонка Ad.search_vector (её заполняет триггер,
+# поиск идёт по GIN-индексу), на SQLite - внешняя FTS5-таблица ads_ad_fts.
+
+SEARCH_CONFIG = 'russian'
+SQLITE_FTS_TABLE = 'ads_ad_fts'
+
+SQLITE_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        title, description, content='ads_ad', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON ads_ad BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON ads_ad BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF title, description ON ads_ad BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+
+def ensure_sqlite_fts(using):
+    """
+    Создаёт FTS5-таблицу и триггеры синхронизации на SQLite.
+
+    Вызывается после каждого migrate: при изменении схемы SQLite пересоздаёт
+    таблицу ads_ad и теряет её триггеры, поэтому их нужно вернуть и
+    перестроить индекс.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{SQLITE_FTS_TABLE}_a%'],
+        )
+        if cursor.fetchone()[0] == 3:
+            return
+
+        for statement in SQLITE_FTS_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def sqlite_match_expression(query):
+    # каждое слово берётся в кавычки, чтобы пользовательский ввод
+    # не разбирался как синтаксис FTS5 (AND, NEAR, *, ...)
+    terms = query.split()
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_ads(queryset, query):
+    """Фильтрует объявления по поисковой строке и аннотирует их релевантностью `rank`."""
+    query = query.strip()
+    if not query:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        )
+
+    if vendor == 'sqlite':
+        match = sqlite_match_expression(query)
+        # bm25() тем меньше, чем документ релевантнее, поэтому знак меняется
+        rank = RawSQL(
+            f'SELECT -bm25({SQLITE_FTS_TABLE}) FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = ads_ad.id',
+            [match],
+        )
+        matched_ids = RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s',
+            [match],
+        )
+        return queryset.filter(id__in=matched_ids).annotate(rank=rank)
+
+    return queryset.filter(Q(title__icontains=query) | Q(description__icontains=query)).annotate(
+        rank=Value(1.0, output_field=FloatField())
+    )
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from ads.models import Comment, Ad
+from ads.values import ValuesSerializer
 
 
 # Сериалайзеры
@@ -12,11 +13,35 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ('ad', 'author', 'created_at', 'text',)
 
 
+class AdBulkListSerializer(serializers.ListSerializer):
+    # при many=True объявления создаются одним bulk_create вместо INSERT на каждое
+    batch_size = 500
+
+    def create(self, validated_data):
+        return Ad.objects.bulk_create([Ad(**item) for item in validated_data], batch_size=self.batch_size)
+
+
 class AdSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ad
-        fields = ('title', 'image', 'price', 'description', 'created_at', 'author',)
+        list_serializer_class = AdBulkListSerializer
+        fields = ('title', 'image', 'price', 'description', 'created_at', 'author',
+                  'comments_count', 'last_comment_at',)
+        read_only_fields = ('comments_count', 'last_comment_at',)
+
+
+class AdValuesSerializer(ValuesSerializer):
+    # быстрый путь списков объявлений, вывод как у AdSerializer
+
+    class Meta:
+        serializer = AdSerializer
+
+
+class CommentValuesSerializer(ValuesSerializer):
+
+    class Meta:
+        serializer = CommentSerializer
 
 
 class AdDetailSerializer(serializers.ModelSerializer):
@@ -0,0 +1,160 @@
+import threading
+import weakref
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ads import cache
+from ads.models import Ad, Comment
+from ads.snapshots import refresh_snapshots
+
+# Ad.comments_count и Ad.last_comment_at обновляются одним UPDATE с F()-выражениями,
+# поэтому параллельные создания/удаления комментариев не теряют инкременты.
+# updated_at сдвигается тем же UPDATE: счётчики входят в представление объявления (ETag),
+# и снимок объявления (ads/snapshots.py) перестраивается после коммита - один раз
+# на объявление, сколько бы комментариев транзакция ни записала.
+
+
+class AdBatch(set):
+    """Набор id объявлений одной транзакции (подкласс - ради слабых ссылок)."""
+
+
+class TransactionAds:
+    """
+    Id объявлений, собранные текущей транзакцией, - отдельный набор на каждый
+    алиас базы в памяти потока (подключения Django тоже у каждого потока свои).
+
+    Каждое добавление регистрирует обычный transaction.on_commit, который
+    держит набор; сам реестр хранит на него только слабую ссылку. Первый
+    колбэк после коммита забирает набор и передаёт его в `on_commit`, остальные
+    находят его пустым. При откате (в том числе до точки сохранения) Django
+    отбрасывает колбэки, и набор, на который больше никто не ссылается, исчезает
+    из реестра. Набор, общий с внешней транзакцией, сохраняет и id из откаченной
+    точки сохранения, поэтому работа по нему должна быть верной и для лишних id.
+    """
+
+    def __init__(self, on_commit=None):
+        self.on_commit = on_commit
+        self.local = threading.local()
+
+    def batches(self):
+        if not hasattr(self.local, 'batches'):
+            self.local.batches = weakref.WeakValueDictionary()
+        return self.local.batches
+
+    def add(self, ad_id, using='default'):
+        batches = self.batches()
+        batch = batches.get(using)
+        if batch is None:
+            batch = batches[using] = AdBatch()
+        batch.add(ad_id)
+        # вне транзакции колбэк выполняется сразу
+        transaction.on_commit(partial(self.commit, batch, using), using=using)
+
+    def contains(self, ad_id, using='default'):
+        batch = self.batches().get(using)
+        return batch is not None and ad_id in batch
+
+    def commit(self, batch, using):
+        batches = self.batches()
+        if batches.get(using) is batch:
+            del batches[using]
+        ad_ids = set(batch)
+        batch.clear()
+        if ad_ids and self.on_commit is not None:
+            self.on_commit(ad_ids, using)
+
+
+def comment_added(ad_id, created_at):
+    # на SQLite GREATEST с NULL даёт NULL, поэтому пустое last_comment_at подменяется
+    created_at = Value(created_at, output_field=DateTimeField())
+    Ad.objects.filter(pk=ad_id).update(
+        comments_count=F('comments_count') + 1,
+        last_comment_at=Greatest(Coalesce(F('last_comment_at'), created_at), created_at),
+        updated_at=timezone.now(),
+    )
+    pending_snapshots.add(ad_id)
+    cache.invalidate()
+
+
+def comment_removed(ad_id):
+    latest = Comment.objects.filter(ad=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+    Ad.objects.filter(pk=ad_id, comments_count__gt=0).update(
+        comments_count=F('comments_count') - 1,
+        last_comment_at=Subquery(latest),
+        updated_at=timezone.now(),
+    )
+    pending_snapshots.add(ad_id)
+    cache.invalidate()
+
+
+def recount_comments(ad_ids, using='default'):
+    """Полный пересчёт счётчиков для набора объявлений, например после bulk_create комментариев без сигналов."""
+    comments = Comment.objects.filter(ad=OuterRef('pk')).order_by().values('ad')
+    Ad.objects.using(using).filter(pk__in=ad_ids).update(
+        comments_count=Coalesce(Subquery(comments.annotate(count=Count('id')).values('count')), 0),
+        last_comment_at=Subquery(comments.annotate(last=Max('created_at')).values('last')),
+        updated_at=timezone.now(),
+    )
+    refresh_snapshots(ad_ids, using)
+    cache.invalidate()
+
+
+# снимки перестраиваются после коммита один раз на объявление
+pending_snapshots = TransactionAds(refresh_snapshots)
+# объявления, которые удаляет текущая транзакция: их комментарии уходят каскадом, и
+# вместо пересчёта на каждый комментарий объявление один раз пересчитывается после
+# коммита (удалённое к тому времени не найдётся). Пересчёт идёт по данным, поэтому
+# метка, оставшаяся после отката точки сохранения, даёт лишь лишний, но верный пересчёт.
+deleting_ads = TransactionAds()
+pending_recounts = TransactionAds(recount_comments)
+
+
+@receiver(post_save, sender=Ad)
+def refresh_saved_ad(sender, instance, using, raw=False, **kwargs):
+    if not raw:
+        refresh_snapshots([instance.pk], using)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def invalidate_ad_lists(sender, **kwargs):
+    cache.invalidate()
+
+
+@receiver(pre_delete, sender=Ad)
+def mark_deleting_ad(sender, instance, using, **kwargs):
+    deleting_ads.add(instance.pk, using)
+
+
+@receiver(post_init, sender=Comment)
+def remember_comment_ad(sender, instance, **kwargs):
+    instance._loaded_ad_id = instance.ad_id
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    previous_ad_id = None if created else instance._loaded_ad_id
+    if previous_ad_id != instance.ad_id:
+        if previous_ad_id is not None:
+            comment_removed(previous_ad_id)
+        if instance.ad_id is not None:
+            comment_added(instance.ad_id, instance.created_at)
+    instance._loaded_ad_id = instance.ad_id
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using, **kwargs):
+    if instance.ad_id is None:
+        return
+    # каскадное удаление вместе с объявлением: строка объявления ещё может существовать,
+    # но будет удалена в этой же транзакции
+    if deleting_ads.contains(instance.ad_id, using):
+        pending_recounts.add(instance.ad_id, using)
+    else:
+        comment_removed(instance.ad_id)
@@ -0,0 +1,138 @@
+import orjson
+from django.db import transaction
+from django.db.models import Case, F, When
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+
+from ads.models import Ad
+from ads.serializers import AdValuesSerializer
+from skymarket.renderers import MessagePackRenderer, ORJSONRenderer
+
+# Готовый JSON объявления (Ad.snapshot) - ровно то, что отдаёт AdSerializer.
+# Списки и карточка объявления склеивают ответ из сохранённых байтов без
+# сериализации. snapshot_version - значение updated_at, по которому построен
+# снимок: любое изменение полей объявления сдвигает updated_at (ads/signals.py,
+# массовые операции), поэтому устаревший снимок просто не используется и строка
+# сериализуется как обычно. Снимки обновляются после save() и изменения
+# счётчиков комментариев; для bulk_create/seed/loadall и проверки согласованности -
+# manage.py reconcile_ad_snapshots.
+#
+# Снимок строится без запроса, поэтому ссылка на картинку в нём относительная
+# (MEDIA_URL) и дополняется схемой и хостом при отдаче, как build_absolute_uri.
+
+# снимок, если он свежий, иначе NULL: версии сравниваются в SQL и не разбираются в Python
+FRESH_SNAPSHOT = Case(When(snapshot_version=F('updated_at'), then=F('snapshot')), default=None)
+IMAGE_PREFIX = b'"image":"/'
+
+
+class RawJSON(bytes):
+    """Уже отрендеренный JSON-фрагмент, который SnapshotJSONRenderer вставляет как есть."""
+
+
+def render_row(serializer, row):
+    return ORJSONRenderer().render(serializer.to_representation(row)).decode('utf-8')
+
+
+def is_fresh(snapshot, version, updated_at):
+    return snapshot is not None and version == updated_at
+
+
+def absolute(snapshot, request):
+    data = snapshot.encode('utf-8')
+    if request is not None and IMAGE_PREFIX in data:
+        # в JSON кавычка внутри строки всегда экранирована, поэтому совпасть может только ключ image
+        base = request.build_absolute_uri('/').encode('utf-8')
+        data = data.replace(IMAGE_PREFIX, b'"image":"' + base, 1)
+    return RawJSON(data)
+
+
+def build_snapshots(queryset):
+    """Строит снимки для объявлений queryset: [(pk, updated_at, snapshot)]."""
+    serializer = AdValuesSerializer()
+    rows = queryset.values(*serializer.columns, 'updated_at')
+    return [(row['id'], row['updated_at'], render_row(serializer, row)) for row in rows]
+
+
+def refresh_snapshots(ad_ids, using='default'):
+    """
+    Перестраивает снимки объявлений. Запись условна по updated_at: если объявление
+    успело измениться после чтения, снимок со старой версией не затрёт более новый.
+    """
+    ad_ids = list(ad_ids)
+    if not ad_ids:
+        return 0
+    manager = Ad.objects.using(using)
+    refreshed = 0
+    with transaction.atomic(using=using):
+        for pk, updated_at, snapshot in build_snapshots(manager.filter(pk__in=ad_ids)):
+            refreshed += manager.filter(pk=pk, updated_at=updated_at).update(
+                snapshot=snapshot, snapshot_version=updated_at,
+            )
+    return refreshed
+
+
+class SnapshotValuesSerializer(AdValuesSerializer):
+    """Строка values() со свежим снимком отдаётся снимком, остальные сериализуются как в AdValuesSerializer."""
+    extra_columns = AdValuesSerializer.extra_columns + ('fresh_snapshot',)
+
+    def prepare(self, queryset):
+        return super().prepare(queryset.annotate(fresh_snapshot=FRESH_SNAPSHOT))
+
+    def to_representation(self, row):
+        if row['fresh_snapshot'] is not None:
+            return absolute(row['fresh_snapshot'], self.context.get('request'))
+        return super().to_representation(row)
+
+
+class SnapshotJSONRenderer(ORJSONRenderer):
+    """
+    JSONRenderer, который вставляет RawJSON без повторного кодирования: сам
+    ответ, элементы списка или элементы `results` страницы (ключ последний у
+    обоих пагинаторов). С отступами (браузерный API) снимки разбираются обратно.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(self.plain(data), accepted_media_type, renderer_context)
+
+        if isinstance(data, RawJSON):
+            return bytes(data)
+        if isinstance(data, list):
+            return b'[' + b','.join(self.item(value) for value in data) + b']'
+        if isinstance(data, dict) and isinstance(data.get('results'), list) and list(data)[-1] == 'results':
+            envelope = super().render({**data, 'results': []}, accepted_media_type, renderer_context)
+            return envelope[:-3] + self.render(data['results']) + b'}'
+        return super().render(data, accepted_media_type, renderer_context)
+
+    def item(self, value):
+        return bytes(value) if isinstance(value, RawJSON) else super().render(value)
+
+    @classmethod
+    def plain(cls, data):
+        if isinstance(data, RawJSON):
+            return orjson.loads(bytes(data))
+        if isinstance(data, list):
+            return [cls.plain(value) for value in data]
+        if isinstance(data, dict):
+            return {key: cls.plain(value) for key, value in data.items()}
+        return data
+
+
+class SnapshotMessagePackRenderer(MessagePackRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(SnapshotJSONRenderer.plain(data), accepted_media_type, renderer_context)
+
+
+class SnapshotViewMixin:
+    renderer_classes = [SnapshotJSONRenderer, SnapshotMessagePackRenderer, BrowsableAPIRenderer]
+
+
+class SnapshotRetrieveMixin(SnapshotViewMixin):
+    """retrieve() из снимка, если он свежий."""
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if is_fresh(instance.snapshot, instance.snapshot_version, instance.updated_at):
+            return Response(absolute(instance.snapshot, request))
+        return Response(self.get_serializer(instance).data)
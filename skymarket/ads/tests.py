@@ -1,11 +1,51 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import time
-
-from rest_framework import status
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3 import base as sqlite_base
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+import msgpack
+from phonenumber_field.phonenumber import to_python as to_phone_number
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.multiprocess import MultiProcessCollector
+from rest_framework import serializers, status
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
 from users.models import User
+from ads import cache as ads_cache
+from ads.checks import check_ordering_indexes
+from ads.management.commands.check_query_plans import seq_scans
 from ads.models import Ad, Comment
+from ads.serializers import AdSerializer, AdValuesSerializer, CommentSerializer, CommentValuesSerializer
+from ads.snapshots import SnapshotValuesSerializer
+from ads.views import AdBulkCreateAPIView, AdListAPIView
+from skymarket.apps import install_slow_query_logger
+from skymarket.db_pool import PooledConnectionMixin, PoolTimeout, clear_pools
+from skymarket.db_router import PIN_COOKIE, PIN_KEY, PrimaryReplicaRouter, read_from_replica
+from skymarket.management.commands.slow_query_report import fingerprint
+from skymarket.parsers import MessagePackParser, ORJSONParser
+from skymarket.profiling import StackProfiler
+from skymarket.renderers import MessagePackRenderer, ORJSONRenderer
+from skymarket.slow_queries import SlowQueryLogger, explain_prefix
 
 
 class AdListTestCase(APITestCase):
@@ -88,33 +128,41 @@ class AdListTestCase(APITestCase):
                 'results': [
                     {
                         'author': self.ad5.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad5.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad5.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad5.price),
                         'title': self.ad5.title
                     },
                     {
                         'author': self.ad4.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad4.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad4.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad4.price),
                         'title': self.ad4.title
                     },
                     {
                         'author': self.ad3.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad3.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad3.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad3.price),
                         'title': self.ad3.title
                     },
                     {
                         'author': self.ad2.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad2.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad2.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad2.price),
                         'title': self.ad2.title
                     },
@@ -123,6 +171,273 @@ class AdListTestCase(APITestCase):
         )
 
 
+class AdCursorPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ads = [
+            Ad.objects.create(title=f'Test{i}', price=100 + i, author=self.user)
+            for i in range(6)
+        ]
+        # одинаковое created_at у всех объявлений: порядок держится на tie-breaker по id
+        created_at = self.ads[0].created_at
+        Ad.objects.update(created_at=created_at)
+
+    def test_walk_forward_and_back(self):
+        self.client.force_authenticate(user=self.user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('ads:ads_list'), {'pagination': 'cursor'})
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+        first_page = response.json()
+        self.assertNotIn('count', first_page)
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual(
+            [ad['title'] for ad in first_page['results']],
+            ['Test5', 'Test4', 'Test3', 'Test2']
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(first_page['next'])
+
+        second_page = response.json()
+        self.assertIsNone(second_page['next'])
+        self.assertEqual(
+            [ad['title'] for ad in second_page['results']],
+            ['Test1', 'Test0']
+        )
+
+        response = self.client.get(second_page['previous'])
+
+        self.assertEqual(
+            [ad['title'] for ad in response.json()['results']],
+            ['Test5', 'Test4', 'Test3', 'Test2']
+        )
+
+    def test_ordering_by_price(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('ads:ads_list'), {'pagination': 'cursor', 'ordering': 'price'})
+        response = self.client.get(response.json()['next'])
+
+        self.assertEqual(
+            [ad['title'] for ad in response.json()['results']],
+            ['Test4', 'Test5']
+        )
+
+    def test_unsupported_ordering(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('ads:ads_list'), {'pagination': 'cursor', 'ordering': 'title'})
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('ads:ads_list'), {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+
+
+class AdCursorQueryTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        for i in range(6):
+            Ad.objects.create(title=f'Test{i}', price=100 + i, author=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_cursor_is_a_row_value_range(self):
+        first_page = self.client.get(reverse('ads:ads_list'), {'pagination': 'cursor'}).json()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(first_page['next'])
+
+        self.assertEqual([ad['title'] for ad in response.json()['results']], ['Test1', 'Test0'])
+        sql = queries.captured_queries[-1]['sql']
+        # одно сравнение кортежей вместо OR-ветвей, ORDER BY совпадает с индексом (created_at, id)
+        self.assertIn('("ads_ad"."created_at", "ads_ad"."id") < (', sql)
+        self.assertNotIn(' OR ', sql)
+        self.assertNotIn('NULLS', sql)
+        self.assertTrue(sql.endswith('ORDER BY "ads_ad"."created_at" DESC, "ads_ad"."id" DESC LIMIT 5'))
+
+
+class AdOrderingTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.cheap = Ad.objects.create(title='Cheap', price=10, author=self.user)
+        self.expensive = Ad.objects.create(title='Expensive', price=1000, author=self.user)
+        self.middle = Ad.objects.create(title='Middle', price=100, author=self.user)
+
+    def test_indexed_ordering(self):
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('ads:ads_list'), {'ordering': '-price'})
+
+        self.assertEqual(
+            [ad['title'] for ad in response.json()['results']],
+            ['Expensive', 'Middle', 'Cheap']
+        )
+
+    def test_default_ordering_has_tie_breaker(self):
+        Ad.objects.update(created_at=self.cheap.created_at)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('ads:ads_my_list'))
+
+        self.assertEqual(
+            [ad['title'] for ad in response.json()['results']],
+            ['Middle', 'Expensive', 'Cheap']
+        )
+
+    def test_unsupported_ordering_rejected_without_queries(self):
+        self.client.force_authenticate(user=self.user)
+
+        for url, ordering in [
+            (reverse('ads:ads_list'), 'author__email'),
+            (reverse('ads:ads_list'), 'title'),
+            (reverse('ads:ads_my_list'), 'price'),
+            (reverse('ads:comments', kwargs={'ad_pk': self.cheap.pk}), '-text'),
+        ]:
+            with self.assertNumQueries(0):
+                response = self.client.get(url, {'ordering': ordering})
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_400_BAD_REQUEST
+            )
+            self.assertIn('ordering', response.json())
+
+    def test_ordering_indexes_check(self):
+        self.assertEqual(check_ordering_indexes(None), [])
+
+        with mock.patch.dict(AdListAPIView.ordering_indexes, {'title': 'ads_ad_created_idx'}):
+            errors = check_ordering_indexes(None)
+
+        self.assertEqual([error.id for error in errors], ['ads.E001'])
+
+
+class AdSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.bike = Ad.objects.create(
+            title='Горный велосипед',
+            description='Почти новый, колёса 29 дюймов',
+            author=self.user,
+        )
+        self.phone = Ad.objects.create(
+            title='Телефон',
+            description='Отдам вместе с чехлом для велосипеда',
+            author=self.user,
+        )
+        self.sofa = Ad.objects.create(
+            title='Диван',
+            description='Раскладной',
+            author=self.user,
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('ads:ads_list'), {'search': query})
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        return [ad['title'] for ad in response.json()['results']]
+
+    def test_search_title_and_description(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(set(self.search('велосипед')), {self.bike.title})
+        self.assertEqual(self.search('велосипед чехлом'), [])
+        self.assertEqual(self.search('раскладной'), [self.sofa.title])
+
+    def test_search_index_follows_changes(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.sofa.title = 'Кресло'
+        self.sofa.save()
+        self.phone.delete()
+
+        self.assertEqual(self.search('кресло'), ['Кресло'])
+        self.assertEqual(self.search('диван'), [])
+        self.assertEqual(self.search('телефон'), [])
+
+    def test_search_syntax_is_escaped(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.search('"диван AND* NEAR('), [])
+
+
+class AdAuthorEmailFilterTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='Moderator@Mail.com',
+            password='123qwe456rty'
+        )
+        self.another_user = User.objects.create(
+            email='seller@shop.org',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(title='Test1', author=self.user)
+        self.ad2 = Ad.objects.create(title='Test2', author=self.another_user)
+
+    def filter_by_email(self, value):
+        response = self.client.get(reverse('ads:ads_list'), {'author__email': value})
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        return [ad['title'] for ad in response.json()['results']]
+
+    def test_substring_ignores_case(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.filter_by_email('rator@mail'), ['Test1'])
+        self.assertEqual(self.filter_by_email('SHOP'), ['Test2'])
+        self.assertEqual(self.filter_by_email('nobody'), [])
+
+    def test_short_value(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.filter_by_email('.o'), ['Test2'])
+
+    def test_changed_email(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.another_user.email = 'buyer@shop.org'
+        self.another_user.save()
+
+        self.assertEqual(self.filter_by_email('seller'), [])
+        self.assertEqual(self.filter_by_email('buyer'), ['Test2'])
+
+
 class AdCreateTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create(
@@ -244,25 +559,31 @@ class ListMyAdsTestCase(APITestCase):
                 'results': [
                     {
                         'author': self.ad5.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad5.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad5.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad5.price),
                         'title': self.ad5.title
                     },
                     {
                         'author': self.ad3.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad3.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad3.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad3.price),
                         'title': self.ad3.title
                     },
                     {
                         'author': self.ad1.author.pk,
+                        'comments_count': 0,
                         'created_at': self.ad1.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                         'description': self.ad1.description,
                         'image': None,
+                        'last_comment_at': None,
                         'price': str(self.ad1.price),
                         'title': self.ad1.title
                     },
@@ -416,9 +737,11 @@ class PatchAdTestCase(APITestCase):
             response.json(),
             {
                 'author': self.ad1.author.pk,
+                'comments_count': 0,
                 'created_at': self.ad1.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                 'description': self.ad1.description,
                 'image': None,
+                'last_comment_at': None,
                 'price': str(self.ad1.price),
                 'title': 'New Title'
             }
@@ -441,9 +764,11 @@ class PatchAdTestCase(APITestCase):
             response.json(),
             {
                 'author': self.ad1.author.pk,
+                'comments_count': 0,
                 'created_at': self.ad1.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
                 'description': self.ad1.description,
                 'image': None,
+                'last_comment_at': None,
                 'price': str(self.ad1.price),
                 'title': 'New Title'
             }
@@ -1017,3 +1342,1383 @@ class DestroyCommentTestCase(APITestCase):
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
+
+
+class CheckQueryPlansTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=150,
+            author=self.user_me,
+        )
+        self.comment1 = Comment.objects.create(
+            text='Comment1',
+            ad=self.ad1,
+            author=self.user_me,
+        )
+
+    def test_list_endpoints_use_indexes(self):
+        out = StringIO()
+
+        call_command('check_query_plans', stdout=out)
+
+        self.assertNotIn('sequential scan', out.getvalue())
+        # страницы по курсору и агрегат ETag списка комментариев тоже проверяются
+        self.assertIn('ads_list cursor:', out.getvalue())
+        self.assertIn('comments cursor:', out.getvalue())
+        self.assertIn('comments fingerprint:', out.getvalue())
+
+    def test_empty_database(self):
+        Comment.objects.all().delete()
+
+        with self.assertRaises(CommandError):
+            call_command('check_query_plans', stdout=StringIO())
+
+    def test_seq_scan_detection(self):
+        postgres_plan = (
+            'Limit  (cost=0.00..0.12 rows=4 width=80)\n'
+            '  ->  Seq Scan on ads_ad  (cost=0.00..1.05 rows=5 width=80)'
+        )
+        sqlite_plan = '5 0 0 SCAN ads_comment\n9 0 0 SCAN ads_ad USING INDEX ads_ad_created_idx'
+
+        self.assertEqual(seq_scans(postgres_plan, 'postgresql'), ['ads_ad'])
+        self.assertEqual(seq_scans(sqlite_plan, 'sqlite'), ['ads_comment'])
+
+
+class AdCommentsCountTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=100.99,
+            author=self.user_me,
+        )
+        self.ad2 = Ad.objects.create(
+            title='Test2',
+            price=100.99,
+            author=self.user_me,
+        )
+
+    def test_count_follows_create_and_delete(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        for text in ('1', '2'):
+            self.client.post(
+                reverse('ads:comments_create', kwargs={'ad_pk': self.ad1.pk}),
+                {'text': text}
+            )
+        last_comment = Comment.objects.latest('created_at')
+
+        self.ad1.refresh_from_db()
+        self.assertEqual(self.ad1.comments_count, 2)
+        self.assertEqual(self.ad1.last_comment_at, last_comment.created_at)
+
+        response = self.client.delete(
+            reverse('ads:comments_delete', kwargs={'ad_pk': self.ad1.pk, 'com_pk': last_comment.pk})
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_204_NO_CONTENT
+        )
+
+        self.ad1.refresh_from_db()
+        first_comment = Comment.objects.get()
+        self.assertEqual(self.ad1.comments_count, 1)
+        self.assertEqual(self.ad1.last_comment_at, first_comment.created_at)
+
+        response = self.client.get(reverse('ads:ad_retrieve', kwargs={'pk': self.ad1.pk}))
+
+        self.assertEqual(response.json()['comments_count'], 1)
+        self.assertEqual(
+            response.json()['last_comment_at'],
+            first_comment.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        )
+
+    def test_comment_moved_to_another_ad(self):
+        comment = Comment.objects.create(text='1', ad=self.ad1, author=self.user_me)
+
+        comment.ad = self.ad2
+        comment.save()
+
+        self.ad1.refresh_from_db()
+        self.ad2.refresh_from_db()
+        self.assertEqual((self.ad1.comments_count, self.ad1.last_comment_at), (0, None))
+        self.assertEqual((self.ad2.comments_count, self.ad2.last_comment_at), (1, comment.created_at))
+
+    def test_ad_delete_does_not_touch_counters_per_comment(self):
+        Comment.objects.create(text='1', ad=self.ad1, author=self.user_me)
+        for i in range(5):
+            Comment.objects.create(text=str(i), ad=self.ad2, author=self.user_me)
+
+        # пересчёт после коммита выполняется один раз на объявление, а не на комментарий
+        with CaptureQueriesContext(connection) as one_comment, self.captureOnCommitCallbacks(execute=True):
+            self.ad1.delete()
+        with CaptureQueriesContext(connection) as five_comments, self.captureOnCommitCallbacks(execute=True):
+            self.ad2.delete()
+
+        self.assertEqual(len(five_comments), len(one_comment))
+        self.assertFalse(Comment.objects.exists())
+
+        # метка, оставшаяся после отката удаления, не ломает счётчики
+        ad = Ad.objects.create(title='Test3', author=self.user_me)
+        comment = Comment.objects.create(text='1', ad=ad, author=self.user_me)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Ad.objects.get(pk=ad.pk).delete()
+            raise RuntimeError
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.delete()
+        ad.refresh_from_db()
+        self.assertEqual(ad.comments_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        comment = Comment.objects.create(text='1', ad=self.ad1, author=self.user_me)
+        Ad.objects.update(comments_count=7, last_comment_at=None)
+        updated_at = Ad.objects.get(pk=self.ad1.pk).updated_at
+        generation = ads_cache.get_generation()
+        out = StringIO()
+
+        call_command('reconcile_comment_counts', batch_size=1, stdout=out)
+
+        self.ad1.refresh_from_db()
+        self.ad2.refresh_from_db()
+        # исправленные счётчики меняют ETag карточки и списков
+        self.assertGreater(self.ad1.updated_at, updated_at)
+        self.assertGreater(ads_cache.get_generation(), generation)
+        self.assertEqual((self.ad1.comments_count, self.ad1.last_comment_at), (1, comment.created_at))
+        self.assertEqual((self.ad2.comments_count, self.ad2.last_comment_at), (0, None))
+        self.assertIn('Checked 2 ads, repaired 2', out.getvalue())
+
+
+@override_settings(CACHE_SHARED=True)
+class AdListCacheTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=100.99,
+            author=self.user_me,
+        )
+        self.client.force_authenticate(user=self.user_me)
+
+    def test_repeated_request_is_served_from_cache(self):
+        response = self.client.get(reverse('ads:ads_list'), {'title': 'test', 'page': 1})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        hits = ads_cache.stats()['hits']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('ads:ads_list'), {'page': 1, 'title': 'test'})
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['title'], 'Test1')
+        self.assertEqual(ads_cache.stats()['hits'], hits + 1)
+
+    def test_ad_changes_invalidate(self):
+        self.client.get(reverse('ads:ads_list'))
+
+        self.ad1.title = 'Changed'
+        self.ad1.save()
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['title'], 'Changed')
+
+        Comment.objects.create(text='1', ad=self.ad1, author=self.user_me)
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['comments_count'], 1)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUTS={'ads_list': 0})
+    def test_disabled_by_settings(self):
+        self.client.get(reverse('ads:ads_list'))
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertNotIn('X-Cache', response)
+
+    @override_settings(CACHE_SHARED=None)
+    def test_disabled_for_process_local_cache(self):
+        self.client.get(reverse('ads:ads_list'))
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertNotIn('X-Cache', response)
+
+    def test_evicted_generation_does_not_restart(self):
+        cache.delete(ads_cache.GENERATION_KEY)
+        self.client.get(reverse('ads:ads_list'))
+        Ad.objects.filter(pk=self.ad1.pk).update(title='Changed', updated_at=timezone.now())
+        # ключ поколения вытеснен: новое поколение не должно совпасть со старым
+        cache.delete(ads_cache.GENERATION_KEY)
+
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['title'], 'Changed')
+
+
+class ConditionalRetrieveTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=100.99,
+            author=self.user_me,
+        )
+        self.comment1 = Comment.objects.create(
+            text='Comment1',
+            ad=self.ad1,
+            author=self.user_me,
+        )
+        self.ad_url = reverse('ads:ad_retrieve', kwargs={'pk': self.ad1.pk})
+        self.comment_url = reverse('ads:comments_retrieve', kwargs={'ad_pk': self.ad1.pk, 'com_pk': self.comment1.pk})
+        self.client.force_authenticate(user=self.user_me)
+
+    def test_if_none_match(self):
+        for url in (self.ad_url, self.comment_url):
+            response = self.client.get(url)
+            etag = response['ETag']
+
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_304_NOT_MODIFIED
+            )
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.ad_url)
+
+        response = self.client.get(self.ad_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+    def test_changes_invalidate_etag(self):
+        ad_etag = self.client.get(self.ad_url)['ETag']
+        comment_etag = self.client.get(self.comment_url)['ETag']
+
+        self.comment1.text = 'Changed'
+        self.comment1.save()
+        Comment.objects.create(text='Comment2', ad=self.ad1, author=self.user_me)
+
+        response = self.client.get(self.comment_url, HTTP_IF_NONE_MATCH=comment_etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(response.json()['text'], 'Changed')
+
+        response = self.client.get(self.ad_url, HTTP_IF_NONE_MATCH=ad_etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(response.json()['comments_count'], 2)
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalListTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=100.99,
+            author=self.user_me,
+        )
+        self.comment1 = Comment.objects.create(
+            text='Comment1',
+            ad=self.ad1,
+            author=self.user_me,
+        )
+        self.comments_url = reverse('ads:comments', kwargs={'ad_pk': self.ad1.pk})
+        self.client.force_authenticate(user=self.user_me)
+
+    def test_unchanged_lists_return_304(self):
+        for url in (reverse('ads:ads_list'), reverse('ads:ads_my_list'), self.comments_url):
+            etag = self.client.get(url, {'page': 1})['ETag']
+
+            response = self.client.get(url, {'page': 1}, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_304_NOT_MODIFIED
+            )
+
+    def test_params_are_part_of_etag(self):
+        etag = self.client.get(reverse('ads:ads_list'))['ETag']
+
+        response = self.client.get(reverse('ads:ads_list'), {'ordering': 'price'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+    def test_changed_comments_return_200(self):
+        etag = self.client.get(self.comments_url)['ETag']
+
+        self.comment1.text = 'Changed'
+        self.comment1.save()
+        response = self.client.get(self.comments_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        etag = response['ETag']
+
+        self.comment1.delete()
+        response = self.client.get(self.comments_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_changed_ads_return_200(self):
+        etag = self.client.get(reverse('ads:ads_list'))['ETag']
+
+        Ad.objects.create(title='Test2', author=self.user_me)
+        response = self.client.get(reverse('ads:ads_list'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+    def test_ads_etag_does_not_query_database(self):
+        etag = self.client.get(reverse('ads:ads_list'))['ETag']
+
+        # версия коллекции - поколение из общего кэша, без агрегата по таблице
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('ads:ads_list'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+        # изменение в другом воркере сдвигает то же общее поколение
+        Ad.objects.filter(pk=self.ad1.pk).update(title='Changed', updated_at=timezone.now())
+        ads_cache.invalidate()
+        response = self.client.get(reverse('ads:ads_list'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+    @override_settings(CACHE_SHARED=None)
+    def test_no_ads_etag_for_process_local_cache(self):
+        response = self.client.get(reverse('ads:ads_list'))
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertNotIn('ETag', response)
+        self.assertIn('ETag', self.client.get(self.comments_url))
+
+    def test_my_ads_etag_depends_on_user(self):
+        another_user = User.objects.create(email='test2@mail.com', password='123qwe456rty')
+        Ad.objects.filter(pk=self.ad1.pk).update(author=another_user)
+        etag = self.client.get(reverse('ads:ads_my_list'))['ETag']
+
+        self.client.force_authenticate(user=User.objects.create(email='test3@mail.com'))
+        response = self.client.get(reverse('ads:ads_my_list'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+
+class AdBulkTestCase(APITestCase):
+    def setUp(self):
+        self.user_me = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.another_user = User.objects.create(
+            email='test@mail.com',
+            password='123qwe456rty'
+        )
+        self.admin = User.objects.create(
+            email='admin@mail.com',
+            password='123qwe456rty',
+            role='admin'
+        )
+        self.ad1 = Ad.objects.create(
+            title='Test1',
+            price=100.99,
+            author=self.user_me,
+        )
+        self.ad2 = Ad.objects.create(
+            title='Test2',
+            price=102.99,
+            author=self.another_user,
+        )
+
+    def test_not_authenticated(self):
+        response = self.client.post(reverse('ads:ads_bulk_create'), [{'title': 'New'}], format='json')
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_bulk_create(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        with self.assertNumQueries(3):
+            response = self.client.post(
+                reverse('ads:ads_bulk_create'),
+                [{'title': 'New1', 'price': 1}, {'title': 'New2', 'price': 2}],
+                format='json'
+            )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED
+        )
+        self.assertEqual([result['status'] for result in response.json()['results']], ['created', 'created'])
+        self.assertEqual(Ad.objects.filter(author=self.user_me, title__startswith='New').count(), 2)
+
+    def test_bulk_create_invalid_item(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        response = self.client.post(
+            reverse('ads:ads_bulk_create'),
+            [{'title': 'New1'}, {'title': 'New2', 'price': 'abc'}],
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            response.json(),
+            {'results': [
+                {'index': 0, 'status': 'ok'},
+                {'index': 1, 'status': 'invalid', 'errors': {'price': ['A valid number is required.']}},
+            ]}
+        )
+        self.assertFalse(Ad.objects.filter(title='New1').exists())
+
+    def test_bulk_update(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        response = self.client.patch(
+            reverse('ads:ads_bulk_update'),
+            [{'id': self.ad1.pk, 'title': 'Changed'}, {'id': self.ad1.pk + 100, 'title': 'Nope'}],
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(response.json()['results'][1]['status'], 'not_found')
+        self.ad1.refresh_from_db()
+        self.assertEqual(self.ad1.title, 'Test1')
+
+        updated_at = self.ad1.updated_at
+        response = self.client.patch(
+            reverse('ads:ads_bulk_update'),
+            [{'id': self.ad1.pk, 'title': 'Changed'}],
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.ad1.refresh_from_db()
+        self.assertEqual(self.ad1.title, 'Changed')
+        self.assertGreater(self.ad1.updated_at, updated_at)
+
+    def test_bulk_update_writes_only_submitted_fields(self):
+        self.client.force_authenticate(user=self.admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                reverse('ads:ads_bulk_update'),
+                [{'id': self.ad1.pk, 'title': 'Changed'}, {'id': self.ad2.pk, 'price': 5}],
+                format='json'
+            )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "ads_ad" SET') and ' CASE WHEN ' in query['sql']]
+        self.assertEqual(len(updates), 2)
+        # каждое UPDATE пишет только свои поля и не затирает чужие правки
+        self.assertEqual(
+            sorted(('"title"' in sql, '"price"' in sql) for sql in updates),
+            [(False, True), (True, False)]
+        )
+        self.ad1.refresh_from_db()
+        self.ad2.refresh_from_db()
+        self.assertEqual((self.ad1.title, self.ad2.title), ('Changed', 'Test2'))
+        self.assertEqual(self.ad2.price, 5)
+
+    def test_bulk_update_no_permission(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        response = self.client.patch(
+            reverse('ads:ads_bulk_update'),
+            [{'id': self.ad1.pk, 'title': 'Changed'}, {'id': self.ad2.pk, 'title': 'Changed'}],
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            response.json()['results'][1],
+            {
+                'index': 1,
+                'id': self.ad2.pk,
+                'status': 'forbidden',
+                'detail': 'you are not the owner or administrator of this post'
+            }
+        )
+
+    def test_bulk_delete_by_admin(self):
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.delete(
+            reverse('ads:ads_bulk_delete'),
+            {'ids': [self.ad1.pk, self.ad2.pk]},
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertFalse(Ad.objects.exists())
+
+    def test_bulk_delete_no_permission(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        response = self.client.delete(
+            reverse('ads:ads_bulk_delete'),
+            {'ids': [self.ad1.pk, self.ad2.pk]},
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(Ad.objects.count(), 2)
+
+    def test_too_many_items(self):
+        self.client.force_authenticate(user=self.user_me)
+
+        response = self.client.post(
+            reverse('ads:ads_bulk_create'),
+            [{'title': 'New'}] * (AdBulkCreateAPIView.max_batch_size + 1),
+            format='json'
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+class ServerTimingTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        Ad.objects.create(title='Test1', price=100, author=self.user)
+        ads_cache.bump_generation()
+        self.client.force_authenticate(user=self.user)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1, REQUEST_TIMING_HEADER=True)
+    def test_sampled_request(self):
+        with self.assertLogs('skymarket.timing', level='INFO') as logs:
+            response = self.client.get('/ads/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        header = response['Server-Timing']
+        # COUNT(*) пагинатора и выборка страницы
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="2 queries", serialize;dur=[\d.]+, render;dur=[\d.]+, '
+                                 r'view;dur=[\d.]+, total;dur=[\d.]+$')
+
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(record.url_name, 'ads_list')
+        self.assertEqual(record.queries, 2)
+        self.assertGreater(record.serialize_ms, 0)
+        self.assertIn('url_name=ads_list method=GET status=200 queries=2', record.getMessage())
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_header_is_opt_in(self):
+        with self.assertLogs('skymarket.timing', level='INFO'):
+            response = self.client.get('/ads/')
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_serializer_is_timed_in_view(self):
+        data = serializers.BaseSerializer.__dict__['data']
+        # snapshot был бы отдан без сериализатора
+        Ad.objects.update(snapshot=None)
+        ad = Ad.objects.get()
+        with self.assertLogs('skymarket.timing', level='INFO') as logs:
+            response = self.client.get(f'/ads/{ad.pk}/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(logs.records[0].serialize_ms, 0)
+        # глобальный BaseSerializer.data не подменяется
+        self.assertIs(serializers.BaseSerializer.__dict__['data'], data)
+        self.assertEqual(type(AdSerializer(ad)), AdSerializer)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0, REQUEST_TIMING_HEADER=True)
+    def test_not_sampled(self):
+        with mock.patch('skymarket.middleware.timed_request') as timed_request, \
+                mock.patch('skymarket.metrics.timed_request') as metrics_timed_request:
+            response = self.client.get('/ads/')
+
+        # метрики тоже не ставят замеры SQL и сериализации на невыбранный запрос
+        timed_request.assert_not_called()
+        metrics_timed_request.assert_not_called()
+        self.assertNotIn('Server-Timing', response)
+
+
+class SlowQueryLogTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        Ad.objects.create(title='Test1', price=100, author=self.user)
+        ads_cache.bump_generation()
+        self.client.force_authenticate(user=self.user)
+
+    def test_slow_queries_are_logged_with_plan(self):
+        slow_query_logger = SlowQueryLogger(threshold_ms=0.000001, explain_rate=1)
+        with self.assertLogs('skymarket.slow_queries', level='WARNING') as logs, \
+                connection.execute_wrapper(slow_query_logger):
+            response = self.client.get('/ads/?price__gte=10')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        page_query = next(entry for entry in entries if 'LIMIT' in entry['sql'])
+        self.assertEqual(page_query['view'], 'ads.views.AdListAPIView')
+        self.assertEqual(page_query['url_name'], 'ads_list')
+        self.assertIn('10', page_query['params'])
+        self.assertIn('ads_ad', page_query['explain'])
+
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_file = os.path.join(log_dir, 'slow_queries.log')
+            with open(log_file, 'w', encoding='utf-8') as log:
+                log.writelines(record.getMessage() + '\n' for record in logs.records)
+
+            out = StringIO()
+            call_command('slow_query_report', file=log_file, explain=True, stdout=out)
+
+        self.assertIn(f'{len(entries)} slow queries', out.getvalue())
+        self.assertIn('view=ads.views.AdListAPIView', out.getvalue())
+        self.assertIn('   | ', out.getvalue())
+
+    def test_explain_analyze_only_plain_select(self):
+        self.assertEqual(explain_prefix('postgresql', ' select 1'), 'EXPLAIN (ANALYZE, BUFFERS) ')
+        # CTE может изменять данные, такой запрос нельзя выполнять повторно
+        self.assertEqual(
+            explain_prefix('postgresql', 'WITH d AS (DELETE FROM ads_ad RETURNING id) SELECT * FROM d'),
+            'EXPLAIN '
+        )
+        self.assertEqual(explain_prefix('sqlite', 'WITH t AS (SELECT 1) SELECT * FROM t'), 'EXPLAIN QUERY PLAN ')
+        self.assertIsNone(explain_prefix('postgresql', 'UPDATE ads_ad SET title = title'))
+        self.assertIsNone(explain_prefix('mysql', 'SELECT 1'))
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM \"ads_ad\" WHERE id IN (%s, %s, %s) AND title = 'it''s'\n  LIMIT 21"),
+            'SELECT * FROM "ads_ad" WHERE id IN (?, ...) AND title = ? LIMIT ?'
+        )
+
+    def test_logger_is_opt_in(self):
+        fake_connection = mock.Mock(execute_wrappers=[])
+        install_slow_query_logger(sender=None, connection=fake_connection)
+        self.assertEqual(fake_connection.execute_wrappers, [])
+
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=200):
+            install_slow_query_logger(sender=None, connection=fake_connection)
+            install_slow_query_logger(sender=None, connection=fake_connection)
+
+        self.assertEqual(len(fake_connection.execute_wrappers), 1)
+        self.assertEqual(fake_connection.execute_wrappers[0].threshold, 0.2)
+
+
+@override_settings(CACHE_SHARED=True)
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.admin = User.objects.create(
+            email='admin@mail.com',
+            password='123qwe456rty',
+            role='admin'
+        )
+        Ad.objects.create(title='Test1', price=100, author=self.user)
+        ads_cache.bump_generation()
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_request_metrics(self):
+        labels = {'url_name': 'ads_list', 'method': 'GET'}
+        requests_before = self.sample('http_request_duration_seconds_count', **labels)
+        ok_before = self.sample('http_responses_total', status='200', **labels)
+        misses_before = self.sample('cache_requests_total', cache='ads_list', result='miss')
+        hits_before = self.sample('cache_requests_total', cache='ads_list', result='hit')
+        queries_before = self.sample('db_queries_per_request_sum', url_name='ads_list')
+
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/ads/')
+        self.client.get('/ads/')
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count', **labels) - requests_before, 2)
+        self.assertEqual(self.sample('http_responses_total', status='200', **labels) - ok_before, 2)
+        self.assertEqual(self.sample('cache_requests_total', cache='ads_list', result='miss') - misses_before, 1)
+        self.assertEqual(self.sample('cache_requests_total', cache='ads_list', result='hit') - hits_before, 1)
+        # COUNT и страница при промахе, при попадании в кэш запросов нет
+        self.assertEqual(self.sample('db_queries_per_request_sum', url_name='ads_list') - queries_before, 2)
+        self.assertEqual(self.sample('http_requests_in_flight', url_name='ads_list'), 0)
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_not_sampled_request_is_counted_without_sql(self):
+        labels = {'url_name': 'ads_list', 'method': 'GET'}
+        requests_before = self.sample('http_request_duration_seconds_count', **labels)
+        queries_before = self.sample('db_queries_per_request_count', url_name='ads_list')
+
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/ads/')
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count', **labels) - requests_before, 1)
+        self.assertEqual(self.sample('db_queries_per_request_count', url_name='ads_list') - queries_before, 0)
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.admin)
+        self.client.get('/ads/')
+        response = self.client.get('/metrics/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('http_request_duration_seconds_bucket{le="0.005",method="GET",url_name="ads_list"}',
+                      response.content.decode())
+
+    def test_multiprocess_aggregation(self):
+        script = (
+            'import django; django.setup(); '
+            'from skymarket.metrics import CACHE_REQUESTS; '
+            'CACHE_REQUESTS.labels("ads_list", "hit").inc(3)'
+        )
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': metrics_dir, 'DJANGO_SETTINGS_MODULE': 'skymarket.settings'}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+            registry = CollectorRegistry()
+            MultiProcessCollector(registry, path=metrics_dir)
+            # коллектор читает файлы при каждом сборе
+            hits = registry.get_sample_value('cache_requests_total', {'cache': 'ads_list', 'result': 'hit'})
+
+        self.assertEqual(hits, 6)
+
+
+@override_settings(REQUEST_PROFILER_ENABLED=True)
+class ProfilerTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.admin = User.objects.create(
+            email='admin@mail.com',
+            password='123qwe456rty',
+            role='admin'
+        )
+        Ad.objects.create(title='Test1', price=100, author=self.user)
+        ads_cache.bump_generation()
+
+    def authorize(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def test_inline_profile(self):
+        self.authorize(self.admin)
+        response = self.client.get('/ads/?profile=inline')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertGreater(float(response['X-Profile-Total-Ms']), 0)
+        lines = response.content.decode().splitlines()
+        for line in lines:
+            self.assertRegex(line, r'^\S.* \d+$')
+        stacks = '\n'.join(lines)
+        self.assertIn('ads.cache:CachedListMixin.list', stacks)
+        self.assertIn('rest_framework.serializers:', stacks)
+        self.assertIn('rest_framework_simplejwt.', stacks)
+
+    def test_stored_profile(self):
+        self.authorize(self.admin)
+        with tempfile.TemporaryDirectory() as profile_dir, override_settings(REQUEST_PROFILER_DIR=profile_dir):
+            response = self.client.get('/ads/', HTTP_X_PROFILE='1')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['count'], 1)
+            self.assertEqual(os.listdir(profile_dir), [response['X-Profile-File']])
+            self.assertRegex(response['X-Profile-File'], r'-ads_list-[0-9a-f]{8}\.folded$')
+
+    def test_stored_profiles_are_pruned(self):
+        self.authorize(self.admin)
+        with tempfile.TemporaryDirectory() as profile_dir, \
+                override_settings(REQUEST_PROFILER_DIR=profile_dir, REQUEST_PROFILER_MAX_FILES=2):
+            for age, name in enumerate(['new.folded', 'old.folded', 'older.folded'], start=1):
+                path = os.path.join(profile_dir, name)
+                open(path, 'w').close()
+                os.utime(path, (time.time() - age * 60,) * 2)
+            response = self.client.get('/ads/', HTTP_X_PROFILE='1')
+
+            self.assertEqual(
+                sorted(os.listdir(profile_dir)),
+                sorted([response['X-Profile-File'], 'new.folded'])
+            )
+
+    def test_not_staff(self):
+        self.authorize(self.user)
+        with tempfile.TemporaryDirectory() as profile_dir, override_settings(REQUEST_PROFILER_DIR=profile_dir):
+            response = self.client.get('/ads/?profile=inline')
+            self.assertEqual(os.listdir(profile_dir), [])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertNotIn('X-Profile-Total-Ms', response)
+
+        self.client.credentials()
+        response = self.client.get('/ads/?profile=inline')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertNotIn('X-Profile-Total-Ms', response)
+
+    @override_settings(REQUEST_PROFILER_ENABLED=False)
+    def test_disabled(self):
+        self.authorize(self.admin)
+        response = self.client.get('/ads/?profile=inline')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Total-Ms', response)
+
+    def test_collapsed_stacks(self):
+        def inner():
+            time.sleep(0.01)
+
+        def outer():
+            inner()
+            sorted(range(10))
+
+        with StackProfiler() as profiler:
+            outer()
+
+        stacks = dict(line.rsplit(' ', 1) for line in profiler.collapsed().splitlines())
+        sleep = next(path for path in stacks if path.endswith('time:sleep'))
+        self.assertEqual([frame.split(':')[1].rsplit('.', 1)[-1] for frame in sleep.split(';')],
+                         ['outer', 'inner', 'sleep'])
+        self.assertGreaterEqual(int(stacks[sleep]), 10000)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTestCase(APITransactionTestCase):
+    # вторая локальная база играет роль отстающей реплики: в ней только то, что записано явно;
+    # она подключается в setUpClass, поэтому перечислить её здесь нельзя
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.other = User.objects.create(
+            email='test2@mail.com',
+            password='123qwe456rty'
+        )
+        for user in (self.user, self.other):
+            User.objects.using('replica').create(pk=user.pk, email=user.email, password=user.password)
+        self.primary_ad = Ad.objects.create(title='On primary', price=100, author=self.user)
+        self.replica_ad = Ad.objects.using('replica').create(
+            pk=self.primary_ad.pk + 100, title='On replica', price=100, author_id=self.user.pk
+        )
+        ads_cache.bump_generation()
+        cache.delete_many([PIN_KEY.format(self.user.pk), PIN_KEY.format(self.other.pk)])
+
+    def titles(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/ads/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [ad['title'] for ad in response.json()['results']]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.titles(self.user), ['On replica'])
+
+        response = self.client.get(f'/ads/{self.primary_ad.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(f'/ads/{self.replica_ad.pk}/')
+        self.assertEqual(response.json()['title'], 'On replica')
+
+    def test_writer_is_pinned_to_primary(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/ads/create/', {'title': 'Just posted', 'price': 10})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Ad.objects.using('replica').filter(title='Just posted').exists())
+
+        self.assertEqual(self.titles(self.user), ['Just posted', 'On primary'])
+        response = self.client.get(f'/ads/{Ad.objects.get(title="Just posted").pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # закрепляется только автор записи
+        self.assertEqual(self.titles(self.other), ['On replica'])
+
+        # с кэшем процесса отметка живёт только в cookie, её видит любой воркер
+        self.assertIsNone(cache.get(PIN_KEY.format(self.user.pk)))
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.titles(self.user), ['On replica'])
+
+    def test_forged_pin_cookie_is_ignored(self):
+        self.client.cookies[PIN_COOKIE] = str(self.user.pk)
+
+        self.assertEqual(self.titles(self.user), ['On replica'])
+
+    def test_reads_without_writes_do_not_pin(self):
+        self.titles(self.user)
+
+        self.assertNotIn(PIN_COOKIE, self.client.cookies)
+        self.assertIsNone(cache.get(PIN_KEY.format(self.user.pk)))
+
+    @override_settings(CACHE_SHARED=True)
+    def test_replica_pages_are_not_cached_right_after_write(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/ads/create/', {'title': 'Just posted', 'price': 10})
+        self.assertEqual(cache.get(PIN_KEY.format(self.user.pk)), 1)
+
+        # другой пользователь читает отстающую реплику: ответ не попадает в новое поколение
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get('/ads/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/ads/')['X-Cache'], 'MISS')
+
+        cache.delete(ads_cache.BUMPED_KEY)
+        self.assertEqual(self.client.get('/ads/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/ads/')['X-Cache'], 'HIT')
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Ad))
+        self.assertEqual(router.db_for_write(Ad), 'default')
+
+        token = read_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Ad), 'replica')
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Ad))
+        finally:
+            read_from_replica.reset(token)
+
+
+class PooledSQLiteWrapper(PooledConnectionMixin, sqlite_base.DatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'pool.sqlite3')
+        self.wrappers = []
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+        clear_pools('pool_test')
+        self.tmpdir.cleanup()
+
+    def connect(self, **pool):
+        wrapper = PooledSQLiteWrapper({
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': self.path,
+            'ATOMIC_REQUESTS': False,
+            'AUTOCOMMIT': True,
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {},
+            'TIME_ZONE': None,
+            'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+            'TEST': {},
+            'POOL': {'MAX_SIZE': 2, 'MAX_AGE': 600, 'TIMEOUT': 0.05, 'PING_AFTER': 5, **pool},
+        }, alias='pool_test')
+        self.wrappers.append(wrapper)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_connection_is_reused(self):
+        wrapper = self.connect()
+        raw = wrapper.connection
+        wrapper.close()
+
+        self.assertEqual(wrapper.connection_pool.stats(), {'size': 1, 'idle': 1, 'in_use': 0})
+        wrapper.ensure_connection()
+        self.assertIs(wrapper.connection, raw)
+        self.assertEqual(wrapper.connection_pool.stats(), {'size': 1, 'idle': 0, 'in_use': 1})
+
+    def test_pool_size_limit(self):
+        first = self.connect()
+        self.connect()
+
+        with self.assertRaises(PoolTimeout):
+            self.connect()
+
+        first.close()
+        third = self.connect()
+        self.assertEqual(third.connection_pool.stats(), {'size': 2, 'idle': 0, 'in_use': 2})
+
+    def test_max_age(self):
+        wrapper = self.connect(MAX_AGE=0)
+        raw = wrapper.connection
+        wrapper.close()
+
+        self.assertEqual(wrapper.connection_pool.stats()['size'], 0)
+        wrapper.ensure_connection()
+        self.assertIsNot(wrapper.connection, raw)
+
+    def test_dead_connection_is_replaced(self):
+        wrapper = self.connect(PING_AFTER=0)
+        raw = wrapper.connection
+        wrapper.close()
+        # подключение закрыто "сервером", пока лежало в пуле
+        raw.close()
+
+        wrapper.ensure_connection()
+        self.assertIsNot(wrapper.connection, raw)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertEqual(wrapper.connection_pool.stats(), {'size': 1, 'idle': 0, 'in_use': 1})
+
+    def test_open_transaction_is_rolled_back(self):
+        wrapper = self.connect()
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE pooled (id integer)')
+        wrapper.set_autocommit(False)
+        with wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO pooled VALUES (1)')
+        wrapper.close()
+
+        wrapper.ensure_connection()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM pooled')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_pools_are_per_database(self):
+        wrapper = self.connect()
+        wrapper.close()
+
+        self.path = os.path.join(self.tmpdir.name, 'other.sqlite3')
+        other = self.connect()
+        self.assertIsNot(other.connection_pool, wrapper.connection_pool)
+
+
+class ValuesSerializerTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='With image', price=Decimal('10.5'), description='Text',
+            image='ads_images/photo.png', author=self.user,
+        )
+        self.ad2 = Ad.objects.create(title='Bare', price=0)
+        Ad.objects.filter(pk=self.ad2.pk).update(image='')
+        Comment.objects.create(text='Hi', ad=self.ad1, author=self.user)
+        Comment.objects.create(text='Anonymous')
+        self.request = Request(APIRequestFactory().get('/ads/'))
+
+    def render(self, serializer_class, data):
+        return JSONRenderer().render(serializer_class(data, many=True, context={'request': self.request}).data)
+
+    def test_ads_are_byte_identical(self):
+        queryset = Ad.objects.order_by('id')
+        values = AdValuesSerializer(context={'request': self.request}).prepare(queryset)
+
+        expected = self.render(AdSerializer, queryset)
+        self.assertEqual(self.render(AdValuesSerializer, values), expected)
+        self.assertIn(b'"image":"http://testserver/django_media/ads_images/photo.png"', expected)
+        self.assertIn(b'"price":"10.50"', expected)
+        self.assertIn(b'"image":null', expected)
+
+    def test_comments_are_byte_identical(self):
+        queryset = Comment.objects.order_by('id')
+        values = CommentValuesSerializer().prepare(queryset)
+
+        self.assertEqual(self.render(CommentValuesSerializer, values), self.render(CommentSerializer, queryset))
+
+    def test_list_views(self):
+        self.client.force_authenticate(user=self.user)
+        ads_cache.bump_generation()
+
+        response = self.client.get('/ads/?pagination=cursor')
+        self.assertEqual(
+            response.json()['results'],
+            json.loads(self.render(AdSerializer, Ad.objects.order_by('-created_at', '-id')))
+        )
+
+        response = self.client.get(f'/ads/{self.ad1.pk}/comments/')
+        self.assertEqual(
+            response.json()['results'],
+            json.loads(self.render(CommentSerializer, Comment.objects.filter(ad=self.ad1)))
+        )
+
+
+class AdSnapshotTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='With image', price=Decimal('10.5'), description='Text',
+            image='ads_images/photo.png', author=self.user,
+        )
+        self.ad2 = Ad.objects.create(title='Bare', price=0, author=self.user)
+        self.request = Request(APIRequestFactory().get('/ads/'))
+        self.client.force_authenticate(user=self.user)
+        ads_cache.bump_generation()
+
+    def render(self, data, many=False):
+        return JSONRenderer().render(AdSerializer(data, many=many, context={'request': self.request}).data)
+
+    def test_snapshot_is_built_on_save(self):
+        self.ad1.refresh_from_db()
+
+        self.assertEqual(self.ad1.snapshot_version, self.ad1.updated_at)
+        self.assertIn('"image":"/django_media/ads_images/photo.png"', self.ad1.snapshot)
+
+    def test_retrieve_is_byte_identical(self):
+        response = self.client.get(reverse('ads:ad_retrieve', args=[self.ad1.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, self.render(Ad.objects.get(pk=self.ad1.pk)))
+        self.assertIn(b'"image":"http://testserver/django_media/ads_images/photo.png"', response.content)
+
+    def test_list_is_byte_identical(self):
+        queryset = Ad.objects.order_by('-created_at', '-id')
+
+        for params in ({'page': 1}, {'pagination': 'cursor'}):
+            response = self.client.get(reverse('ads:ads_list'), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.content.endswith(b'"results":' + self.render(queryset, many=True) + b'}'))
+            self.assertEqual(len(response.json()['results']), 2)
+
+        response = self.client.get(reverse('ads:ads_my_list'))
+        self.assertTrue(response.content.endswith(b'"results":' + self.render(queryset, many=True) + b'}'))
+
+    def test_snapshot_is_served_without_serialization(self):
+        Ad.objects.filter(pk=self.ad2.pk).update(snapshot='{"title":"From snapshot"}')
+
+        response = self.client.get(reverse('ads:ad_retrieve', args=[self.ad2.pk]))
+        self.assertEqual(response.json(), {'title': 'From snapshot'})
+
+        rows = list(SnapshotValuesSerializer().prepare(Ad.objects.filter(pk=self.ad2.pk)))
+        self.assertEqual(bytes(SnapshotValuesSerializer(rows[0]).data), b'{"title":"From snapshot"}')
+
+    def test_stale_snapshot_falls_back(self):
+        Ad.objects.filter(pk=self.ad2.pk).update(title='Changed', updated_at=timezone.now())
+
+        response = self.client.get(reverse('ads:ad_retrieve', args=[self.ad2.pk]))
+        self.assertEqual(response.json()['title'], 'Changed')
+
+        response = self.client.get(reverse('ads:ads_list'), {'page': 1})
+        self.assertEqual([ad['title'] for ad in response.json()['results']], ['Changed', 'With image'])
+
+    def test_comment_refreshes_snapshot(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            for text in ('Hi', 'Hello', 'Bye'):
+                Comment.objects.create(text=text, ad=self.ad1, author=self.user)
+            # до коммита снимок не перестраивается
+            self.ad1.refresh_from_db()
+            self.assertNotEqual(self.ad1.snapshot_version, self.ad1.updated_at)
+
+        # один пересчёт снимка на объявление за транзакцию
+        self.assertEqual(sum('SET "snapshot" = ' in query['sql'] for query in queries.captured_queries), 1)
+
+        response = self.client.get(reverse('ads:ad_retrieve', args=[self.ad1.pk]))
+        self.assertEqual(response.json()['comments_count'], 3)
+        self.assertEqual(response.content, self.render(Ad.objects.get(pk=self.ad1.pk)))
+
+        self.ad1.refresh_from_db()
+        self.assertEqual(self.ad1.snapshot_version, self.ad1.updated_at)
+
+    def test_browsable_api(self):
+        response = self.client.get(reverse('ads:ads_list'), {'page': 1, 'format': 'api'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'With image', response.content)
+
+    def test_reconcile_ad_snapshots(self):
+        Ad.objects.filter(pk=self.ad1.pk).update(snapshot=None)
+        Ad.objects.filter(pk=self.ad2.pk).update(title='Changed')
+
+        out = StringIO()
+        call_command('reconcile_ad_snapshots', dry_run=True, stdout=out)
+        self.assertIn('Checked 2 ads, broken 2', out.getvalue())
+        self.assertIsNone(Ad.objects.get(pk=self.ad1.pk).snapshot)
+
+        out = StringIO()
+        call_command('reconcile_ad_snapshots', batch_size=1, stdout=out)
+        self.assertIn('Checked 2 ads, repaired 2', out.getvalue())
+
+        response = self.client.get(reverse('ads:ad_retrieve', args=[self.ad2.pk]))
+        self.assertEqual(response.json()['title'], 'Changed')
+        self.assertEqual(response.content, self.render(Ad.objects.get(pk=self.ad2.pk)))
+
+        out = StringIO()
+        call_command('reconcile_ad_snapshots', stdout=out)
+        self.assertIn('Checked 2 ads, repaired 0', out.getvalue())
+
+
+class RenderersTestCase(SimpleTestCase):
+    def test_json_is_byte_identical(self):
+        moscow = datetime.timezone(datetime.timedelta(hours=3))
+        values = [
+            {'price': Decimal('10.50'), 'title': 'Велосипед\u2028', 1: None, 'tags': ('a', 2.5, True)},
+            {'utc': datetime.datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc)},
+            {'local': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=moscow)},
+            {'naive': datetime.datetime(2024, 1, 2, 3, 4, 5), 'date': datetime.date(2024, 1, 2)},
+            {'delta': datetime.timedelta(hours=1), 'lazy': gettext_lazy('Enter a valid phone number.')},
+            {'errors': [ErrorDetail('Bad', code='invalid')], 'big': 2 ** 70},
+            [],
+        ]
+        for value in values:
+            self.assertEqual(ORJSONRenderer().render(value), JSONRenderer().render(value))
+
+    def test_phone_number(self):
+        self.assertEqual(
+            ORJSONRenderer().render({'phone': to_phone_number('+79001234567')}),
+            b'{"phone":"+79001234567"}'
+        )
+
+    def test_indent_falls_back_to_json_renderer(self):
+        self.assertEqual(
+            ORJSONRenderer().render({'a': 1}, 'application/json; indent=2'),
+            b'{\n  "a": 1\n}'
+        )
+
+    def test_messagepack(self):
+        data = {
+            'price': Decimal('10.50'),
+            'created_at': datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            'phone': to_phone_number('+79001234567'),
+        }
+
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(data)),
+            {'price': 10.5, 'created_at': '2024-01-02T03:04:05Z', 'phone': '+79001234567'}
+        )
+
+    def test_parsers(self):
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"title": "Лыжи"}'.encode())), {'title': 'Лыжи'})
+        self.assertEqual(MessagePackParser().parse(BytesIO(msgpack.packb({'title': 'Лыжи'}))), {'title': 'Лыжи'})
+
+        with self.assertRaisesMessage(ParseError, 'JSON parse error'):
+            ORJSONParser().parse(BytesIO(b'{"title": NaN}'))
+        with self.assertRaisesMessage(ParseError, 'MessagePack parse error'):
+            MessagePackParser().parse(BytesIO(b'\xc1'))
+
+
+class MessagePackAPITestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test1@mail.com',
+            password='123qwe456rty'
+        )
+        self.ad1 = Ad.objects.create(
+            title='With image', price=Decimal('10.5'),
+            image='ads_images/photo.png', author=self.user,
+        )
+        self.client.force_authenticate(user=self.user)
+        ads_cache.bump_generation()
+
+    @override_settings(CACHE_SHARED=True)
+    def test_list_and_retrieve(self):
+        for url in (reverse('ads:ads_list'), reverse('ads:ad_retrieve', args=[self.ad1.pk])):
+            json_response = self.client.get(url)
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content), json_response.json())
+            self.assertNotEqual(response['ETag'], json_response['ETag'])
+            self.assertIn('Accept', response['Vary'])
+
+    def test_create(self):
+        response = self.client.post(
+            reverse('ads:ads_create'),
+            msgpack.packb({'title': 'NewOne', 'price': '99.90'}),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(response.content)['price'], '99.90')
@@ -7,7 +7,8 @@ from ads.views import (AdListAPIView, AdCreateAPIView,
                        AdPatchAPIView, AdDestroyAPIView,
                        CommentListAPIView, CommentCreateAPIView,
                        CommentRetrieveAPIView, CommentPatchAPIView,
-                       CommentDestroyAPIView
+                       CommentDestroyAPIView, AdBulkCreateAPIView,
+                       AdBulkUpdateAPIView, AdBulkDestroyAPIView
                        )
 
 app_name = SalesConfig.name
@@ -19,6 +20,9 @@ urlpatterns = [
     path('ads/<int:pk>/', AdRetrieveAPIView.as_view(), name='ad_retrieve'),
     path('ads/update/<int:pk>/', AdPatchAPIView.as_view(), name='ad_patch'),
     path('ads/delete/<int:pk>/', AdDestroyAPIView.as_view(), name='ad_delete'),
+    path('ads/bulk/create/', AdBulkCreateAPIView.as_view(), name='ads_bulk_create'),
+    path('ads/bulk/update/', AdBulkUpdateAPIView.as_view(), name='ads_bulk_update'),
+    path('ads/bulk/delete/', AdBulkDestroyAPIView.as_view(), name='ads_bulk_delete'),
 
     path('ads/<int:ad_pk>/comments/', CommentListAPIView.as_view(), name='comments'),
     path('ads/<int:ad_pk>/comments/create/', CommentCreateAPIView.as_view(), name='comments_create'),
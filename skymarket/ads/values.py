@@ -0,0 +1,121 @@
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from skymarket.timing import timed_serializer
+
+# Быстрый путь чтения для списков.
+# Вместо экземпляров моделей страница выбирается через values() - только нужные
+# колонки, - и каждая строка превращается в словарь напрямую. Поля, источники и
+# to_representation берутся у обычного ModelSerializer (Meta.serializer), поэтому
+# ответ совпадает с ним байт в байт: для строк, чисел и PK значение из БД
+# отдаётся как есть, для остальных полей вызывается to_representation того же поля.
+
+# поля, у которых to_representation для значения из БД ничего не меняет
+IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+class ValuesSerializer(serializers.BaseSerializer):
+    """
+    Сериализатор строк values() только для чтения, зеркало `Meta.serializer`.
+    Поддерживаются поля модели и PrimaryKeyRelatedField без вложенных источников.
+    """
+
+    class Meta:
+        serializer = None
+
+    # колонки сверх полей вывода; id нужен keyset-пагинации
+    extra_columns = ('id',)
+
+    @property
+    def columns(self):
+        columns = [column for _, column, _ in self.plan]
+        return columns + [column for column in self.extra_columns if column not in columns]
+
+    def prepare(self, queryset):
+        return queryset.values(*self.columns)
+
+    @property
+    def plan(self):
+        plan = getattr(self, '_plan', None)
+        if plan is None:
+            plan = self._plan = self.plan_for(self.Meta.serializer(context=self.context))
+        return plan
+
+    @staticmethod
+    def plan_for(serializer):
+        model = serializer.Meta.model
+        plan = []
+        for field in serializer._readable_fields:
+            if '.' in field.source or field.source == '*':
+                raise ImproperlyConfigured(f'{field.field_name}: nested sources are not supported by values()')
+            model_field = model._meta.get_field(field.source)
+
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                plan.append((field.field_name, model_field.attname, None))
+            elif isinstance(field, serializers.FileField):
+                # values() отдаёт имя файла, а поле ожидает FieldFile с url
+                plan.append((field.field_name, model_field.attname, file_converter(field, model_field)))
+            elif isinstance(field, serializers.DateTimeField):
+                plan.append((field.field_name, model_field.attname, datetime_converter(field)))
+            elif isinstance(field, serializers.RelatedField):
+                raise ImproperlyConfigured(f'{field.field_name}: only primary key relations are supported')
+            elif type(field).to_representation in {cls.to_representation for cls in IDENTITY_FIELDS}:
+                plan.append((field.field_name, model_field.attname, None))
+            else:
+                plan.append((field.field_name, model_field.attname, field.to_representation))
+        return plan
+
+    def to_representation(self, row):
+        data = {}
+        for name, column, convert in self.plan:
+            value = row[column]
+            # как в Serializer.to_representation: None не проходит через поле
+            data[name] = convert(value) if convert is not None and value is not None else value
+        return data
+
+
+def file_converter(field, model_field):
+    def convert(name):
+        return field.to_representation(model_field.attr_class(None, model_field, name))
+    return convert
+
+
+def datetime_converter(field):
+    """
+    DateTimeField.to_representation для ISO 8601 без повторного поиска часового
+    пояса на каждом значении: пояс определяется один раз на страницу.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+class ValuesListMixin:
+    """
+    list() через ValuesSerializer (`values_serializer_class`) для GET-списков.
+    Фильтры, сортировка и пагинация те же, меняется только выборка строк страницы.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.values_serializer_class
+        context = self.get_serializer_context()
+        queryset = serializer_class(context=context).prepare(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = timed_serializer(serializer_class(page, many=True, context=context))
+            return self.get_paginated_response(serializer.data)
+
+        serializer = timed_serializer(serializer_class(queryset, many=True, context=context))
+        return Response(serializer.data)
@@ -1,28 +1,55 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView, CreateAPIView, RetrieveAPIView, UpdateAPIView, DestroyAPIView, \
     get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from ads.cache import CachedListMixin, collection_version, invalidate
+from ads.conditional import ConditionalListMixin, ConditionalRetrieveMixin
 from ads.models import Ad, Comment
-from ads.serializers import AdSerializer, CommentSerializer
+from ads.serializers import AdSerializer, CommentSerializer, CommentValuesSerializer
 from ads.permissions import IsOwnerOrAdmin, IsCommentOwnerOrAdmin
 from ads.pagination import AdPagination, CommentPagination
 from ads.filters import AdFilter
+from ads.ordering import IndexedOrderingFilter
+from ads.snapshots import SnapshotRetrieveMixin, SnapshotValuesSerializer, SnapshotViewMixin, refresh_snapshots
+from ads.values import ValuesListMixin
+from skymarket.db_router import ReplicaReadMixin
+from skymarket.timing import SerializerTimingMixin
 
 
-class AdListAPIView(ListAPIView):
+class AdListAPIView(ReplicaReadMixin, ConditionalListMixin, CachedListMixin, SnapshotViewMixin, ValuesListMixin,
+                    SerializerTimingMixin, ListAPIView):
     serializer_class = AdSerializer
+    values_serializer_class = SnapshotValuesSerializer
     pagination_class = AdPagination
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, IndexedOrderingFilter]
     filterset_class = AdFilter
+    ordering = '-created_at'
+    ordering_indexes = {
+        'created_at': 'ads_ad_created_idx',
+        'price': 'ads_ad_price_idx',
+    }
 
     def get_queryset(self):
-        ordering = self.request.query_params.get('ordering', '-created_at')
-        return Ad.objects.order_by(ordering)
+        return Ad.objects.all()
+
+    def get_collection_fingerprint(self):
+        # агрегат по всей таблице на каждый запрос стоил бы полного прохода, поэтому версией
+        # служит поколение кэша списков; без общего кэша ETag не выдаётся
+        version = collection_version()
+        return None if version is None else str(version)
 
 
-class AdCreateAPIView(CreateAPIView):
+class AdCreateAPIView(SerializerTimingMixin, CreateAPIView):
     serializer_class = AdSerializer
     permission_classes = [IsAuthenticated]
 
@@ -30,23 +57,38 @@ class AdCreateAPIView(CreateAPIView):
         serializer.save(author=self.request.user)
 
 
-class AdMyListAPIView(ListAPIView):
+class AdMyListAPIView(ReplicaReadMixin, ConditionalListMixin, SnapshotViewMixin, ValuesListMixin, SerializerTimingMixin,
+                      ListAPIView):
     serializer_class = AdSerializer
+    values_serializer_class = SnapshotValuesSerializer
     pagination_class = AdPagination
     permission_classes = [IsAuthenticated]
+    filter_backends = [IndexedOrderingFilter]
+    ordering = '-created_at'
+    ordering_indexes = {
+        'created_at': 'ads_ad_author_created_idx',
+    }
 
     def get_queryset(self):
-        ordering = self.request.query_params.get('ordering', '-created_at')
-        return Ad.objects.filter(author=self.request.user).order_by(ordering)
+        return Ad.objects.filter(author=self.request.user)
+
+    def get_collection_fingerprint(self):
+        version = collection_version()
+        # URL у всех пользователей один, а списки разные
+        return None if version is None else f'{self.request.user.pk}:{version}'
 
 
-class AdRetrieveAPIView(RetrieveAPIView):
+class AdRetrieveAPIView(ReplicaReadMixin, ConditionalRetrieveMixin, SnapshotRetrieveMixin, SerializerTimingMixin,
+                        RetrieveAPIView):
     queryset = Ad.objects.all()
     serializer_class = AdSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_last_modified(self):
+        return self.queryset.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
 
-class AdPatchAPIView(UpdateAPIView):
+
+class AdPatchAPIView(SerializerTimingMixin, UpdateAPIView):
     queryset = Ad.objects.all()
     serializer_class = AdSerializer
     permission_classes = [IsOwnerOrAdmin, IsAuthenticated]
@@ -58,18 +100,24 @@ class AdDestroyAPIView(DestroyAPIView):
     permission_classes = [IsOwnerOrAdmin, IsAuthenticated]
 
 
-class CommentListAPIView(ListAPIView):
+class CommentListAPIView(ReplicaReadMixin, ConditionalListMixin, ValuesListMixin, SerializerTimingMixin,
+                         ListAPIView):
     serializer_class = CommentSerializer
+    values_serializer_class = CommentValuesSerializer
     pagination_class = CommentPagination
     permission_classes = [IsAuthenticated]
+    filter_backends = [IndexedOrderingFilter]
+    ordering = '-created_at'
+    ordering_indexes = {
+        'created_at': 'ads_comment_ad_created_idx',
+    }
 
     def get_queryset(self):
         ad_pk = self.kwargs.get('ad_pk')
-        ordering = self.request.query_params.get('ordering', '-created_at')
-        return Comment.objects.filter(ad__pk=ad_pk).order_by(ordering)
+        return Comment.objects.filter(ad__pk=ad_pk)
 
 
-class CommentCreateAPIView(CreateAPIView):
+class CommentCreateAPIView(SerializerTimingMixin, CreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
 
@@ -79,11 +127,16 @@ class CommentCreateAPIView(CreateAPIView):
         serializer.save(author=self.request.user, ad=ad)
 
 
-class CommentRetrieveAPIView(RetrieveAPIView):
+class CommentRetrieveAPIView(ReplicaReadMixin, ConditionalRetrieveMixin, SerializerTimingMixin, RetrieveAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_last_modified(self):
+        return self.queryset.filter(
+            ad_id=self.kwargs['ad_pk'], id=self.kwargs['com_pk']
+        ).values_list('updated_at', flat=True).first()
+
     def get_object(self):
         try:
             return self.queryset.get(ad_id=self.kwargs['ad_pk'], id=self.kwargs['com_pk'])
@@ -91,7 +144,7 @@ class CommentRetrieveAPIView(RetrieveAPIView):
             return None
 
 
-class CommentPatchAPIView(UpdateAPIView):
+class CommentPatchAPIView(SerializerTimingMixin, UpdateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsCommentOwnerOrAdmin, IsAuthenticated]
@@ -113,3 +166,135 @@ class CommentDestroyAPIView(DestroyAPIView):
             return self.queryset.get(ad_id=self.kwargs['ad_pk'], id=self.kwargs['com_pk'])
         except Comment.DoesNotExist or Ad.DoesNotExist:
             return None
+
+
+class AdBulkMixin:
+    """
+    Общая часть массовых операций с объявлениями.
+
+    Операции выполняются по принципу "всё или ничего" в одной транзакции:
+    если хотя бы один элемент не прошёл проверку, ничего не меняется и
+    возвращается 400 со статусом каждого элемента.
+    """
+    permission_classes = [IsAuthenticated]
+    max_batch_size = 1000
+    object_permission_class = IsOwnerOrAdmin
+
+    def get_items(self, data):
+        if not isinstance(data, list) or not data:
+            raise ValidationError({'non_field_errors': ['Expected a non-empty list of items.']})
+        if len(data) > self.max_batch_size:
+            raise ValidationError({'non_field_errors': [f'No more than {self.max_batch_size} items per request.']})
+        return data
+
+    def check_ads(self, ids):
+        """
+        Одним запросом загружает и блокирует (SELECT ... FOR UPDATE) объявления
+        и проверяет IsOwnerOrAdmin для каждого; вызывается внутри транзакции.
+        Возвращает словарь разрешённых объявлений и ошибки по индексам элементов.
+        """
+        # блокировки берутся в порядке pk, чтобы встречные пачки не взаимоблокировались
+        ads = Ad.objects.select_for_update().order_by('pk').in_bulk([pk for pk in ids if pk is not None])
+        permission = self.object_permission_class()
+        allowed, errors = {}, {}
+        for index, pk in enumerate(ids):
+            ad = ads.get(pk)
+            if pk is None:
+                errors[index] = {'index': index, 'status': 'invalid', 'errors': {'id': ['A valid integer is required.']}}
+            elif ad is None:
+                errors[index] = {'index': index, 'id': pk, 'status': 'not_found'}
+            elif not permission.has_object_permission(self.request, self, ad):
+                errors[index] = {'index': index, 'id': pk, 'status': 'forbidden', 'detail': permission.message}
+            else:
+                allowed[pk] = ad
+        return allowed, errors
+
+    @staticmethod
+    def get_id(value):
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+class AdBulkCreateAPIView(AdBulkMixin, APIView):
+
+    def post(self, request):
+        items = self.get_items(request.data)
+        serializer = AdSerializer(data=items, many=True)
+        if not serializer.is_valid():
+            results = [
+                {'index': index, 'status': 'invalid', 'errors': errors} if errors else {'index': index, 'status': 'ok'}
+                for index, errors in enumerate(serializer.errors)
+            ]
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            ads = serializer.save(author=request.user)
+            # без id (SQLite) снимки достроит reconcile_ad_snapshots
+            refresh_snapshots(ad.pk for ad in ads if ad.pk is not None)
+            invalidate()
+
+        # id известен, только если БД возвращает его из bulk INSERT (PostgreSQL)
+        results = [{'index': index, 'id': ad.pk, 'status': 'created'} for index, ad in enumerate(ads)]
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+
+class AdBulkUpdateAPIView(AdBulkMixin, APIView):
+
+    def patch(self, request):
+        items = self.get_items(request.data)
+        ids = [self.get_id(item.get('id')) if isinstance(item, dict) else None for item in items]
+
+        with transaction.atomic():
+            allowed, errors = self.check_ads(ids)
+
+            # каждое объявление записывается только с теми полями, которые в нём меняли,
+            # иначе общий bulk_update затёр бы остальные поля прочитанными значениями
+            results, groups = [], defaultdict(list)
+            for index, (pk, item) in enumerate(zip(ids, items)):
+                if index in errors:
+                    results.append(errors[index])
+                    continue
+
+                serializer = AdSerializer(allowed[pk], data=item, partial=True)
+                if not serializer.is_valid():
+                    results.append({'index': index, 'id': pk, 'status': 'invalid', 'errors': serializer.errors})
+                    continue
+
+                ad = allowed[pk]
+                for field, value in serializer.validated_data.items():
+                    setattr(ad, field, value)
+                groups[tuple(sorted(serializer.validated_data))].append(ad)
+                results.append({'index': index, 'id': pk, 'status': 'updated'})
+
+            if sum(len(ads) for ads in groups.values()) != len(items):
+                return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+            # bulk_update не вызывает pre_save, поэтому auto_now проставляется вручную
+            now = timezone.now()
+            for fields, ads in groups.items():
+                for ad in ads:
+                    ad.updated_at = now
+                Ad.objects.bulk_update(ads, [*fields, 'updated_at'], batch_size=500)
+            refresh_snapshots(ad.pk for ads in groups.values() for ad in ads)
+            invalidate()
+
+        return Response({'results': results})
+
+
+class AdBulkDestroyAPIView(AdBulkMixin, APIView):
+
+    def delete(self, request):
+        data = request.data.get('ids') if isinstance(request.data, dict) else None
+        ids = [self.get_id(pk) for pk in self.get_items(data)]
+        with transaction.atomic():
+            allowed, errors = self.check_ads(ids)
+
+            results = [
+                errors.get(index, {'index': index, 'id': pk, 'status': 'deleted'})
+                for index, pk in enumerate(ids)
+            ]
+            if errors:
+                return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+            Ad.objects.filter(pk__in=allowed).delete()
+
+        return Response({'results': results})
@@ -0,0 +1,47 @@
+"""
+Микробенчмарки проекта.
+
+Запуск из каталога skymarket: `python -m benchmarks.<имя_модуля>`.
+Каждый бенчмарк работает на временной тестовой базе (как `manage.py test`),
+поэтому рабочие данные не затрагиваются.
+"""
+import contextlib
+import os
+import time
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'skymarket.settings')
+
+    import django
+
+    django.setup()
+
+
+@contextlib.contextmanager
+def temporary_database(alias='default'):
+    from django.db import connections
+
+    connection = connections[alias]
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def best_of(func, repeat=5, number=1):
+    """Лучшее время одного вызова `func` в секундах из `repeat` замеров по `number` вызовов."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started) / number)
+    return min(timings)
+
+
+def print_table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in [header, *rows]:
+        print('  '.join(str(cell).rjust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,73 @@
+"""
+Выборка и сериализация страницы объявлений: AdSerializer по экземплярам,
+AdValuesSerializer по строкам values() и склейка готовых снимков Ad.snapshot
+(ads/snapshots.py) SnapshotJSONRenderer. Вывод всех путей сверяется байт в байт.
+
+    python -m benchmarks.bench_ad_snapshots
+"""
+from benchmarks import best_of, print_table, setup_django, temporary_database
+
+SIZES = (1_000, 10_000)
+
+
+def seed(count):
+    from ads.models import Ad
+    from ads.snapshots import refresh_snapshots
+    from users.models import User
+
+    author = User.objects.create(email='author@example.com')
+    Ad.objects.bulk_create(
+        [Ad(title=f'Ad {i}', price=i, description='Lorem ipsum ' * 5, author=author,
+            image=f'ads_images/{i}.png' if i % 2 else '')
+         for i in range(count)],
+        batch_size=5_000,
+    )
+    refresh_snapshots(Ad.objects.values_list('pk', flat=True))
+
+
+def main():
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from ads.models import Ad
+    from ads.serializers import AdSerializer, AdValuesSerializer
+    from ads.snapshots import SnapshotJSONRenderer, SnapshotValuesSerializer
+
+    context = {'request': Request(APIRequestFactory().get('/ads/'))}
+    rows = []
+    with temporary_database():
+        seed(max(SIZES))
+        for count in SIZES:
+            queryset = Ad.objects.order_by('-created_at', '-id')[:count]
+
+            def model_path():
+                # all(): без него повторные замеры брали бы строки из кэша queryset
+                return JSONRenderer().render(AdSerializer(list(queryset.all()), many=True, context=context).data)
+
+            def values_path(serializer_class=AdValuesSerializer, renderer_class=JSONRenderer):
+                page = list(serializer_class(context=context).prepare(queryset))
+                return renderer_class().render(serializer_class(page, many=True, context=context).data)
+
+            def snapshot_path():
+                return values_path(SnapshotValuesSerializer, SnapshotJSONRenderer)
+
+            assert model_path() == values_path() == snapshot_path()
+            model_time = best_of(model_path, repeat=3)
+            values_time = best_of(values_path, repeat=3)
+            snapshot_time = best_of(snapshot_path, repeat=3)
+            rows.append((
+                count,
+                f'{model_time * 1000:.1f}',
+                f'{values_time * 1000:.1f}',
+                f'{snapshot_time * 1000:.1f}',
+                f'{model_time / snapshot_time:.1f}x',
+            ))
+
+    print_table(('rows', 'AdSerializer, ms', 'values(), ms', 'snapshots, ms', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Фильтр объявлений по подстроке email автора: icontains через JOIN против
+триграммного индекса (users.search). Время индексного варианта должно
+почти не расти с числом пользователей и объявлений.
+
+    python -m benchmarks.bench_author_email
+"""
+from benchmarks import best_of, print_table, setup_django, temporary_database
+
+SIZES = (2_000, 20_000, 100_000)
+ADS_PER_USER = 3
+
+
+def seed(count, start):
+    from ads.models import Ad
+    from users.models import User
+
+    User.objects.bulk_create(
+        [User(email=f'user{i}@example{i % 50}.com', password='') for i in range(start, count)],
+        batch_size=5_000,
+    )
+    # SQLite не возвращает pk из bulk_create, поэтому id новых авторов читаются отдельно
+    author_ids = User.objects.order_by('-id').values_list('id', flat=True)[:count - start]
+    Ad.objects.bulk_create(
+        [Ad(title=f'Ad {author_id}-{n}', price=n, author_id=author_id)
+         for author_id in author_ids for n in range(ADS_PER_USER)],
+        batch_size=5_000,
+    )
+
+
+def main():
+    setup_django()
+
+    from ads.models import Ad
+    from users.search import users_with_email_containing
+
+    rows = []
+    with temporary_database():
+        seeded = 0
+        for size in SIZES:
+            seed(size, seeded)
+            seeded = size
+            # искомый пользователь один, как на экране модерации
+            needle = f'user{size // 2}@'
+
+            def scan():
+                return list(Ad.objects.filter(author__email__icontains=needle).values_list('id', flat=True))
+
+            def indexed():
+                authors = users_with_email_containing(needle).values('id')
+                return list(Ad.objects.filter(author__in=authors).values_list('id', flat=True))
+
+            assert sorted(scan()) == sorted(indexed())
+            rows.append((
+                size,
+                size * ADS_PER_USER,
+                f'{best_of(scan) * 1000:.2f}',
+                f'{best_of(indexed) * 1000:.2f}',
+            ))
+
+    print_table(('users', 'ads', 'icontains, ms', 'trigram, ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Латентность "запроса" (подключение + SELECT 1 + конец запроса, как его
+закрывает Django по сигналу request_finished) в трёх режимах:
+новое подключение на каждый запрос (CONN_MAX_AGE = 0), постоянное подключение
+потока (CONN_MAX_AGE = None) и пул skymarket.db_pool.
+
+    python -m benchmarks.bench_db_pool
+
+Разница заметна на PostgreSQL (DB_ENGINE=django.db.backends.postgresql или
+skymarket.backends.postgresql, особенно с TLS и через сеть); на SQLite
+подключение почти бесплатно.
+"""
+import statistics
+import time
+
+from benchmarks import print_table, setup_django, temporary_database
+
+REQUESTS = 500
+
+
+def main():
+    setup_django()
+
+    from django.db import connection
+    from django.db.utils import load_backend
+
+    from skymarket.db_pool import PooledConnectionMixin, clear_pools
+
+    with temporary_database():
+        settings_dict = dict(connection.settings_dict)
+        backend = load_backend(settings_dict['ENGINE'])
+        # базовый класс без пула, даже если ENGINE уже skymarket.backends.postgresql
+        plain_class = next(
+            cls for cls in backend.DatabaseWrapper.__mro__
+            if cls.__name__ == 'DatabaseWrapper' and not issubclass(cls, PooledConnectionMixin)
+        )
+        pooled_class = type('DatabaseWrapper', (PooledConnectionMixin, plain_class), {})
+
+        modes = [
+            ('connect per request', plain_class, {'CONN_MAX_AGE': 0}),
+            ('persistent', plain_class, {'CONN_MAX_AGE': None}),
+            ('pool', pooled_class, {'CONN_MAX_AGE': 0}),
+        ]
+        rows = []
+        for name, wrapper_class, overrides in modes:
+            wrapper = wrapper_class({**settings_dict, **overrides}, alias='bench')
+            timings = []
+            for _ in range(REQUESTS):
+                started = time.perf_counter()
+                with wrapper.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                wrapper.close_if_unusable_or_obsolete()
+                timings.append(time.perf_counter() - started)
+            wrapper.close()
+            clear_pools('bench')
+
+            timings.sort()
+            rows.append((
+                name,
+                f'{statistics.median(timings) * 1e6:.0f}',
+                f'{timings[int(len(timings) * 0.99)] * 1e6:.0f}',
+                f'{statistics.mean(timings) * 1e6:.0f}',
+            ))
+
+    print_table(('mode', 'p50, us', 'p99, us', 'mean, us'), rows)
+    print(f'{REQUESTS} requests per mode, {connection.vendor}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Накладные расходы аутентификации на один запрос: стандартная
+JWTAuthentication (проверка подписи + SELECT пользователя на каждый запрос)
+против CachedJWTAuthentication (users.authentication) с прогретым LRU.
+
+    python -m benchmarks.bench_jwt_auth
+"""
+import os
+
+from benchmarks import best_of, print_table, setup_django, temporary_database
+
+REQUESTS = 2_000
+TOKENS = (1, 100, 1_000)
+
+
+def count_queries(connection, func):
+    executed = []
+
+    def counter(execute, sql, params, many, context):
+        executed.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(counter):
+        func()
+    return len(executed)
+
+
+def main():
+    # один процесс: LocMemCache для него общий, иначе кэш токенов выключен
+    os.environ.setdefault('CACHE_SHARED', '1')
+    setup_django()
+
+    from django.db import connection
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from users.authentication import CachedJWTAuthentication, token_user_cache
+    from users.models import User
+
+    factory = APIRequestFactory()
+    rows = []
+    with temporary_database():
+        users = [User.objects.create(email=f'user{i}@example.com') for i in range(max(TOKENS))]
+        for count in TOKENS:
+            requests = [
+                factory.get('/ads/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+                for user in users[:count]
+            ]
+
+            def run(authentication):
+                for i in range(REQUESTS):
+                    authentication.authenticate(requests[i % count])
+
+            plain = JWTAuthentication()
+            cached = CachedJWTAuthentication()
+            token_user_cache.clear()
+            run(cached)  # прогрев
+
+            plain_time = best_of(lambda: run(plain), repeat=3)
+            cached_time = best_of(lambda: run(cached), repeat=3)
+            plain_queries = count_queries(connection, lambda: run(plain))
+            cached_queries = count_queries(connection, lambda: run(cached))
+
+            rows.append((
+                count,
+                f'{plain_time / REQUESTS * 1e6:.1f}',
+                f'{cached_time / REQUESTS * 1e6:.1f}',
+                plain_queries,
+                cached_queries,
+            ))
+
+    print_table(('tokens', 'jwt, us/req', 'cached, us/req', 'jwt queries', 'cached queries'), rows)
+    print(f'{REQUESTS} requests per run')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Выборка и сериализация списка объявлений и комментариев: ModelSerializer
+по экземплярам моделей против ValuesSerializer по строкам values()
+(ads/values.py). Вывод обоих путей сверяется байт в байт.
+
+    python -m benchmarks.bench_list_serializers
+"""
+from benchmarks import best_of, print_table, setup_django, temporary_database
+
+SIZES = (1_000, 10_000)
+
+
+def seed(count):
+    from ads.models import Ad, Comment
+    from users.models import User
+
+    author = User.objects.create(email='author@example.com')
+    Ad.objects.bulk_create(
+        [Ad(title=f'Ad {i}', price=i, description='Lorem ipsum ' * 5, author=author,
+            image=f'ads_images/{i}.png' if i % 2 else '')
+         for i in range(count)],
+        batch_size=5_000,
+    )
+    ad = Ad.objects.first()
+    Comment.objects.bulk_create(
+        [Comment(text=f'Comment {i}', ad=ad, author=author) for i in range(count)],
+        batch_size=5_000,
+    )
+
+
+def main():
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from ads.models import Ad, Comment
+    from ads.serializers import AdSerializer, AdValuesSerializer, CommentSerializer, CommentValuesSerializer
+
+    context = {'request': Request(APIRequestFactory().get('/ads/'))}
+    rows = []
+    with temporary_database():
+        seed(max(SIZES))
+        cases = (
+            ('ads', Ad.objects.all(), AdSerializer, AdValuesSerializer),
+            # как в CommentListAPIView: комментарии одного объявления по индексу (ad, created_at, id)
+            ('comments', Comment.objects.filter(ad=Ad.objects.first()), CommentSerializer, CommentValuesSerializer),
+        )
+        for count in SIZES:
+            for name, base_queryset, serializer_class, values_serializer_class in cases:
+                queryset = base_queryset.order_by('-created_at', '-id')[:count]
+
+                def model_path():
+                    # all(): без него повторные замеры брали бы строки из кэша queryset
+                    return serializer_class(list(queryset.all()), many=True, context=context).data
+
+                def values_path():
+                    page = list(values_serializer_class(context=context).prepare(queryset))
+                    return values_serializer_class(page, many=True, context=context).data
+
+                assert JSONRenderer().render(model_path()) == JSONRenderer().render(values_path())
+                model_time = best_of(model_path, repeat=3)
+                values_time = best_of(values_path, repeat=3)
+                rows.append((
+                    name,
+                    count,
+                    f'{model_time * 1000:.1f}',
+                    f'{values_time * 1000:.1f}',
+                    f'{model_time / values_time:.1f}x',
+                ))
+
+    print_table(('list', 'rows', 'ModelSerializer, ms', 'values(), ms', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
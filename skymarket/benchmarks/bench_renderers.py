@@ -0,0 +1,78 @@
+"""
+Рендеринг и разбор страницы объявлений и комментариев: JSONRenderer и
+JSONParser DRF против ORJSONRenderer/ORJSONParser и MessagePack
+(skymarket/renderers.py, skymarket/parsers.py). Данные - вывод AdSerializer
+и CommentSerializer; размер ответа показан без сжатия и после gzip.
+
+    python -m benchmarks.bench_renderers
+"""
+import gzip
+from io import BytesIO
+
+from benchmarks import best_of, print_table, setup_django, temporary_database
+from benchmarks.bench_list_serializers import seed
+
+SIZES = (1_000, 10_000)
+
+
+def main():
+    setup_django()
+
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from ads.models import Ad, Comment
+    from ads.serializers import AdValuesSerializer, CommentValuesSerializer
+    from skymarket.parsers import MessagePackParser, ORJSONParser
+    from skymarket.renderers import MessagePackRenderer, ORJSONRenderer
+
+    formats = (
+        ('json (DRF)', JSONRenderer(), JSONParser()),
+        ('json (orjson)', ORJSONRenderer(), ORJSONParser()),
+        ('msgpack', MessagePackRenderer(), MessagePackParser()),
+    )
+    context = {'request': Request(APIRequestFactory().get('/ads/'))}
+    rows = []
+    with temporary_database():
+        seed(max(SIZES))
+        cases = (
+            ('ads', Ad.objects.all(), AdValuesSerializer),
+            ('comments', Comment.objects.filter(ad=Ad.objects.first()), CommentValuesSerializer),
+        )
+        for count in SIZES:
+            for name, queryset, serializer_class in cases:
+                page = list(serializer_class(context=context).prepare(queryset.order_by('-created_at', '-id')[:count]))
+                data = serializer_class(page, many=True, context=context).data
+
+                expected = JSONRenderer().render(data)
+                assert ORJSONRenderer().render(data) == expected
+
+                baseline = None
+                for format_name, renderer, parser in formats:
+                    payload = renderer.render(data)
+                    assert parser.parse(BytesIO(payload)) == JSONParser().parse(BytesIO(expected))
+                    render_time = best_of(lambda: renderer.render(data), repeat=5)
+                    parse_time = best_of(lambda: parser.parse(BytesIO(payload)), repeat=5)
+                    baseline = baseline or render_time
+                    rows.append((
+                        name,
+                        count,
+                        format_name,
+                        f'{render_time * 1000:.2f}',
+                        f'{len(payload) / render_time / 2 ** 20:.0f}',
+                        f'{baseline / render_time:.1f}x',
+                        f'{parse_time * 1000:.2f}',
+                        f'{len(payload) / 1024:.0f}',
+                        f'{len(gzip.compress(payload)) / 1024:.0f}',
+                    ))
+
+    print_table(
+        ('list', 'rows', 'format', 'render, ms', 'MB/s', 'speedup', 'parse, ms', 'size, KB', 'gzip, KB'),
+        rows,
+    )
+
+
+if __name__ == '__main__':
+    main()
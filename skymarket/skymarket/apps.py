@@ -0,0 +1,17 @@
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def install_slow_query_logger(sender, connection, **kwargs):
+    from skymarket.slow_queries import SlowQueryLogger
+
+    if SlowQueryLogger.enabled() and not any(isinstance(w, SlowQueryLogger) for w in connection.execute_wrappers):
+        connection.execute_wrappers.append(SlowQueryLogger())
+
+
+class SkymarketConfig(AppConfig):
+    """Общепроектные вещи, не относящиеся к ads или users: журнал медленных запросов и его отчёт."""
+    name = "skymarket"
+
+    def ready(self):
+        connection_created.connect(install_slow_query_logger)
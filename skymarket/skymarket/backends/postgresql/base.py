@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import base, creation
+
+from skymarket.db_pool import PooledConnectionMixin, clear_pools
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # свободные подключения пула к тестовой базе не дают выполнить DROP DATABASE
+        clear_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(PooledConnectionMixin, base.DatabaseWrapper):
+    """PostgreSQL с пулом подключений процесса: DB_ENGINE=skymarket.backends.postgresql."""
+    creation_class = DatabaseCreation
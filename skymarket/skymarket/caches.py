@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# LocMemCache у каждого процесса свой и вытесняет ключи при переполнении, поэтому
+# общее для воркеров состояние (версии, поколения, метки) в нём хранить нельзя:
+# изменение в одном воркере не дойдёт до остальных, а вытесненный ключ начнёт
+# отсчёт заново. Код, которому нужен общий кэш, без него откатывается к базе.
+LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared(alias='default'):
+    """Виден ли кэш всем воркерам; CACHE_SHARED в настройках переопределяет автоопределение."""
+    shared = getattr(settings, 'CACHE_SHARED', None)
+    if shared is not None:
+        return shared
+    return not isinstance(caches[alias], LOCAL_BACKENDS)
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import DatabaseError
+
+from skymarket.metrics import DB_POOL_CHECKOUTS, DB_POOL_CONNECTIONS, DB_POOL_DISCARDS, DB_POOL_WAIT
+
+# Пул подключений к базе внутри процесса.
+# Django закрывает подключение в конце запроса (CONN_MAX_AGE = 0), а бэкенд
+# с PooledConnectionMixin вместо закрытия возвращает его в пул, и следующий
+# запрос любого потока берёт уже открытое. Настройки - ключ POOL в
+# DATABASES[alias] (см. settings.py):
+#   MAX_SIZE   - максимум подключений процесса к этой базе;
+#   MAX_AGE    - время жизни подключения, секунды;
+#   TIMEOUT    - сколько ждать свободного подключения, когда пул исчерпан;
+#   PING_AFTER - подключение, простоявшее дольше, перед выдачей проверяется SELECT 1.
+# Пул совместим с PgBouncer в режиме transaction: подключение возвращается
+# в пул только вне транзакции, а серверные курсоры отключает DISABLE_SERVER_SIDE_CURSORS.
+
+DEFAULTS = {
+    'MAX_SIZE': 10,
+    'MAX_AGE': 600,
+    'TIMEOUT': 5,
+    'PING_AFTER': 5,
+}
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, alias, max_size, max_age, timeout, ping_after):
+        self.alias = alias
+        self.max_size = max_size
+        self.max_age = max_age
+        self.timeout = timeout
+        self.ping_after = ping_after
+        # свободные подключения: (подключение, время создания, время возврата)
+        self.idle = deque()
+        self.created = {}
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, connect, ping):
+        started = time.monotonic()
+        while True:
+            raw, reused = self.checkout(connect, started)
+            # простоявшее подключение могли закрыть сервер, PgBouncer или сеть
+            if reused is not None and time.monotonic() - reused >= self.ping_after and not ping(raw):
+                self.discard(raw, 'ping')
+                continue
+            DB_POOL_WAIT.labels(self.alias).observe(time.monotonic() - started)
+            self.report()
+            return raw
+
+    def checkout(self, connect, started):
+        with self.condition:
+            while True:
+                while self.idle:
+                    raw, created, returned = self.idle.pop()
+                    if time.monotonic() - created < self.max_age:
+                        DB_POOL_CHECKOUTS.labels(self.alias, 'reused').inc()
+                        return raw, returned
+                    self.close(raw, 'max_age')
+
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    DB_POOL_CHECKOUTS.labels(self.alias, 'timeout').inc()
+                    raise PoolTimeout(
+                        f'No free connection to "{self.alias}" in {self.timeout}s (pool size {self.max_size})'
+                    )
+                self.condition.wait(remaining)
+
+        # подключение открывается вне блокировки, место в пуле уже занято
+        try:
+            raw = connect()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created[raw] = time.monotonic()
+        DB_POOL_CHECKOUTS.labels(self.alias, 'created').inc()
+        return raw, None
+
+    def release(self, raw):
+        with self.condition:
+            created = self.created.get(raw)
+            if created is None:
+                # подключение открыто до сброса пула (fork), к этому пулу не относится
+                self.close_quietly(raw)
+                return
+            if time.monotonic() - created >= self.max_age:
+                self.close(raw, 'max_age')
+            else:
+                self.idle.append((raw, created, time.monotonic()))
+            self.condition.notify()
+        self.report()
+
+    def discard(self, raw, reason):
+        with self.condition:
+            if raw in self.created:
+                self.close(raw, reason)
+            else:
+                self.close_quietly(raw)
+            self.condition.notify()
+        self.report()
+
+    def close(self, raw, reason):
+        # вызывается под блокировкой
+        del self.created[raw]
+        self.size -= 1
+        DB_POOL_DISCARDS.labels(self.alias, reason).inc()
+        self.close_quietly(raw)
+
+    @staticmethod
+    def close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def report(self):
+        idle = len(self.idle)
+        DB_POOL_CONNECTIONS.labels(self.alias, 'idle').set(idle)
+        DB_POOL_CONNECTIONS.labels(self.alias, 'in_use').set(self.size - idle)
+
+    def stats(self):
+        with self.condition:
+            return {'size': self.size, 'idle': len(self.idle), 'in_use': self.size - len(self.idle)}
+
+    def clear(self):
+        with self.condition:
+            while self.idle:
+                raw, _, _ = self.idle.pop()
+                self.close(raw, 'clear')
+        self.report()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict, conn_params):
+    # пул на каждый набор параметров: тестовая база (NAME=test_...) не должна получить
+    # подключение к рабочей, которое осталось в пуле под тем же алиасом
+    key = (alias, repr(sorted(conn_params.items())))
+    pool = pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                options = {**DEFAULTS, **settings_dict.get('POOL', {})}
+                pool = pools[key] = ConnectionPool(
+                    alias, options['MAX_SIZE'], options['MAX_AGE'], options['TIMEOUT'], options['PING_AFTER'],
+                )
+    return pool
+
+
+def clear_pools(alias):
+    """Закрывает свободные подключения всех пулов алиаса, например перед удалением тестовой базы."""
+    for (pool_alias, _), pool in list(pools.items()):
+        if pool_alias == alias:
+            pool.clear()
+
+
+# после fork (gunicorn --preload) дочерний процесс не должен делить сокеты с родителем
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pools.clear)
+
+
+class PooledConnectionMixin:
+    """Берёт подключения бэкенда из пула процесса и возвращает их туда вместо закрытия."""
+
+    connection_pool = None
+
+    def get_new_connection(self, conn_params):
+        self.connection_pool = get_pool(self.alias, self.settings_dict, conn_params)
+        return self.connection_pool.acquire(
+            lambda: super(PooledConnectionMixin, self).get_new_connection(conn_params), self.ping,
+        )
+
+    @staticmethod
+    def ping(raw):
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _close(self):
+        raw = self.connection
+        # незавершённая транзакция откатывается: через PgBouncer (transaction) подключение
+        # уйдёт другому клиенту, а незакоммиченные изменения не должны достаться следующему запросу
+        try:
+            raw.rollback()
+        except Exception:
+            self.connection_pool.discard(raw, 'error')
+            return
+        self.connection_pool.release(raw)
@@ -0,0 +1,98 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from skymarket.caches import is_shared
+
+# Чтение с реплик (settings.DATABASE_REPLICAS) и запись в основную базу.
+# На реплики уходят только запросы вьюх с ReplicaReadMixin и только для
+# безопасных методов; всё остальное читает основная база. Пользователь, который
+# что-то записал, на REPLICA_PIN_SECONDS закрепляется за основной базой
+# (ставит ReplicaPinMiddleware), чтобы сразу видеть свои изменения несмотря на
+# отставание реплик. Отметка хранится в подписанной cookie, которую клиент
+# пришлёт в любой воркер, и, если кэш общий (skymarket/caches.py), ещё и в кэше -
+# для клиентов без cookie.
+
+PIN_KEY = 'db:pin:user:{}'
+PIN_COOKIE = 'db_pin'
+PIN_SALT = 'skymarket.db_router.pin'
+
+# разрешено ли текущему запросу читать с реплики
+read_from_replica = contextvars.ContextVar('read_from_replica', default=False)
+# пользователь текущего запроса закреплён за основной базой
+pinned = contextvars.ContextVar('pinned_to_primary', default=False)
+# отметка о записи в текущем запросе, её ставит db_for_write
+current_writes = contextvars.ContextVar('current_writes', default=None)
+
+
+def is_pinned(request):
+    user = getattr(request, 'user', None)
+    if not user or not user.is_authenticated:
+        return False
+    # cookie действует только для того пользователя, который делал запись
+    cookie = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS)
+    if cookie == str(user.pk):
+        return True
+    return is_shared() and bool(cache.get(PIN_KEY.format(user.pk)))
+
+
+def pin(user, response):
+    response.set_signed_cookie(
+        PIN_COOKIE, str(user.pk), salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS,
+        httponly=True, samesite='Lax',
+    )
+    if is_shared():
+        cache.set(PIN_KEY.format(user.pk), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned_to_primary():
+    return pinned.get()
+
+
+def reads_from_replica():
+    return read_from_replica.get()
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        # внутри транзакции основная база видит свои незакоммиченные изменения, реплика - нет
+        if replicas and read_from_replica.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        writes = current_writes.get()
+        if writes is not None:
+            writes.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики содержат те же данные
+        return True
+
+
+class ReplicaReadMixin:
+    """Читает с реплики GET/HEAD/OPTIONS, если пользователь не закреплён за основной базой."""
+
+    def dispatch(self, request, *args, **kwargs):
+        tokens = read_from_replica.set(False), pinned.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_from_replica.reset(tokens[0])
+            pinned.reset(tokens[1])
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # пользователь известен только после аутентификации
+        if settings.DATABASE_REPLICAS and request.method in SAFE_METHODS:
+            if is_pinned(request):
+                pinned.set(True)
+            else:
+                read_from_replica.set(True)
@@ -0,0 +1,71 @@
+import glob
+import json
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# литералы и списки параметров заменяются, чтобы один и тот же запрос
+# с разными значениями попадал в одну группу
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\?(?:\s*,\s*\?)+'), '?, ...'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class Command(BaseCommand):
+    help = "Summarizes the slow query log (SLOW_QUERY_LOG_FILE and its rotated copies) by query shape"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Log file, defaults to SLOW_QUERY_LOG_FILE.')
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--sort', choices=('total', 'count', 'max'), default='total')
+        parser.add_argument('--explain', action='store_true', help='Print the captured plan of the slowest sample.')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.SLOW_QUERY_LOG_FILE
+        files = sorted(glob.glob(glob.escape(path) + '*'))
+        if not files:
+            raise CommandError(f'No slow query log at {path}')
+
+        groups = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0, 'views': Counter(), 'slowest': None})
+        for name in files:
+            with open(name, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    group = groups[fingerprint(entry['sql'])]
+                    group['count'] += 1
+                    group['total'] += entry['duration_ms']
+                    group['views'][entry.get('view') or '-'] += 1
+                    if entry['duration_ms'] >= group['max']:
+                        group['max'] = entry['duration_ms']
+                        # план берётся у самого медленного запроса, у которого он есть
+                        if entry.get('explain') or not (group['slowest'] or {}).get('explain'):
+                            group['slowest'] = entry
+
+        ranked = sorted(groups.items(), key=lambda item: item[1][options['sort']], reverse=True)[:options['top']]
+        self.stdout.write(f'{sum(g["count"] for g in groups.values())} slow queries, {len(groups)} shapes')
+        for position, (shape, group) in enumerate(ranked, 1):
+            view, _ = group['views'].most_common(1)[0]
+            self.stdout.write(
+                f'{position}. count={group["count"]} total_ms={group["total"]:.1f} '
+                f'avg_ms={group["total"] / group["count"]:.1f} max_ms={group["max"]:.1f} view={view}'
+            )
+            self.stdout.write(f'   {shape[:300]}')
+            if options['explain'] and group['slowest'].get('explain'):
+                self.stdout.write(f'   params: {group["slowest"].get("params")}')
+                for plan_line in group['slowest']['explain'].splitlines():
+                    self.stdout.write(f'   | {plan_line}')
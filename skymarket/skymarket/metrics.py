@@ -0,0 +1,105 @@
+import contextlib
+import os
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from skymarket.timing import is_sampled, timed_request
+
+# Метрики в формате Prometheus (prometheus_client).
+# С несколькими воркерами (gunicorn) задайте PROMETHEUS_MULTIPROC_DIR - общий
+# каталог, где каждый процесс пишет свои значения в mmap-файлы без блокировок
+# между процессами; /metrics/ суммирует их через MultiProcessCollector. Каталог
+# нужно очищать при старте, а в хуке child_exit вызывать
+# prometheus_client.multiprocess.mark_process_dead(worker.pid).
+
+UNMATCHED = 'unmatched'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name',
+    ['url_name', 'method'],
+)
+RESPONSES = Counter(
+    'http_responses_total', 'Responses by URL name and status code',
+    ['url_name', 'method', 'status'],
+)
+IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests being processed by URL name',
+    ['url_name'], multiprocess_mode='livesum',
+)
+# SQL считается только для выбранных запросов (REQUEST_TIMING_SAMPLE_RATE, как у Server-Timing)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'SQL queries per request',
+    ['url_name'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+DB_TIME = Histogram(
+    'db_time_per_request_seconds', 'Time spent in SQL per request',
+    ['url_name'], buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf')),
+)
+# доля попаданий: rate(cache_requests_total{result="hit"}) / rate(cache_requests_total)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit/miss)',
+    ['cache', 'result'],
+)
+# пул подключений к базе (skymarket/db_pool.py)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled database connections by state (idle/in_use)',
+    ['alias', 'state'], multiprocess_mode='livesum',
+)
+DB_POOL_CHECKOUTS = Counter(
+    'db_pool_checkouts_total', 'Connection checkouts by result (reused/created/timeout)',
+    ['alias', 'result'],
+)
+DB_POOL_DISCARDS = Counter(
+    'db_pool_discards_total', 'Pooled connections closed by reason (max_age/ping/error/clear)',
+    ['alias', 'reason'],
+)
+DB_POOL_WAIT = Histogram(
+    'db_pool_checkout_seconds', 'Time to get a connection from the pool, including connect and ping',
+    ['alias'], buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .5, 1, 5, float('inf')),
+)
+
+
+class MetricsMiddleware:
+    """
+    Латентность, статусы и запросы в работе по имени URL - для каждого запроса;
+    SQL - только для запросов, выбранных для замеров (skymarket.timing.is_sampled).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._metrics_url_name = None
+        sampled = is_sampled(request)
+        started = time.perf_counter()
+        try:
+            # невыбранные запросы идут без execute_wrapper и таймера сериализации
+            with timed_request() if sampled else contextlib.nullcontext() as timings:
+                response = self.get_response(request)
+        finally:
+            url_name = request._metrics_url_name
+            if url_name is not None:
+                IN_FLIGHT.labels(url_name).dec()
+
+        url_name = url_name or UNMATCHED
+        REQUEST_LATENCY.labels(url_name, request.method).observe(time.perf_counter() - started)
+        RESPONSES.labels(url_name, request.method, response.status_code).inc()
+        if sampled:
+            DB_QUERIES.labels(url_name).observe(timings.queries)
+            DB_TIME.labels(url_name).observe(timings.db)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # имя URL известно только после разрешения маршрута
+        request._metrics_url_name = request.resolver_match.url_name or UNMATCHED
+        IN_FLIGHT.labels(request._metrics_url_name).inc()
+
+
+def collect():
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    return generate_latest(registry)
@@ -0,0 +1,196 @@
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from skymarket.db_router import current_writes, pin
+from skymarket.profiling import StackProfiler
+from skymarket.slow_queries import current_view
+from skymarket.timing import is_sampled, timed_request
+
+logger = logging.getLogger('skymarket.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Для доли запросов REQUEST_TIMING_SAMPLE_RATE считает SQL-запросы и время
+    базы, сериализации, рендеринга и вьюхи. Результат пишется строкой в лог
+    `skymarket.timing` с именем URL, а при REQUEST_TIMING_HEADER ещё и в
+    заголовок Server-Timing. Невыбранные запросы проходят без замеров.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_sampled(request):
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with timed_request() as timings:
+            response = self.get_response(request)
+            view = time.perf_counter() - started
+            # DRF Response рендерится после middleware; здесь его рендерят заранее,
+            # чтобы время JSON-рендерера попало в замер (повторно render() не выполняется)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                render_started = time.perf_counter()
+                response.render()
+                timings.render = time.perf_counter() - render_started
+        total = time.perf_counter() - started
+
+        metrics = {
+            'db': timings.db,
+            'serialize': timings.serialize,
+            'render': timings.render,
+            'view': view,
+            'total': total,
+        }
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        logger.info(
+            'url_name=%s method=%s status=%s queries=%d %s',
+            url_name, request.method, response.status_code, timings.queries,
+            ' '.join(f'{name}_ms={value * 1000:.2f}' for name, value in metrics.items()),
+            extra={
+                'url_name': url_name,
+                'status_code': response.status_code,
+                'queries': timings.queries,
+                **{f'{name}_ms': round(value * 1000, 2) for name, value in metrics.items()},
+            },
+        )
+
+        if getattr(settings, 'REQUEST_TIMING_HEADER', False):
+            response['Server-Timing'] = ', '.join(
+                [f'db;dur={timings.db * 1000:.2f};desc="{timings.queries} queries"']
+                + [f'{name};dur={value * 1000:.2f}' for name, value in metrics.items() if name != 'db']
+            )
+        return response
+
+
+class RequestContextMiddleware:
+    """Запоминает вьюху текущего запроса для журнала медленных запросов (skymarket/slow_queries.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_view.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        current_view.set((f'{view.__module__}.{view.__qualname__}', request.resolver_match.url_name))
+
+
+class ReplicaPinMiddleware:
+    """
+    Закрепляет пользователя за основной базой на REPLICA_PIN_SECONDS, если
+    запрос что-то записал (skymarket/db_router.py). Без реплик ничего не делает.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        token = current_writes.set(set())
+        try:
+            response = self.get_response(request)
+            writes = current_writes.get()
+        finally:
+            current_writes.reset(token)
+
+        # DRF переносит пользователя из аутентификации по JWT в request.user
+        user = getattr(request, 'user', None)
+        if writes and user is not None and user.is_authenticated:
+            pin(user, response)
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Профилирование одного запроса по флагу: заголовок `X-Profile` или параметр
+    `?profile=`. Доступно только персоналу (User.is_staff, роль admin).
+    Значение `inline` возвращает профиль вместо ответа, любое другое сохраняет
+    его в REQUEST_PROFILER_DIR, а имя файла отдаёт в заголовке X-Profile-File.
+    Формат - свёрнутые стеки (skymarket/profiling.py): flamegraph.pl profile.folded > profile.svg.
+    """
+
+    header = 'HTTP_X_PROFILE'
+    param = 'profile'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = request.META.get(self.header) or request.GET.get(self.param)
+        if not mode or not getattr(settings, 'REQUEST_PROFILER_ENABLED', False):
+            return self.get_response(request)
+
+        profiler = StackProfiler()
+        with profiler:
+            # проверка JWT тоже попадает в профиль: во вьюхе токен берётся уже из кэша
+            allowed = self.is_staff(request)
+            if allowed:
+                response = self.get_response(request)
+                if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                    response.render()
+        if not allowed:
+            return self.get_response(request)
+
+        if mode == 'inline':
+            response = HttpResponse(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+        else:
+            response['X-Profile-File'] = self.store(request, profiler)
+        response['X-Profile-Total-Ms'] = f'{profiler.total * 1000:.2f}'
+        return response
+
+    @staticmethod
+    def is_staff(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+
+        drf_request = Request(request)
+        for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            try:
+                result = authentication_class().authenticate(drf_request)
+            except APIException:
+                return False
+            if result is not None:
+                return result[0].is_staff
+        return False
+
+    @staticmethod
+    def store(request, profiler):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        name = f'{timezone.now():%Y%m%dT%H%M%S}-{url_name or "unmatched"}-{uuid.uuid4().hex[:8]}.folded'
+        os.makedirs(settings.REQUEST_PROFILER_DIR, exist_ok=True)
+        with open(os.path.join(settings.REQUEST_PROFILER_DIR, name), 'w', encoding='utf-8') as output:
+            output.write(profiler.collapsed())
+        ProfilerMiddleware.prune(settings.REQUEST_PROFILER_DIR, settings.REQUEST_PROFILER_MAX_FILES)
+        return name
+
+    @staticmethod
+    def prune(directory, keep):
+        # старые профили удаляются, чтобы каталог не рос без ограничений
+        with os.scandir(directory) as entries:
+            profiles = [entry for entry in entries if entry.name.endswith('.folded') and entry.is_file()]
+        profiles.sort(key=lambda entry: (entry.stat().st_mtime, entry.name), reverse=True)
+        for entry in profiles[keep:]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # параллельный запрос уже удалил этот файл
+                pass
@@ -0,0 +1,80 @@
+import sys
+import time
+from collections import Counter
+
+# Детерминированный профайлер одного запроса через sys.setprofile.
+# Время между событиями вызова/возврата приписывается текущему стеку, а
+# результат выводится в "свёрнутом" формате (collapsed stacks) - строка на
+# стек "frame;frame;frame <мкс>", который понимают flamegraph.pl, speedscope
+# и inferno. Вызовы C-функций (json, re, hashlib и т.п.) тоже попадают в стек.
+# Профилируется только текущий поток.
+
+
+class StackProfiler:
+    def __init__(self):
+        self.totals = Counter()
+        # стек путей: каждый элемент - кортеж меток от корня до кадра
+        self.stack = []
+        self.labels = {}
+        self.last = None
+
+    def __enter__(self):
+        self.last = time.perf_counter_ns()
+        sys.setprofile(self.trace)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.setprofile(None)
+        self.account(time.perf_counter_ns())
+        self.stack.clear()
+
+    def account(self, now):
+        if self.stack:
+            self.totals[self.stack[-1]] += now - self.last
+
+    def trace(self, frame, event, arg):
+        self.account(time.perf_counter_ns())
+
+        if event == 'call':
+            self.push(self.code_label(frame))
+        elif event == 'c_call':
+            self.push(self.c_label(arg))
+        elif self.stack:
+            # return, c_return, c_exception; возвраты из кадров, открытых до
+            # включения профайлера, стек не затрагивают
+            self.stack.pop()
+
+        # накладные расходы самого профайлера не учитываются
+        self.last = time.perf_counter_ns()
+
+    def push(self, label):
+        parent = self.stack[-1] if self.stack else ()
+        self.stack.append(parent + (label,))
+
+    def code_label(self, frame):
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            module = frame.f_globals.get('__name__', '?')
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self.labels[code] = f'{module}:{name}:{code.co_firstlineno}'.replace(';', ',')
+        return label
+
+    @staticmethod
+    def c_label(function):
+        # не кэшируется: связанные методы создаются на каждый вызов и держат свой __self__
+        module = getattr(function, '__module__', None) or 'builtins'
+        name = getattr(function, '__qualname__', None) or type(function).__name__
+        return f'{module}:{name}'.replace(';', ',')
+
+    def collapsed(self):
+        """Строки "frame;frame <мкс>" по убыванию веса."""
+        return '\n'.join(
+            f'{";".join(path)} {nanoseconds // 1000}'
+            for path, nanoseconds in self.totals.most_common()
+            if nanoseconds >= 1000
+        ) + '\n'
+
+    @property
+    def total(self):
+        return sum(self.totals.values()) / 1e9
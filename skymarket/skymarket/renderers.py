@@ -0,0 +1,65 @@
+import msgpack
+import orjson
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Рендереры на orjson и MessagePack.
+# ORJSONRenderer - замена JSONRenderer с тем же выводом байт в байт: компактный
+# UTF-8, datetime в UTC с суффиксом Z, нестроковые ключи как строки, \u2028 и
+# \u2029 экранированы. Всё, что orjson не знает сам (Decimal, timedelta, ленивые
+# строки, генераторы, PhoneNumber), превращается так же, как в JSONEncoder DRF.
+# Единственное отличие - экспонента float пишется короче (1e20 вместо 1e+20),
+# число то же.
+# Ответ с отступами (браузерный API, Accept: application/json; indent=4) и
+# значения, которые orjson не кодирует (целые больше 64 бит), отдаёт JSONRenderer.
+#
+# MessagePackRenderer - тот же ответ в application/msgpack, выбирается
+# заголовком Accept или ?format=msgpack.
+
+drf_encoder = JSONEncoder()
+
+
+def default(obj):
+    # PhoneNumber не сериализуется и стандартным JSONEncoder
+    if isinstance(obj, PhoneNumber):
+        return str(obj)
+    return drf_encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # как в JSONRenderer: вывод остаётся подмножеством JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def msgpack_default(obj):
+    # datetime и прочее приводятся к тем же строкам, что и в JSON, а не к расширениям MessagePack
+    return orjson.loads(orjson.dumps(obj, default=default, option=ORJSONRenderer.options))
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=msgpack_default, use_bin_type=True, datetime=False)
@@ -55,12 +55,17 @@ INSTALLED_APPS = [
     "django_filters",
     "phonenumbers",
 
+    "skymarket",
     "users",
     "ads",
 ]
 
 
 MIDDLEWARE = [
+    "skymarket.metrics.MetricsMiddleware",
+    "skymarket.middleware.ServerTimingMiddleware",
+    "skymarket.middleware.RequestContextMiddleware",
+    "skymarket.middleware.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -69,10 +74,52 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "skymarket.middleware.ProfilerMiddleware",
 ]
 
 ROOT_URLCONF = "skymarket.urls"
 
+# доля запросов, для которых считаются SQL-запросы и время (skymarket/middleware.py), 0 - выключено;
+# заголовок Server-Timing виден клиентам, поэтому включается отдельно
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv("REQUEST_TIMING_SAMPLE_RATE", 0))
+REQUEST_TIMING_HEADER = os.getenv("REQUEST_TIMING_HEADER", "0") == "1"
+
+# журнал SQL-запросов дольше порога (skymarket/slow_queries.py), 0 - выключен;
+# для доли SELECT из журнала дополнительно снимается EXPLAIN (ANALYZE, BUFFERS)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 0))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", os.path.join(BASE_DIR, "slow_queries.log"))
+
+# профилирование одного запроса персоналом по X-Profile / ?profile= (skymarket/middleware.py)
+# выключено по умолчанию; в каталоге хранятся только последние REQUEST_PROFILER_MAX_FILES профилей
+REQUEST_PROFILER_ENABLED = os.getenv("REQUEST_PROFILER_ENABLED", "0") == "1"
+REQUEST_PROFILER_DIR = os.getenv("REQUEST_PROFILER_DIR", os.path.join(BASE_DIR, "profiles"))
+REQUEST_PROFILER_MAX_FILES = int(os.getenv("REQUEST_PROFILER_MAX_FILES", 100))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "slow_queries": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": SLOW_QUERY_LOG_FILE,
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "delay": True,
+            "encoding": "utf-8",
+            "formatter": "message",
+        },
+    },
+    "loggers": {
+        "skymarket.timing": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "skymarket.slow_queries": {"handlers": ["slow_queries"], "level": "WARNING", "propagate": False},
+    },
+}
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -94,10 +141,30 @@ WSGI_APPLICATION = "skymarket.wsgi.application"
 # здесь мы настраиваем аутентификацию и пагинацию
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
+    ),
+    # JSON на orjson и MessagePack по Accept: application/msgpack (skymarket/renderers.py)
+    "DEFAULT_RENDERER_CLASSES": (
+        "skymarket.renderers.ORJSONRenderer",
+        "skymarket.renderers.MessagePackRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "skymarket.parsers.ORJSONParser",
+        "skymarket.parsers.MessagePackParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ),
 }
 
+# размер LRU проверенных токенов в каждом процессе (0 - без кэша)
+AUTH_USER_CACHE_SIZE = int(os.environ.get("AUTH_USER_CACHE_SIZE", 10_000))
+
+# фильтр Блума перед чёрным списком refresh-токенов (users/blacklist.py);
+# при переполнении фильтр перестраивается с удвоенной ёмкостью
+TOKEN_BLACKLIST_BLOOM_CAPACITY = int(os.environ.get("TOKEN_BLACKLIST_BLOOM_CAPACITY", 100_000))
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = 0.001
+
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
@@ -141,9 +208,52 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # постоянные подключения без пула: сколько секунд держать подключение потока
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        # через PgBouncer в режиме transaction серверные курсоры не работают
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER', '0') == '1',
+        # пул подключений процесса для DB_ENGINE=skymarket.backends.postgresql (skymarket/db_pool.py);
+        # при пуле CONN_MAX_AGE оставляют 0 - в конце запроса подключение возвращается в пул
+        'POOL': {
+            'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            'MAX_AGE': int(os.getenv('DB_POOL_MAX_AGE', 600)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            'PING_AFTER': float(os.getenv('DB_POOL_PING_AFTER', 5)),
+        },
     }
 }
 
+# реплики только для чтения (skymarket/db_router.py): хосты через запятую, остальные
+# параметры подключения как у default; в тестах реплики зеркалируют default
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['skymarket.db_router.PrimaryReplicaRouter']
+# сколько секунд после записи пользователь читает только основную базу
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# для нескольких воркеров нужен общий бэкенд (memcached), иначе у каждого процесса свой кэш
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# виден ли кэш всем воркерам (skymarket/caches.py): по умолчанию определяется по бэкенду;
+# CACHE_SHARED=1 - например, для единственного процесса с LocMemCache
+CACHE_SHARED = {'1': True, '0': False}.get(os.getenv('CACHE_SHARED', ''))
+
+# время жизни закэшированных ответов (секунды) по имени URL, 0 отключает кэш
+RESPONSE_CACHE_TIMEOUTS = {
+    'ads_list': int(os.getenv('ADS_LIST_CACHE_TIMEOUT', 60)),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -197,7 +307,14 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = 'users.User'
 
 # Include Email Backend
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# письма из запросов складываются в outbox, по SMTP их отправляет manage.py send_outbox_emails
+EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "users.outbox.OutboxEmailBackend")
+EMAIL_OUTBOX_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 100))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 8))
+EMAIL_OUTBOX_RETRY_BASE = 30  # секунды
+EMAIL_OUTBOX_RETRY_MAX = 60 * 60
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 10 * 60  # через столько взятое воркером и не отмеченное письмо снова станет доступно
 EMAIL_USE_SSL = True
 EMAIL_HOST = os.environ.get("EMAIL_HOST", "smtp.gmail.com")
 EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
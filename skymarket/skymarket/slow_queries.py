@@ -0,0 +1,107 @@
+import contextvars
+import json
+import logging
+import random
+import re
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+# Журнал медленных SQL-запросов (включается SLOW_QUERY_THRESHOLD_MS).
+# Execute wrapper ставится на каждое новое подключение (skymarket/apps.py) и
+# пишет запросы дольше порога JSON-строкой в логгер skymarket.slow_queries -
+# в settings.LOGGING это ротируемый файл SLOW_QUERY_LOG_FILE. Для части
+# SELECT-запросов (SLOW_QUERY_EXPLAIN_RATE) к записи добавляется план:
+# EXPLAIN (ANALYZE, BUFFERS) на PostgreSQL, EXPLAIN QUERY PLAN на SQLite.
+# Запросы с WITH только планируются без выполнения: в CTE может быть запись.
+# Сводка: manage.py slow_query_report.
+
+logger = logging.getLogger('skymarket.slow_queries')
+
+# вьюха текущего запроса, её ставит RequestContextMiddleware
+current_view = contextvars.ContextVar('current_view', default=None)
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+# без выполнения запроса
+PLAN_ONLY_PREFIXES = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+# EXPLAIN ANALYZE выполняет запрос повторно, поэтому только простой SELECT;
+# у WITH в CTE может быть INSERT/UPDATE/DELETE
+ANALYZABLE = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+PLAN_ONLY = re.compile(r'^\s*WITH\b', re.IGNORECASE)
+
+
+def explain_prefix(vendor, sql):
+    if ANALYZABLE.match(sql):
+        return EXPLAIN_PREFIXES.get(vendor)
+    if PLAN_ONLY.match(sql):
+        return PLAN_ONLY_PREFIXES.get(vendor)
+    return None
+
+
+class SlowQueryLogger:
+    def __init__(self, threshold_ms=None, explain_rate=None):
+        if threshold_ms is None:
+            threshold_ms = settings.SLOW_QUERY_THRESHOLD_MS
+        if explain_rate is None:
+            explain_rate = settings.SLOW_QUERY_EXPLAIN_RATE
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+
+    @staticmethod
+    def enabled():
+        return bool(getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 0))
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            self.log(context['connection'], sql, params, many, duration)
+        return result
+
+    def log(self, connection, sql, params, many, duration):
+        explain = None
+        if not many and self.explain_rate and random.random() < self.explain_rate:
+            explain = self.explain(connection, sql, params)
+
+        view = current_view.get()
+        logger.warning(json.dumps({
+            'time': timezone.now().isoformat(),
+            'database': connection.alias,
+            'duration_ms': round(duration * 1000, 3),
+            'view': view and view[0],
+            'url_name': view and view[1],
+            'sql': sql,
+            # у executemany параметров может быть очень много
+            'params': None if many else params,
+            'explain': explain,
+        }, ensure_ascii=False, default=str))
+
+    def explain(self, connection, sql, params):
+        prefix = explain_prefix(connection.vendor, sql)
+        if prefix is None:
+            return None
+
+        # курсор бэкенда без execute wrapper'ов: EXPLAIN не попадает в журнал сам,
+        # а точка сохранения не даёт ошибке EXPLAIN сломать текущую транзакцию
+        savepoint = connection.savepoint() if connection.in_atomic_block else None
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        except connection.Database.Error as exc:
+            if savepoint:
+                connection.savepoint_rollback(savepoint)
+            return f'EXPLAIN failed: {exc}'
+        finally:
+            cursor.close()
+        if savepoint:
+            connection.savepoint_commit(savepoint)
+        return '\n'.join(str(row[-1]) for row in rows)
@@ -0,0 +1,114 @@
+import contextvars
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+# Замеры одного запроса: число и время SQL-запросов, время сериализации
+# (serializer.data во вьюхах, см. SerializerTimingMixin) и рендеринга ответа.
+# Пока запрос не выбран для замера, текущий RequestTimings равен None и
+# обёртки стоят один вызов contextvar.get.
+
+current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper для всех подключений
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def is_sampled(request):
+    """
+    Выбран ли запрос для замеров (доля REQUEST_TIMING_SAMPLE_RATE). Решение
+    принимается один раз и запоминается в запросе, чтобы метрики и Server-Timing
+    замеряли одни и те же запросы.
+    """
+    sampled = getattr(request, '_timing_sampled', None)
+    if sampled is None:
+        rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 0)
+        sampled = request._timing_sampled = bool(rate) and random.random() < rate
+    return sampled
+
+
+class timed_request:
+    """
+    Включает замеры для тела блока: ставит RequestTimings и execute_wrapper на все базы.
+    Вложенный блок (метрики внутри Server-Timing и наоборот) использует уже открытые замеры.
+    """
+
+    def __enter__(self):
+        self.timings = current_timings.get()
+        self.token = None
+        if self.timings is not None:
+            return self.timings
+
+        self.timings = RequestTimings()
+        self.token = current_timings.set(self.timings)
+        self.wrappers = [connection.execute_wrapper(self.timings) for connection in connections.all()]
+        for wrapper in self.wrappers:
+            wrapper.__enter__()
+        return self.timings
+
+    def __exit__(self, *exc_info):
+        if self.token is None:
+            return
+        for wrapper in reversed(self.wrappers):
+            wrapper.__exit__(*exc_info)
+        current_timings.reset(self.token)
+
+
+def timed_serializer(serializer):
+    """
+    Для запроса с замерами подменяет класс сериализатора подклассом, у которого
+    обращение к .data попадает в RequestTimings.serialize. Остальные запросы и
+    сериализаторы вне вьюх не затрагиваются.
+    """
+    if current_timings.get() is not None:
+        serializer.__class__ = timed_class(type(serializer))
+    return serializer
+
+
+@functools.lru_cache(maxsize=None)
+def timed_class(cls):
+    if getattr(cls, 'timed', False):
+        return cls
+
+    def data(self):
+        timings = current_timings.get()
+        if timings is None:
+            return super(timed, self).data
+
+        started = time.perf_counter()
+        try:
+            return super(timed, self).data
+        finally:
+            timings.serialize += time.perf_counter() - started
+
+    timed = type(cls)(cls.__name__, (cls,), {
+        '__module__': cls.__module__,
+        '__qualname__': cls.__qualname__,
+        'data': property(data),
+        'timed': True,
+    })
+    return timed
+
+
+class SerializerTimingMixin:
+    """Замер сериализации для вьюх: сериализаторы из get_serializer() проходят через timed_serializer."""
+
+    def get_serializer(self, *args, **kwargs):
+        return timed_serializer(super().get_serializer(*args, **kwargs))
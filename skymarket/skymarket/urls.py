@@ -6,6 +6,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from skymarket.views import MetricsView
+
 schema_view = get_schema_view(
    openapi.Info(
       title="Snippets API",
@@ -21,6 +23,7 @@ schema_view = get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include('ads.urls', namespace='main')),
     path('', include('users.urls', namespace='users')),
 
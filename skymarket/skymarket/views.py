@@ -0,0 +1,14 @@
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+from skymarket.metrics import collect
+
+
+class MetricsView(APIView):
+    # метрики не кэшируются и не нужны анонимам
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(collect(), content_type=CONTENT_TYPE_LATEST)
@@ -1,7 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_email_index(sender, using, **kwargs):
+    from users.search import ensure_sqlite_email_index
+
+    ensure_sqlite_email_index(using)
 
 
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
     verbose_name = "Пользователи"
+
+    def ready(self):
+        from users import signals  # noqa: F401
+
+        post_migrate.connect(ensure_email_index, sender=self)
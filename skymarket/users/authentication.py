@@ -0,0 +1,185 @@
+import base64
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from hmac import compare_digest
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from skymarket.caches import is_shared
+from skymarket.metrics import CACHE_REQUESTS
+
+# Кэш аутентификации по JWT.
+# Проверка подписи и SELECT пользователя выполняются один раз на токен, дальше
+# запрос обслуживается из LRU в памяти процесса (ключ - jti токена).
+# Чтобы любое изменение пользователя в одном воркере было видно остальным,
+# у каждого пользователя есть номер версии в общем кэше (django cache): запись
+# LRU действительна, пока версия не изменилась (см. users/signals.py).
+# С кэшем процесса (LocMemCache) версии до других воркеров не доходят, поэтому
+# без общего кэша аутентификация работает как обычная JWTAuthentication.
+
+VERSION_KEY = 'auth:user:{}:version'
+STATS_KEY = 'auth:stats:{}'
+STATS_FLUSH_EVERY = 100
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_user_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        # вытесненная версия начинается не с нуля, а с текущего времени: иначе
+        # записи LRU, сохранённые при старых номерах, снова стали бы действительными
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_version(user_id):
+    get_user_version(user_id)
+    try:
+        cache.incr(VERSION_KEY.format(user_id))
+    except ValueError:
+        # ключ вытеснен между чтением и incr - он уже получит новое значение
+        pass
+
+
+def stats():
+    counters = cache.get_many([STATS_KEY.format('hit'), STATS_KEY.format('miss')])
+    return {
+        'hits': counters.get(STATS_KEY.format('hit'), 0),
+        'misses': counters.get(STATS_KEY.format('miss'), 0),
+    }
+
+
+def unverified_claims(raw_token):
+    """Payload токена без проверки подписи; None, если токен не разбирается."""
+    try:
+        payload = raw_token.split(b'.')[1]
+        payload += b'=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, TypeError, ValueError):
+        return None
+    return claims if isinstance(claims, dict) else None
+
+
+class TokenUserCache:
+    """
+    Ограниченный LRU: jti -> (сырой токен, проверенный токен, пользователь,
+    версия пользователя, exp). Счётчики попаданий копятся локально и
+    сбрасываются в общий кэш раз в STATS_FLUSH_EVERY обращений.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = {'hit': 0, 'miss': 0}
+
+    def get(self, jti, raw_token):
+        with self.lock:
+            entry = self.entries.get(jti)
+            if entry is not None:
+                self.entries.move_to_end(jti)
+        if entry is None:
+            return None
+
+        stored_token, validated_token, user, version, expires_at = entry
+        # запись отдаётся только для того же самого токена: подделка с чужим jti
+        # не совпадёт побайтно и пойдёт на полную проверку подписи
+        if (
+            not compare_digest(stored_token, raw_token)
+            or expires_at <= time.time()
+            or version != get_user_version(user.pk)
+        ):
+            self.forget(jti)
+            return None
+        return validated_token, user
+
+    def put(self, jti, raw_token, validated_token, user, version):
+        with self.lock:
+            self.entries[jti] = (raw_token, validated_token, user, version, validated_token['exp'])
+            self.entries.move_to_end(jti)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def forget(self, jti):
+        with self.lock:
+            self.entries.pop(jti, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pending = {'hit': 0, 'miss': 0}
+
+    def record(self, outcome):
+        CACHE_REQUESTS.labels('auth_user', outcome).inc()
+        with self.lock:
+            self.pending[outcome] += 1
+            if sum(self.pending.values()) < STATS_FLUSH_EVERY:
+                return
+        self.flush_stats()
+
+    def flush_stats(self):
+        with self.lock:
+            pending, self.pending = self.pending, {'hit': 0, 'miss': 0}
+        for name, count in pending.items():
+            if count:
+                key = STATS_KEY.format(name)
+                if not cache.add(key, count, timeout=None):
+                    cache.incr(key, count)
+
+
+token_user_cache = TokenUserCache(getattr(settings, 'AUTH_USER_CACHE_SIZE', 10_000))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication, которая не проверяет подпись и не читает пользователя
+    из базы повторно для уже виденного токена.
+    """
+    cache = token_user_cache
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        claims = unverified_claims(raw_token) or {}
+        jti = claims.get(api_settings.JTI_CLAIM) if self.cache.max_size and is_shared() else None
+        if jti is not None:
+            cached = self.cache.get(jti, raw_token)
+            if cached is not None:
+                self.cache.record('hit')
+                validated_token, user = cached
+                # у каждого запроса своя копия: вьюхи могут менять request.user
+                return copy.copy(user), validated_token
+            self.cache.record('miss')
+
+        # версия читается до SELECT: изменение пользователя между ними
+        # сделает запись устаревшей, а не закэширует старые данные
+        user_id = claims.get(api_settings.USER_ID_CLAIM)
+        version = get_user_version(user_id) if jti is not None else None
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+
+        # подпись проверена, значит claims совпадают с validated_token
+        if jti is not None and user.pk == user_id:
+            self.cache.put(jti, raw_token, validated_token, copy.copy(user), version)
+        return user, validated_token
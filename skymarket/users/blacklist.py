@@ -0,0 +1,142 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from skymarket.caches import is_shared
+
+# Фильтр Блума перед таблицей BlacklistedToken.
+# Каждый процесс держит в памяти фильтр по jti отозванных токенов. Если jti в
+# фильтр не попадает, токен точно не в чёрном списке и запрос к базе не нужен;
+# при попадании (отозван или ложное срабатывание) выполняется обычная проверка.
+#
+# Фильтр догружается инкрементально: добавление в чёрный список увеличивает
+# версию в общем кэше, и при следующей проверке процесс дочитывает новые строки
+# по id. Очистка (purge_expired_tokens) меняет эпоху - фильтр строится заново.
+# Версия и эпоха должны быть видны всем воркерам: с кэшем процесса (LocMemCache)
+# фильтр не используется и каждый токен проверяется по базе.
+
+VERSION_KEY = 'auth:blacklist:version'
+EPOCH_KEY = 'auth:blacklist:epoch'
+# строки перечитываются с запасом: параллельные транзакции могут закоммитить
+# меньший id позже большего
+SYNC_OVERLAP = 1000
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # вытесненный счётчик начинается не с единицы, а с текущего времени:
+        # иначе он мог бы повторить значение, на котором процесс уже синхронизирован
+        if not cache.add(key, time.time_ns(), timeout=None):
+            cache.incr(key)
+
+
+def bump_version():
+    _incr(VERSION_KEY)
+
+
+def bump_epoch():
+    _incr(EPOCH_KEY)
+
+
+def blacklist_changed():
+    # как и ads.cache.invalidate: второй раз после коммита, когда строка видна
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class BlacklistFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, epoch=None):
+        self.filter = BloomFilter(self.capacity, self.error_rate)
+        self.watermark = 0
+        self.count = 0
+        self.state = (epoch, object())
+
+    def load(self, since):
+        rows = BlacklistedToken.objects.filter(id__gt=since).order_by('id').values_list('id', 'token__jti')
+        for row_id, jti in rows.iterator():
+            self.filter.add(jti)
+            if row_id > self.watermark:
+                self.watermark = row_id
+                self.count += 1
+
+    def sync(self):
+        counters = cache.get_many([VERSION_KEY, EPOCH_KEY])
+        version, epoch = counters.get(VERSION_KEY), counters.get(EPOCH_KEY)
+        with self.lock:
+            if self.state == (epoch, version):
+                return
+            if self.state[0] != epoch:
+                self.reset(epoch)
+
+            self.load(self.watermark - SYNC_OVERLAP)
+            if self.count > self.capacity:
+                # при переполнении растёт доля ложных срабатываний,
+                # поэтому фильтр строится заново вдвое больше
+                self.capacity = self.count * 2
+                self.reset(epoch)
+                self.load(0)
+            self.state = (epoch, version)
+
+    def might_contain(self, jti):
+        self.sync()
+        return jti in self.filter
+
+
+blacklist_filter = BlacklistFilter(
+    getattr(settings, 'TOKEN_BLACKLIST_BLOOM_CAPACITY', 100_000),
+    getattr(settings, 'TOKEN_BLACKLIST_BLOOM_ERROR_RATE', 0.001),
+)
+
+
+def is_blacklisted(jti):
+    if is_shared() and not blacklist_filter.might_contain(jti):
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+class BloomRefreshToken(RefreshToken):
+    """RefreshToken, который проверяет чёрный список через blacklist_filter."""
+
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
@@ -0,0 +1,213 @@
+import contextlib
+import json
+import re
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+
+from ads import cache
+from ads.models import Ad, Comment
+from ads.signals import recount_comments
+
+# Потоковая загрузка фикстур в формате dumpdata (JSON-массив объектов).
+# В отличие от loaddata файл не разбирается целиком: объекты читаются по
+# одному, копятся в пачку и вставляются через bulk_create. Память ограничена
+# размером пачки, а не файла.
+
+READ_SIZE = 64 * 1024
+BATCH_SIZE = 5000
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    """Элементы JSON-массива верхнего уровня по одному, файл читается кусками."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    expect = '['
+
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unexpected end of fixture')
+            buffer, pos = stream.read(read_size), 0
+            eof = not buffer
+            continue
+
+        if expect == '[':
+            if buffer[pos] != '[':
+                raise ValueError('Fixture must be a JSON array')
+            pos += 1
+            expect = 'first'
+        elif expect in ('first', 'value'):
+            if expect == 'first' and buffer[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # значение, упёршееся в конец буфера, могло быть обрезано (например число)
+            if end is None or (end == len(buffer) and not eof):
+                chunk = stream.read(read_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield obj
+            pos = end
+            expect = 'separator'
+        else:
+            char = buffer[pos]
+            pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" in fixture, got {char!r}')
+            expect = 'value'
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*models):
+    """Отключает auto_now/auto_now_add, чтобы bulk_create сохранил даты из данных."""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def fill_missing_timestamps(model, objs):
+    """
+    С отключёнными auto_now/auto_now_add пропущенные в записи даты остались бы
+    NULL: created_at получает текущее время, как при обычном save(), а updated_at -
+    дату создания (запись с тех пор не менялась).
+    """
+    now = timezone.now()
+    created = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+    updated = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+    for obj in objs:
+        for field in created:
+            if getattr(obj, field.attname) is None:
+                setattr(obj, field.attname, now)
+        default = getattr(obj, created[0].attname) if created else now
+        for field in updated:
+            if getattr(obj, field.attname) is None:
+                setattr(obj, field.attname, default)
+
+
+def build_object(record):
+    """Экземпляр модели из записи dumpdata; FK остаются сырыми id до проверки пачкой."""
+    model = apps.get_model(record['model'])
+    values, m2m = {}, {}
+    if record.get('pk') is not None:
+        values[model._meta.pk.attname] = model._meta.pk.to_python(record['pk'])
+    for name, value in record.get('fields', {}).items():
+        field = model._meta.get_field(name)
+        if field.many_to_many:
+            m2m[name] = value
+        elif field.remote_field is not None:
+            values[field.attname] = value
+        else:
+            values[field.attname] = field.to_python(value)
+    return model(**values), m2m
+
+
+def check_foreign_keys(model, objs, using):
+    """
+    Проверяет ссылки пачки одним запросом на каждый FK (например Ad.author и
+    Comment.ad) вместо ошибки целостности в конце загрузки.
+    """
+    for field in model._meta.concrete_fields:
+        if not field.many_to_one:
+            continue
+        target = field.target_field
+        referenced = {target.to_python(getattr(obj, field.attname)) for obj in objs} - {None}
+        if not referenced:
+            continue
+        found = set(
+            field.related_model._base_manager.using(using)
+            .filter(**{f'{target.attname}__in': referenced})
+            .values_list(target.attname, flat=True)
+        )
+        missing = referenced - found
+        if missing:
+            raise ValueError(
+                f'{model._meta.label_lower}: {field.name} references missing '
+                f'{field.related_model._meta.label_lower} {sorted(missing)[:10]}'
+            )
+        for obj in objs:
+            setattr(obj, field.attname, target.to_python(getattr(obj, field.attname)))
+
+
+def insert_batch(model, batch, using):
+    """
+    Как и loaddata, существующие строки с тем же pk перезаписываются: они
+    находятся одним запросом и обновляются bulk_update, остальные - bulk_create.
+    """
+    objs = [obj for obj, _ in batch]
+    check_foreign_keys(model, objs, using)
+    fill_missing_timestamps(model, objs)
+
+    manager = model._base_manager.using(using)
+    pk_name = model._meta.pk.attname
+    existing = set(manager.filter(pk__in=[obj.pk for obj in objs if obj.pk is not None]).values_list('pk', flat=True))
+    new = [obj for obj in objs if obj.pk not in existing]
+    changed = [obj for obj in objs if obj.pk in existing]
+
+    with explicit_timestamps(model):
+        manager.bulk_create(new)
+        if changed:
+            fields = [
+                field.attname for field in model._meta.concrete_fields
+                if field.attname != pk_name and field.editable
+            ]
+            manager.bulk_update(changed, fields)
+    for obj, m2m in batch:
+        for name, values in m2m.items():
+            getattr(obj, name).set(values)
+
+    # bulk-операции не шлют сигналы, счётчики комментариев пересчитываются пачкой
+    if model is Comment:
+        recount_comments({obj.ad_id for obj in objs} - {None}, using)
+    elif model is Ad and changed:
+        recount_comments([obj.pk for obj in changed], using)
+
+
+def load_fixture(path, using='default', batch_size=BATCH_SIZE):
+    """Загружает один файл; возвращает {label модели: число объектов}."""
+    counts = {}
+    models = set()
+    connection = connections[using]
+
+    with open(path, encoding='utf-8') as stream, transaction.atomic(using=using):
+        model, batch = None, []
+        for record in iter_json_array(stream):
+            obj, m2m = build_object(record)
+            if batch and (type(obj) is not model or len(batch) >= batch_size):
+                insert_batch(model, batch, using)
+                batch = []
+            model = type(obj)
+            models.add(model)
+            batch.append((obj, m2m))
+            counts[model._meta.label_lower] = counts.get(model._meta.label_lower, 0) + 1
+        if batch:
+            insert_batch(model, batch, using)
+
+        # как и loaddata: после вставки с явными id сдвигаем последовательности
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), models)
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+    if models & {Ad, Comment}:
+        cache.invalidate()
+    return counts
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from users.authentication import stats
+
+
+class Command(BaseCommand):
+    help = "Shows hit/miss counters of the JWT authenticated-user cache"
+
+    def handle(self, *args, **options):
+        counters = stats()
+        total = counters['hits'] + counters['misses']
+        ratio = counters['hits'] / total if total else 0
+        self.stdout.write(
+            f"hits={counters['hits']} misses={counters['misses']} hit_ratio={ratio:.2%}"
+        )
@@ -1,21 +1,45 @@
 import os
+import time
 
-from django.core.management.base import BaseCommand
-from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from users.loading import BATCH_SIZE, load_fixture
 
 
 class Command(BaseCommand):
-    help = "Loads fixtures from fixtures dir"
+    help = "Loads fixtures from fixtures dir (streamed and inserted in batches, see users/loading.py)"
     fixtures_dir = "fixtures"
-    loaddata_command = "loaddata"
     filenames = [
         "users",
         "ad",
         "comments",
     ]
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--database', default='default')
+
     def handle(self, *args, **options):
+        total_objects, total_time = 0, 0
         for fixture_filename in self.filenames:
-            call_command(
-                self.loaddata_command, os.path.join(self.fixtures_dir, f"{fixture_filename}.json")
+            path = os.path.join(self.fixtures_dir, f"{fixture_filename}.json")
+            started = time.perf_counter()
+            try:
+                counts = load_fixture(path, options['database'], options['batch_size'])
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'{path}: {exc}')
+            elapsed = time.perf_counter() - started
+
+            objects = sum(counts.values())
+            total_objects += objects
+            total_time += elapsed
+            details = ', '.join(f'{label}: {count}' for label, count in counts.items())
+            self.stdout.write(
+                f'{path}: {objects} objects ({details}) in {elapsed:.2f}s, '
+                f'{objects / elapsed if elapsed else 0:.0f} objects/s'
             )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Installed {total_objects} objects from {len(self.filenames)} fixtures in {total_time:.2f}s '
+            f'({total_objects / total_time if total_time else 0:.0f} objects/s)'
+        ))
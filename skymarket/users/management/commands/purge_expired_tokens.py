@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from users.blacklist import bump_epoch
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired outstanding and blacklisted JWTs in short primary key batches "
+        "(a batched replacement for flushexpiredtokens)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Pause between batches, seconds.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        outstanding = blacklisted = 0
+        last_pk = 0
+
+        while True:
+            # обход идёт по первичному ключу, а не по expires_at (индекса на нём нет),
+            # и каждая пачка удаляется в своей короткой транзакции
+            ids = list(
+                OutstandingToken.objects.filter(pk__gt=last_pk, expires_at__lte=now)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_pk = ids[-1]
+
+            with transaction.atomic():
+                blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+                outstanding += OutstandingToken.objects.filter(pk__in=ids).delete()[0]
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if blacklisted:
+            # удалённые jti остаются в фильтрах Блума процессов, пока их не перестроить
+            bump_epoch()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {outstanding} outstanding and {blacklisted} blacklisted tokens'
+        ))
@@ -0,0 +1,258 @@
+import contextlib
+import csv
+import io
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ads import cache
+from ads.models import Ad, Comment
+from users.loading import explicit_timestamps
+from users.models import User, UserRoles
+
+# Генератор синтетических данных для нагрузочной проверки.
+# id пользователей и объявлений назначаются заранее (max(id) + номер), поэтому
+# пачки строятся независимо друг от друга в пуле процессов. Комментарии
+# генерируются в той же пачке, что и их объявление: так comments_count и
+# last_comment_at сразу согласованы и отдельный пересчёт не нужен.
+
+WORDS = (
+    'продам срочно новый почти отличное состояние торг уместен самовывоз доставка '
+    'диван шкаф стол стул кровать холодильник телевизор ноутбук телефон велосипед '
+    'коляска куртка ботинки платье игрушки книги гитара палатка лодка самокат '
+    'компьютер монитор принтер кофемашина пылесос микроволновка чайник утюг '
+    'белый чёрный красный синий большой маленький удобный лёгкий тёплый крепкий '
+    'гарантия чек коробка документы комплект оригинал подарок обмен район центр '
+    'недорого быстро аккуратно работает проверено звоните пишите вечером'
+).split()
+FIRST_NAMES = ('Иван', 'Мария', 'Алексей', 'Анна', 'Дмитрий', 'Елена', 'Сергей', 'Ольга', 'Павел', 'Наталья')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Морозов')
+
+# чем больше степень, тем сильнее объявления сосредоточены у первых авторов:
+# при 3 десятая часть пользователей владеет почти половиной объявлений
+AUTHOR_SKEW = 3
+# комментарии делятся между объявлениями по логнормальным весам: большинство
+# объявлений без комментариев или с парой, у немногих - сотни
+COMMENTS_SIGMA = 1.5
+PRICE_MEDIAN = 3000
+PRICE_SIGMA = 1.5
+MAX_PRICE = 10 ** 9 - 1
+DESCRIPTION_MEDIAN_WORDS = 25
+HISTORY_DAYS = 365
+
+
+def chunk_rng(seed, kind, start):
+    return random.Random(f'{seed}:{kind}:{start}')
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def generate_users(start, count, first_id, password, seed):
+    rng = chunk_rng(seed, 'users', start)
+    for index in range(start, start + count):
+        user_id = first_id + index
+        yield User(
+            id=user_id,
+            email=f'user{user_id}@example.com',
+            password=password,
+            role=UserRoles.admin if rng.random() < 0.01 else UserRoles.user,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES) if rng.random() < 0.7 else None,
+            is_active=rng.random() < 0.95,
+        )
+
+
+def chunk_share(total, start, count, size):
+    """Доля total для строк [start, start + count) из size; сумма долей всех пачек равна total."""
+    return total * (start + count) // size - total * start // size
+
+
+def allocate(total, weights):
+    """Делит total на целые части пропорционально weights методом наибольшего остатка."""
+    weight_sum = sum(weights)
+    if not total or not weight_sum:
+        return [0] * len(weights)
+    shares = [total * weight / weight_sum for weight in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def generate_ads(start, count, first_id, first_user_id, users, comments, now, seed):
+    """Объявления пачки и ровно `comments` комментариев к ним: (ads, comments)."""
+    rng = chunk_rng(seed, 'ads', start)
+    comment_counts = allocate(comments, [rng.lognormvariate(0, COMMENTS_SIGMA) for _ in range(count)])
+    ads, comments = [], []
+    for index, count_comments in zip(range(start, start + count), comment_counts):
+        created_at = now - timedelta(seconds=rng.random() * HISTORY_DAYS * 86400)
+        price = min(MAX_PRICE, round(rng.lognormvariate(math.log(PRICE_MEDIAN), PRICE_SIGMA), -1))
+        description = None
+        if rng.random() < 0.9:
+            description = words(rng, max(1, int(rng.lognormvariate(math.log(DESCRIPTION_MEDIAN_WORDS), 0.8))))
+
+        ad = Ad(
+            id=first_id + index,
+            title=words(rng, rng.randint(2, 6)).capitalize()[:150],
+            price=Decimal(price),
+            description=description,
+            author_id=first_user_id + int(users * rng.random() ** AUTHOR_SKEW),
+            created_at=created_at,
+            comments_count=0,
+        )
+        for _ in range(count_comments):
+            # большая часть комментариев приходит в первые дни после публикации
+            comment_at = min(now, created_at + timedelta(hours=rng.expovariate(1 / 48)))
+            comments.append(Comment(
+                text=words(rng, max(1, int(rng.lognormvariate(math.log(8), 0.7)))),
+                author_id=first_user_id + rng.randrange(users),
+                ad_id=ad.id,
+                created_at=comment_at,
+                updated_at=comment_at,
+            ))
+            ad.last_comment_at = max(ad.last_comment_at or comment_at, comment_at)
+        ad.comments_count = count_comments
+        ad.updated_at = ad.last_comment_at or created_at
+        ads.append(ad)
+    return ads, comments
+
+
+def copy_objects(objs, using):
+    """Вставка через COPY ... FROM STDIN (PostgreSQL): в разы быстрее INSERT."""
+    model = type(objs[0])
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key and getattr(objs[0], field.attname) is None)
+        and field.attname != 'search_vector'
+    ]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        writer.writerow([field.get_db_prep_save(getattr(obj, field.attname), connections[using]) for field in fields])
+    buffer.seek(0)
+
+    columns = ', '.join(connections[using].ops.quote_name(field.column) for field in fields)
+    with connections[using].cursor() as cursor:
+        cursor.copy_expert(f'COPY {model._meta.db_table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def insert(objs, using, batch_size):
+    if not objs:
+        return
+    if connections[using].vendor == 'postgresql':
+        copy_objects(objs, using)
+    else:
+        with explicit_timestamps(type(objs[0])):
+            type(objs[0]).objects.using(using).bulk_create(objs, batch_size=batch_size)
+
+
+def seed_users(start, count, first_id, password, seed, using, batch_size):
+    with transaction.atomic(using=using):
+        insert(list(generate_users(start, count, first_id, password, seed)), using, batch_size)
+    return count, 0, 0
+
+
+def seed_ads(start, count, first_id, first_user_id, users, comments, now, seed, using, batch_size):
+    ads, comments = generate_ads(start, count, first_id, first_user_id, users, comments, now, seed)
+    with transaction.atomic(using=using):
+        insert(ads, using, batch_size)
+        insert(comments, using, batch_size)
+    return 0, len(ads), len(comments)
+
+
+def init_worker():
+    import django
+
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates synthetic users, ads and comments: skewed authors, a long tail of comment "
+        "counts, log-normal prices and text lengths. "
+        "All generated users share the password 'password'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--ads', type=int, default=10_000)
+        parser.add_argument('--comments', type=int, default=50_000)
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Rows per chunk and per INSERT.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Generator processes. SQLite always uses a single writer.',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data.')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        users, ads, batch_size = options['users'], options['ads'], options['batch_size']
+        if users < 1 and ads:
+            raise CommandError('Ads need at least one user.')
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        workers = 1 if connection.vendor == 'sqlite' else max(1, options['workers'])
+        first_user_id = (User.objects.using(using).aggregate(m=Max('id'))['m'] or 0) + 1
+        first_ad_id = (Ad.objects.using(using).aggregate(m=Max('id'))['m'] or 0) + 1
+        password = make_password('password')
+        now = timezone.now()
+        seed = options['seed']
+        comments = options['comments']
+
+        stages = [
+            ('users', seed_users, users, lambda start, count: (
+                start, count, first_user_id, password, seed, using, batch_size,
+            )),
+            ('ads', seed_ads, ads, lambda start, count: (
+                start, count, first_ad_id, first_user_id, users, chunk_share(comments, start, count, ads), now, seed,
+                using, batch_size,
+            )),
+        ]
+
+        started = time.perf_counter()
+        totals = [0, 0, 0]
+        if workers > 1:
+            # дочерние процессы открывают свои соединения, наследовать открытые нельзя
+            connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=init_worker) if workers > 1 else contextlib.nullcontext() as pool:
+            for name, func, total, make_args in stages:
+                chunks = [make_args(start, min(batch_size, total - start)) for start in range(0, total, batch_size)]
+                results = pool.map(func, *zip(*chunks)) if pool and chunks else (func(*chunk) for chunk in chunks)
+                for done in results:
+                    totals = [a + b for a, b in zip(totals, done)]
+                    self.stdout.write(
+                        f'{name}: users={totals[0]} ads={totals[1]} comments={totals[2]} '
+                        f'({time.perf_counter() - started:.1f}s)'
+                    )
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Ad, Comment]):
+                    cursor.execute(sql)
+                for model in (User, Ad, Comment):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+        cache.invalidate()
+
+        elapsed = time.perf_counter() - started
+        rows = sum(totals)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {totals[0]} users, {totals[1]} ads, {totals[2]} comments '
+            f'in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.outbox import send_batch
+
+
+class Command(BaseCommand):
+    help = "Sends pending emails from the outbox in batches over a reused SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting when it is empty.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep between polls in --loop mode.')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+
+        while True:
+            sent, failed = send_batch(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f'sent={sent} failed={failed}')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Outbox drained: sent={total_sent} failed={total_failed}'))
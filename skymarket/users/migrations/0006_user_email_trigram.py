@@ -0,0 +1,36 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# индекс повторяет выражение, в которое Django компилирует email__icontains
+POSTGRES_FORWARD_SQL = [
+    "CREATE INDEX users_user_email_trgm ON users_user USING gin ((UPPER(email::text)) gin_trgm_ops)",
+]
+
+POSTGRES_REVERSE_SQL = [
+    "DROP INDEX IF EXISTS users_user_email_trgm",
+]
+
+
+def run_postgres_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            # на SQLite триграммный индекс создаётся в post_migrate (users.apps)
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_auto_20231224_1552'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(
+            run_postgres_sql(POSTGRES_FORWARD_SQL),
+            run_postgres_sql(POSTGRES_REVERSE_SQL),
+        ),
+    ]
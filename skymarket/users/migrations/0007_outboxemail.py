@@ -0,0 +1,43 @@
+# Generated by Django 3.2.6 on 2026-10-18 14:15
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_email_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=998, verbose_name='subject')),
+                ('body', models.TextField(blank=True, verbose_name='body')),
+                ('from_email', models.CharField(max_length=254, verbose_name='from')),
+                ('to', models.JSONField(default=list, verbose_name='to')),
+                ('cc', models.JSONField(default=list, verbose_name='cc')),
+                ('bcc', models.JSONField(default=list, verbose_name='bcc')),
+                ('reply_to', models.JSONField(default=list, verbose_name='reply to')),
+                ('alternatives', models.JSONField(default=list, verbose_name='alternatives')),
+                ('headers', models.JSONField(default=dict, verbose_name='headers')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=7, verbose_name='status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='next attempt at')),
+                ('last_error', models.TextField(blank=True, verbose_name='last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Outbox email',
+                'verbose_name_plural': 'Outbox emails',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='users_outbox_due_idx'),
+        ),
+    ]
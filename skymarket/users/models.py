@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
+from django.utils import timezone
 from users.managers import UserManager
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils.translation import gettext_lazy as _
@@ -52,3 +53,39 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+
+class OutboxStatus(models.TextChoices):
+    pending = 'pending', _('pending')
+    sent = 'sent', _('sent')
+    failed = 'failed', _('failed')
+
+
+class OutboxEmail(models.Model):
+    """Письмо, ожидающее отправки воркером send_outbox_emails (см. users/outbox.py)."""
+    subject = models.CharField(max_length=998, verbose_name='subject')
+    body = models.TextField(verbose_name='body', blank=True)
+    from_email = models.CharField(max_length=254, verbose_name='from')
+    to = models.JSONField(default=list, verbose_name='to')
+    cc = models.JSONField(default=list, verbose_name='cc')
+    bcc = models.JSONField(default=list, verbose_name='bcc')
+    reply_to = models.JSONField(default=list, verbose_name='reply to')
+    alternatives = models.JSONField(default=list, verbose_name='alternatives')
+    headers = models.JSONField(default=dict, verbose_name='headers')
+    status = models.CharField(max_length=7, choices=OutboxStatus.choices,
+                              default=OutboxStatus.pending, verbose_name='status')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='attempts')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='next attempt at')
+    last_error = models.TextField(blank=True, verbose_name='last error')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(**NULLABLE)
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.to)}'
+
+    class Meta:
+        verbose_name = 'Outbox email'
+        verbose_name_plural = 'Outbox emails'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='users_outbox_due_idx'),
+        ]
@@ -0,0 +1,143 @@
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import OutboxEmail, OutboxStatus
+
+# Почта отправляется через outbox: запрос (регистрация, смена пароля) только
+# пишет письмо в таблицу, а воркер `manage.py send_outbox_emails` отправляет
+# накопленные письма пачками через одно SMTP-соединение. Так время ответа
+# API не зависит от почтового сервера.
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """EMAIL_BACKEND, который сохраняет письма в OutboxEmail вместо отправки."""
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        OutboxEmail.objects.bulk_create([message_to_outbox(message) for message in email_messages])
+        return len(email_messages)
+
+
+def message_to_outbox(message):
+    if message.attachments:
+        raise ValueError('Attachments are not supported by the email outbox')
+
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        alternatives=[list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        headers=message.extra_headers,
+    )
+
+
+def outbox_to_message(email, connection):
+    return EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        alternatives=[tuple(alternative) for alternative in email.alternatives],
+        headers=email.headers,
+        connection=connection,
+    )
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повторной попыткой: base * 2^(attempts - 1), не больше max."""
+    delay = settings.EMAIL_OUTBOX_RETRY_BASE * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_RETRY_MAX))
+
+
+def open_connection(connection):
+    # если сервер недоступен, ошибку получит каждое письмо при отправке и уйдёт на повтор
+    try:
+        connection.open()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+def claim_batch(batch_size):
+    """
+    Забирает пачку готовых к отправке писем в короткой транзакции.
+
+    Строки блокируются (SKIP LOCKED) только на время выборки: письмам сразу
+    засчитывается попытка и переносится next_attempt_at на
+    EMAIL_OUTBOX_CLAIM_TIMEOUT, поэтому другие воркеры их не возьмут, а если
+    воркер упадёт, письма вернутся в очередь по истечении этого срока.
+    """
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxStatus.pending, next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        claimed_until = timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt_at = claimed_until
+        OutboxEmail.objects.bulk_update(emails, ['attempts', 'next_attempt_at'])
+    return emails
+
+
+def send_batch(batch_size=None, connection=None):
+    """
+    Отправляет одну пачку готовых к отправке писем.
+
+    Все письма пачки уходят через одно SMTP-соединение уже вне транзакции,
+    а результат каждого письма сохраняется сразу после его отправки.
+    Возвращает пару (отправлено, с ошибкой).
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    connection = connection or get_connection(settings.EMAIL_OUTBOX_BACKEND)
+    sent = failed = 0
+
+    emails = claim_batch(batch_size)
+    if not emails:
+        return sent, failed
+
+    open_connection(connection)
+    try:
+        for email in emails:
+            try:
+                outbox_to_message(email, connection).send()
+            except (smtplib.SMTPException, OSError) as exc:
+                failed += 1
+                email.last_error = f'{type(exc).__name__}: {exc}'
+                if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    email.status = OutboxStatus.failed
+                else:
+                    email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+                # после обрыва соединения следующее письмо пойдёт через новое
+                if isinstance(exc, smtplib.SMTPServerDisconnected):
+                    connection.close()
+                    open_connection(connection)
+            except Exception as exc:
+                # ошибка не почтового сервера, а самого письма: повтор не поможет
+                failed += 1
+                email.status = OutboxStatus.failed
+                email.last_error = f'{type(exc).__name__}: {exc}'
+            else:
+                sent += 1
+                email.status = OutboxStatus.sent
+                email.sent_at = timezone.now()
+                email.last_error = ''
+            email.save(update_fields=['status', 'next_attempt_at', 'last_error', 'sent_at'])
+    finally:
+        connection.close()
+
+    return sent, failed
@@ -0,0 +1,70 @@
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from users.models import User
+
+# Поиск пользователей по подстроке email с опорой на триграммный индекс.
+# На PostgreSQL icontains (UPPER(email) LIKE UPPER('%...%')) обслуживает
+# GIN-индекс users_user_email_trgm, на SQLite - FTS5-таблица с токенайзером trigram.
+
+SQLITE_EMAIL_TABLE = 'users_user_email_trgm'
+TRIGRAM_LENGTH = 3
+
+SQLITE_EMAIL_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_EMAIL_TABLE} USING fts5(
+        email, content='users_user', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_EMAIL_TABLE}_ai AFTER INSERT ON users_user BEGIN
+        INSERT INTO {SQLITE_EMAIL_TABLE}(rowid, email) VALUES (new.id, new.email);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_EMAIL_TABLE}_ad AFTER DELETE ON users_user BEGIN
+        INSERT INTO {SQLITE_EMAIL_TABLE}({SQLITE_EMAIL_TABLE}, rowid, email) VALUES ('delete', old.id, old.email);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_EMAIL_TABLE}_au AFTER UPDATE OF email ON users_user BEGIN
+        INSERT INTO {SQLITE_EMAIL_TABLE}({SQLITE_EMAIL_TABLE}, rowid, email) VALUES ('delete', old.id, old.email);
+        INSERT INTO {SQLITE_EMAIL_TABLE}(rowid, email) VALUES (new.id, new.email);
+    END
+    """,
+]
+
+
+def ensure_sqlite_email_index(using):
+    """Создаёт на SQLite триграммный FTS5-индекс email и триггеры синхронизации."""
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{SQLITE_EMAIL_TABLE}_a%'],
+        )
+        if cursor.fetchone()[0] == 3:
+            return
+
+        for statement in SQLITE_EMAIL_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {SQLITE_EMAIL_TABLE}({SQLITE_EMAIL_TABLE}) VALUES ('rebuild')")
+
+
+def users_with_email_containing(value, using='default'):
+    """Возвращает queryset пользователей, в email которых есть подстрока `value` (без учёта регистра)."""
+    users = User.objects.using(using)
+
+    # строку короче одной триграммы индекс не ускорит
+    if connections[using].vendor != 'sqlite' or len(value) < TRIGRAM_LENGTH:
+        return users.filter(email__icontains=value)
+
+    phrase = '"{}"'.format(value.replace('"', '""'))
+    matched_ids = RawSQL(
+        f'SELECT rowid FROM {SQLITE_EMAIL_TABLE} WHERE {SQLITE_EMAIL_TABLE} MATCH %s',
+        [phrase],
+    )
+    return users.filter(id__in=matched_ids)
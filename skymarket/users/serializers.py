@@ -1,7 +1,11 @@
 from djoser.serializers import UserCreateSerializer as BaseUserRegistrationSerializer, UserSerializer
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth import get_user_model
 
+from users.blacklist import BloomRefreshToken
+
 User = get_user_model()
 # Здесь нам придется переопределить сериалайзер, который использует djoser
 # для создания пользователя из за того, что у нас имеются нестандартные поля
@@ -17,3 +21,22 @@ class CurrentUserSerializer(serializers.ModelSerializer):
     class Meta(UserSerializer.Meta):
         model = User
         fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'role')
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    # тот же TokenRefreshSerializer, но чёрный список проверяется через фильтр Блума
+    def validate(self, attrs):
+        refresh = BloomRefreshToken(attrs['refresh'])
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+
+            data['refresh'] = str(refresh)
+
+        return data
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from users.authentication import bump_user_version
+from users.blacklist import blacklist_changed
+from users.models import User
+
+@receiver(post_save, sender=User)
+def invalidate_changed_user(sender, instance, created, **kwargs):
+    # закэшированный пользователь отдаётся как request.user, поэтому устаревает
+    # при изменении любого поля, а не только влияющих на аутентификацию
+    if not created:
+        bump_user_version(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def sync_blacklist_filter(sender, created, **kwargs):
+    if created:
+        blacklist_changed()
@@ -1,8 +1,29 @@
+import json
+import socketserver
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
-from users.models import User
+from ads.models import Ad, Comment
+from users.authentication import get_user_version, stats as auth_stats, token_user_cache
+from users.blacklist import BloomFilter, blacklist_filter
+from users.loading import iter_json_array, load_fixture
+from users.management.commands.seed import allocate, chunk_share
+from users.models import OutboxEmail, OutboxStatus, User, UserRoles
+from users.outbox import outbox_to_message, retry_delay, send_batch
 
 
 class GetUsersTestCase(APITestCase):
@@ -228,6 +249,56 @@ class ActivateUserTestCase(APITestCase):
             status.HTTP_204_NO_CONTENT
         )
 
+    def test_activate_by_get_without_http_call(self):
+        self.client.post(
+            self.users_url,
+            self.user
+        )
+
+        email_lines = mail.outbox[0].body.splitlines()
+        activation_link = [l for l in email_lines if '/activate/' in l][0]
+        uid, token = activation_link.split('/')[-2:]
+
+        with mock.patch('requests.adapters.HTTPAdapter.send') as http_send:
+            response = self.client.get(f'/users/activate/{uid}/{token}')
+            repeated_response = self.client.get(f'/users/activate/{uid}/{token}')
+
+        http_send.assert_not_called()
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_204_NO_CONTENT
+        )
+        self.assertTrue(User.objects.get(email=self.user['email']).is_active)
+
+        self.assertEqual(
+            repeated_response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(
+            repeated_response.json(),
+            {'detail': 'Stale token for given user.'}
+        )
+
+    def test_activate_by_get_invalid_token(self):
+        self.client.post(
+            self.users_url,
+            self.user
+        )
+        uid = [l for l in mail.outbox[0].body.splitlines() if '/activate/' in l][0].split('/')[-2]
+
+        response = self.client.get(f'/users/activate/{uid}/wrong-token')
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(
+            response.json(),
+            {'token': ['Invalid token for given user.']}
+        )
+        self.assertFalse(User.objects.get(email=self.user['email']).is_active)
+
 
 class GetUserMeTestCase(APITestCase):
     def setUp(self):
@@ -862,3 +933,459 @@ class ResetConfirmPasswordTestCase(APITestCase):
             response.status_code,
             status.HTTP_204_NO_CONTENT
         )
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-сервер для тестов: принимает письма и запоминает их."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line.split(' ', 1)[0].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == 'EHLO':
+                self.reply('250 localhost')
+            elif command == 'RCPT' and 'reject' in line:
+                self.reply('550 Mailbox unavailable')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (data_line := self.rfile.readline().decode()) != '.\r\n':
+                    data.append(data_line)
+                self.server.messages.append(''.join(data))
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class EmailOutboxTestCase(APITestCase):
+    def setUp(self):
+        self.smtp = FakeSMTPServer()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.addCleanup(self.smtp.server_close)
+        self.addCleanup(self.smtp.shutdown)
+
+        smtp_settings = override_settings(
+            EMAIL_OUTBOX_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.smtp.server_address[1],
+            EMAIL_USE_SSL=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+        )
+        smtp_settings.enable()
+        self.addCleanup(smtp_settings.disable)
+
+    @override_settings(EMAIL_BACKEND='users.outbox.OutboxEmailBackend')
+    def test_registration_email_goes_to_outbox(self):
+        response = self.client.post(
+            'http://localhost:8000/users/',
+            {
+                'email': 'test@mail.com',
+                'password': '123qwe456rty',
+                're_password': '123qwe456rty'
+            }
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED
+        )
+        self.assertEqual(self.smtp.messages, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['test@mail.com'])
+        self.assertIn('/activate/', email.body)
+
+        call_command('send_outbox_emails', stdout=StringIO())
+
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assertIn('test@mail.com', self.smtp.messages[0])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxStatus.sent)
+
+    def test_batch_reuses_one_connection(self):
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(subject=f'Subject {i}', body='body', from_email='noreply@mail.com', to=[f'user{i}@mail.com'])
+            for i in range(5)
+        ])
+
+        sent, failed = send_batch(batch_size=10)
+
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(len(self.smtp.messages), 5)
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        ok = OutboxEmail.objects.create(subject='ok', from_email='noreply@mail.com', to=['user@mail.com'])
+        rejected = OutboxEmail.objects.create(subject='rejected', from_email='noreply@mail.com', to=['reject@mail.com'])
+
+        sent, failed = send_batch()
+
+        self.assertEqual((sent, failed), (1, 1))
+        ok.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual(ok.status, OutboxStatus.sent)
+        self.assertEqual(rejected.status, OutboxStatus.pending)
+        self.assertEqual(rejected.attempts, 1)
+        self.assertGreater(rejected.next_attempt_at, timezone.now())
+        self.assertIn('SMTPRecipientsRefused', rejected.last_error)
+
+        # до истечения задержки письмо не берётся повторно
+        self.assertEqual(send_batch(), (0, 0))
+
+        with override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2):
+            OutboxEmail.objects.filter(pk=rejected.pk).update(next_attempt_at=timezone.now())
+            send_batch()
+
+        rejected.refresh_from_db()
+        self.assertEqual(rejected.status, OutboxStatus.failed)
+        self.assertEqual(retry_delay(1), timedelta(seconds=30))
+        self.assertEqual(retry_delay(20), timedelta(hours=1))
+
+    def test_batch_is_sent_outside_claim_transaction(self):
+        ok = OutboxEmail.objects.create(subject='ok', from_email='noreply@mail.com', to=['user@mail.com'])
+        broken = OutboxEmail.objects.create(subject='broken', from_email='noreply@mail.com', to=['user@mail.com'])
+        after = OutboxEmail.objects.create(subject='after', from_email='noreply@mail.com', to=['user@mail.com'])
+        claimed = []
+
+        def to_message(email, connection):
+            # пока пачка отправляется, её письма уже не видны другим воркерам
+            claimed.append(OutboxEmail.objects.filter(status=OutboxStatus.pending, next_attempt_at__lte=timezone.now()).count())
+            if email.subject == 'broken':
+                raise ValueError('bad header')
+            return outbox_to_message(email, connection)
+
+        with mock.patch('users.outbox.outbox_to_message', side_effect=to_message):
+            self.assertEqual(send_batch(), (2, 1))
+
+        self.assertEqual(claimed, [0, 0, 0])
+        self.assertEqual(len(self.smtp.messages), 2)
+        for email in (ok, broken, after):
+            email.refresh_from_db()
+        self.assertEqual((ok.status, after.status), (OutboxStatus.sent, OutboxStatus.sent))
+        # письмо с необрабатываемой ошибкой не откатывает уже отправленные и не уходит на повтор
+        self.assertEqual((broken.status, broken.attempts), (OutboxStatus.failed, 1))
+        self.assertEqual(broken.last_error, 'ValueError: bad header')
+        self.assertEqual(send_batch(), (0, 0))
+
+    def test_unreachable_server(self):
+        email = OutboxEmail.objects.create(subject='ok', from_email='noreply@mail.com', to=['user@mail.com'])
+
+        with override_settings(EMAIL_PORT=1):
+            self.assertEqual(send_batch(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxStatus.pending, 1))
+
+
+@override_settings(CACHE_SHARED=True)
+class CachedJWTAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        self.users_me_url = 'http://127.0.0.1:8000/users/me/'
+        self.user = User.objects.create(
+            email='test0@mail.com',
+            password='123qwe456rty'
+        )
+        self.token = str(AccessToken.for_user(self.user))
+        token_user_cache.clear()
+        self.addCleanup(token_user_cache.clear)
+        cache.clear()
+
+    def get_me(self, token=None):
+        return self.client.get(
+            self.users_me_url,
+            HTTP_AUTHORIZATION=f'Bearer {token or self.token}'
+        )
+
+    def test_repeated_requests_skip_user_query(self):
+        self.assertEqual(self.get_me().status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.get_me()
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(
+            response.json()['email'],
+            self.user.email
+        )
+
+        token_user_cache.flush_stats()
+        self.assertEqual(auth_stats(), {'hits': 1, 'misses': 1})
+        out = StringIO()
+        call_command('auth_cache_stats', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'hits=1 misses=1 hit_ratio=50.00%')
+
+    def test_deactivated_user_is_rejected(self):
+        self.get_me()
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(
+            self.get_me().status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_role_and_password_changes_invalidate(self):
+        self.get_me()
+        self.user.role = UserRoles.admin
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.get_me()
+
+        self.user.set_password('new-password')
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.get_me()
+
+    def test_profile_change_is_visible(self):
+        self.get_me()
+
+        response = self.client.patch(
+            self.users_me_url,
+            {'first_name': 'Ivan'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(
+            self.get_me().json()['first_name'],
+            'Ivan'
+        )
+
+    def test_evicted_version_does_not_restart(self):
+        self.get_me()
+        version = get_user_version(self.user.pk)
+
+        # версия вытеснена из кэша: новая не совпадает со старыми номерами
+        cache.delete(f'auth:user:{self.user.pk}:version')
+        self.assertNotEqual(get_user_version(self.user.pk), version)
+
+        with self.assertNumQueries(1):
+            self.get_me()
+
+    @override_settings(CACHE_SHARED=None)
+    def test_disabled_for_process_local_cache(self):
+        self.get_me()
+
+        with self.assertNumQueries(1):
+            self.get_me()
+
+        self.assertEqual(token_user_cache.entries, {})
+
+    def test_forged_token_with_cached_jti_is_verified(self):
+        self.get_me()
+        header, payload, signature = self.token.split('.')
+        forged = f'{header}.{payload}.{signature[::-1]}'
+
+        self.assertEqual(
+            self.get_me(forged).status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+        self.assertEqual(
+            self.get_me().status_code,
+            status.HTTP_200_OK
+        )
+
+    def test_cache_is_bounded(self):
+        with mock.patch.object(token_user_cache, 'max_size', 2):
+            tokens = [str(AccessToken.for_user(self.user)) for _ in range(3)]
+            for token in tokens:
+                self.get_me(token)
+
+            self.assertEqual(len(token_user_cache.entries), 2)
+            self.assertNotIn(AccessToken(tokens[0])['jti'], token_user_cache.entries)
+
+
+@override_settings(CACHE_SHARED=True)
+class TokenBlacklistTestCase(APITestCase):
+    def setUp(self):
+        self.refresh_url = 'http://127.0.0.1:8000/jwt/refresh/'
+        self.user = User.objects.create(
+            email='test0@mail.com',
+            password='123qwe456rty'
+        )
+        cache.clear()
+        blacklist_filter.reset()
+
+    def refresh(self, token):
+        return self.client.post(self.refresh_url, {'refresh': str(token)})
+
+    def test_refresh_skips_blacklist_query(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+
+        with self.assertNumQueries(0):
+            response = self.refresh(token)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertIn('access', response.json())
+
+    def test_blacklisted_token_is_rejected(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_200_OK)
+
+        token.blacklist()
+        response = self.refresh(token)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+        self.assertEqual(
+            response.json()['detail'],
+            'Token is blacklisted'
+        )
+
+    @override_settings(CACHE_SHARED=None)
+    def test_process_local_cache_checks_database(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+
+        with self.assertNumQueries(1):
+            response = self.refresh(token)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+        # отзыв через другой воркер: сигнал до этого процесса не доходит
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get(jti=token['jti']))])
+        self.assertEqual(
+            self.refresh(token).status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f'jti-{i}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    def test_purge_expired_tokens(self):
+        expired = []
+        for _ in range(5):
+            token = RefreshToken.for_user(self.user)
+            token.blacklist()
+            expired.append(token['jti'])
+        alive = RefreshToken.for_user(self.user)
+        alive.blacklist()
+        OutstandingToken.objects.filter(jti__in=expired).update(expires_at=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('purge_expired_tokens', batch_size=2, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Purged 5 outstanding and 5 blacklisted tokens')
+        self.assertEqual(
+            list(OutstandingToken.objects.values_list('jti', flat=True)),
+            [alive['jti']]
+        )
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(
+            self.refresh(alive).status_code,
+            status.HTTP_401_UNAUTHORIZED
+        )
+
+
+class SeedCommandTestCase(APITestCase):
+    def test_seed(self):
+        out = StringIO()
+        call_command('seed', users=20, ads=50, comments=200, batch_size=15, seed=1, stdout=out)
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Ad.objects.count(), 50)
+        # пачки делят комментарии независимо, но в сумме ровно --comments
+        self.assertEqual(Comment.objects.count(), 200)
+        self.assertEqual(
+            Comment.objects.count(),
+            Ad.objects.aggregate(total=Sum('comments_count'))['total']
+        )
+        self.assertIn('Seeded 20 users, 50 ads', out.getvalue())
+
+        # счётчики комментариев согласованы без отдельного пересчёта
+        out = StringIO()
+        call_command('reconcile_comment_counts', dry_run=True, stdout=out)
+        self.assertIn('drifted 0', out.getvalue())
+
+        # повторный запуск дописывает данные после существующих id
+        call_command('seed', users=5, ads=5, comments=0, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 25)
+        self.assertEqual(Ad.objects.filter(author__in=User.objects.order_by('-id')[:5]).count(), 5)
+
+
+    def test_allocate(self):
+        self.assertEqual(allocate(10, [1, 1, 1]), [4, 3, 3])
+        self.assertEqual(allocate(7, [0.2, 5.3, 0.01, 1.7]), [0, 5, 0, 2])
+        self.assertEqual(allocate(0, [1, 2]), [0, 0])
+        self.assertEqual(sum(chunk_share(200, start, min(15, 50 - start), 50) for start in range(0, 50, 15)), 200)
+
+
+class LoadFixturesTestCase(APITestCase):
+    def test_iter_json_array_reads_in_chunks(self):
+        items = [{'pk': i, 'text': 'объявление ' * i} for i in range(20)] + [12345, 'строка', [1, 2]]
+        stream = StringIO(json.dumps(items, ensure_ascii=False, indent=2))
+
+        self.assertEqual(list(iter_json_array(stream, read_size=7)), items)
+        self.assertEqual(list(iter_json_array(StringIO(' [ ] '))), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(StringIO('[{"pk": 1}, {"pk": 2}'), read_size=5))
+
+    def test_loadall(self):
+        out = StringIO()
+        call_command('loadall', batch_size=4, stdout=out)
+        call_command('loadall', stdout=StringIO())
+
+        self.assertIn('Installed 31 objects from 3 fixtures', out.getvalue())
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Ad.objects.count(), 13)
+        self.assertEqual(Comment.objects.count(), 13)
+        # даты из фикстуры не подменяются auto_now_add
+        self.assertEqual(Ad.objects.get(pk=1).created_at.year, 2022)
+        # в фикстурах нет updated_at: он берётся из created_at, а не остаётся NULL
+        self.assertFalse(Comment.objects.filter(updated_at__isnull=True).exists())
+        comment = Comment.objects.get(pk=1)
+        self.assertEqual(comment.updated_at, comment.created_at)
+
+        out = StringIO()
+        call_command('reconcile_comment_counts', dry_run=True, stdout=out)
+        self.assertIn('Checked 13 ads, drifted 0', out.getvalue())
+
+    def test_missing_foreign_key(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8') as fixture:
+            json.dump([{'model': 'ads.ad', 'pk': 1, 'fields': {'title': 'Диван', 'author': 42}}], fixture)
+            fixture.flush()
+
+            with self.assertRaisesMessage(ValueError, 'ads.ad: author references missing users.user [42]'):
+                load_fixture(fixture.name)
+
+        self.assertFalse(Ad.objects.exists())
@@ -1,9 +1,9 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from djoser.views import UserViewSet
 from rest_framework.routers import SimpleRouter
 from users.apps import UsersConfig
 
-from users.views import ActivateUserByGet
+from users.views import ActivateUserByGet, TokenRefreshView
 
 app_name = UsersConfig.name
 
@@ -13,5 +13,7 @@ users_router.register("users", UserViewSet, basename="users")
 
 urlpatterns = [
     path('', include(users_router.urls)),
-    path('users/activate/<str:uid>/<str:token>', ActivateUserByGet.as_view())
+    path('users/activate/<str:uid>/<str:token>', ActivateUserByGet.as_view()),
+    # перекрывает jwt/refresh/ из djoser.urls.jwt
+    re_path(r"^jwt/refresh/?", TokenRefreshView.as_view(), name="jwt-refresh"),
 ]
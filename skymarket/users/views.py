@@ -1,22 +1,53 @@
-import requests
+from django.contrib.auth.tokens import default_token_generator
+from djoser import signals
+from djoser.compat import get_user_email
+from djoser.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
+
+from users.serializers import TokenRefreshSerializer
 
 
 class ActivateUserByGet(APIView):
+    """
+    Активация по ссылке из письма.
+
+    Повторяет djoser UserViewSet.activation внутри процесса, без HTTP-запроса
+    к собственному /users/activation/: такой запрос занимал второй воркер и
+    блокировал однопоточный runserver.
+    """
     permission_classes = [AllowAny]
+    token_generator = default_token_generator
 
     def get(self, request, uid, token):
-        payload = {'uid': uid, 'token': token}
+        serializer = settings.SERIALIZERS.activation(
+            data={'uid': uid, 'token': token},
+            context={'request': request, 'view': self},
+        )
+        try:
+            serializer.is_valid(raise_exception=True)
+        except (ValidationError, PermissionDenied) as exc:
+            # ошибки отдаются с кодом 200, как и раньше при проксировании ответа djoser
+            detail = exc.detail if isinstance(exc, ValidationError) else {'detail': exc.detail}
+            return Response(detail)
+
+        user = serializer.user
+        user.is_active = True
+        user.save()
+
+        signals.user_activated.send(sender=self.__class__, user=user, request=request)
+
+        if settings.SEND_CONFIRMATION_EMAIL:
+            context = {'user': user}
+            to = [get_user_email(user)]
+            settings.EMAIL.confirmation(request, context).send(to)
 
-        protocol = 'https://' if request.is_secure() else 'http://'
-        web_url = protocol + request.get_host()
-        post_url = web_url + '/users/activation/'
+        return Response({'detail': 'User was successful activated'}, status.HTTP_204_NO_CONTENT)
 
-        response = requests.post(post_url, data=payload)
 
-        if response.status_code == 204:
-            return Response({'detail': 'User was successful activated'}, response.status_code)
-        else:
-            return Response(response.json())
+class TokenRefreshView(BaseTokenRefreshView):
+    serializer_class = TokenRefreshSerializer